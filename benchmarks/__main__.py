@@ -0,0 +1,232 @@
+"""
+Benchmarks for the plugin's own overhead, run against the local emulator so results don't depend on the network.
+
+    python -m benchmarks [--json results.json] [--compare previous.json] [--only name ...]
+
+Each benchmark reports p50 and p99 timings, and some report other measurements such as memory per log event,
+--json saves results so a later run can be compared with --compare.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from pytest_cloudflare_worker import TestClient, deploy
+from pytest_cloudflare_worker.emulator import Console, Emulator, WorkerRequest, WorkerResponse
+from pytest_cloudflare_worker.inspect import Inspector, LogMsg
+from pytest_cloudflare_worker.logs import LogStore
+
+ROOT_DIR = Path(__file__).parent.parent
+# timings, optionally with other measurements which are reported and compared alongside them
+Result = Union[List[float], Tuple[List[float], Dict[str, float]]]
+benchmarks: Dict[str, Callable[[Emulator], Result]] = {}
+
+
+def benchmark(func: Callable[[Emulator], Result]) -> Callable[[Emulator], Result]:
+    benchmarks[func.__name__.strip('_')] = func
+    return func
+
+
+def empty_worker(request: WorkerRequest, env: Dict[str, Any], console: Console) -> WorkerResponse:
+    return WorkerResponse('ok')
+
+
+def console_event(i: int) -> Dict[str, Any]:
+    params = {
+        'type': 'log',
+        'args': [
+            {'type': 'string', 'value': 'handling request:'},
+            {'type': 'string', 'value': 'GET'},
+            {'type': 'string', 'value': f'/path/{i}'},
+        ],
+        'executionContextId': 1,
+        'timestamp': 1600000000000 + i,
+        'stackTrace': {
+            'callFrames': [
+                {'functionName': 'handle', 'scriptId': '1', 'url': 'worker.js', 'lineNumber': 6, 'columnNumber': 10},
+                {'functionName': '', 'scriptId': '1', 'url': 'worker.js', 'lineNumber': 0, 'columnNumber': 40},
+            ]
+        },
+    }
+    return {'method': 'Runtime.consoleAPICalled', 'params': params}
+
+
+def timed(func: Callable[[], Any], iterations: int, warmup: int = 5) -> List[float]:
+    for _ in range(warmup):
+        func()
+    times = []
+    for _ in range(iterations):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+    return times
+
+
+def emulator_client(emulator: Emulator, **kwargs: Any) -> TestClient:
+    return TestClient(root=emulator.root, inspect_root=emulator.inspect_root, **kwargs)
+
+
+@benchmark
+def deploy_(emulator: Emulator) -> List[float]:
+    """
+    deploy() end to end: build (a javascript worker, so no wrangler build), bindings and multipart upload.
+    """
+    with emulator_client(emulator) as client:
+        return timed(
+            lambda: deploy(ROOT_DIR / 'example', authenticate=False, test_client=client, preview_root=emulator.root),
+            100,
+        )
+
+
+@benchmark
+def request(emulator: Emulator) -> List[float]:
+    """
+    TestClient.request() per call on a keep-alive connection, including fake_host rewriting and cookie routing,
+    compare with request_direct for the client's overhead.
+    """
+    with emulator_client(emulator) as client:
+        client.preview_id, _ = deploy(ROOT_DIR / 'example', authenticate=False, preview_root=emulator.root)
+        client.inspect_enabled = False
+        return timed(lambda: client.get('https://example.com/foo'), 500)
+
+
+@benchmark
+def request_inspect(emulator: Emulator) -> List[float]:
+    """
+    Sequential requests as "request" but with the client's default settings, so inspect is enabled and each request
+    starts its logs once the previous request's logs have settled.
+    """
+    with emulator_client(emulator) as client:
+        client.preview_id, _ = deploy(ROOT_DIR / 'example', authenticate=False, preview_root=emulator.root)
+        return timed(lambda: client.get('https://example.com/foo'), 500)
+
+
+@benchmark
+def request_direct(emulator: Emulator) -> List[float]:
+    """
+    The same request as "request" made directly with requests.Session.request().
+    """
+    with emulator_client(emulator) as client:
+        client.preview_id, _ = deploy(ROOT_DIR / 'example', authenticate=False, preview_root=emulator.root)
+        cookies = {'__ew_fiddle_preview': f'{client.preview_id}{client._session_id}1example.com'}
+        return timed(lambda: client.direct_request('GET', f'{emulator.root}/foo', cookies=cookies), 500)
+
+
+@benchmark
+def prepare_request(emulator: Emulator) -> List[float]:
+    """
+    Path rewriting and cookie generation alone.
+    """
+    client = emulator_client(emulator, preview_id='a' * 32)
+    return timed(lambda: client._prepare_request('https://example.com/foo/bar', {}), 2000)
+
+
+@benchmark
+def inspect_handshake(emulator: Emulator) -> List[float]:
+    """
+    Time from starting an inspect connection to the end of the inspect_start_msgs handshake.
+    """
+    inspectors = []
+
+    def connect():
+        inspector = Inspector(session_id=f'handshake-{len(inspectors)}', log=LogStore(), root=emulator.inspect_root)
+        inspector.start()
+        inspector.ready.wait(2)
+        inspectors.append(inspector)
+
+    times = timed(connect, 100)
+    for inspector in inspectors:
+        inspector.stop()
+    return times
+
+
+@benchmark
+def log_latency(emulator: Emulator) -> List[float]:
+    """
+    Time from an event being sent by the inspect websocket to inspect_log_wait() returning it.
+    """
+    with emulator_client(emulator) as client:
+        client.preview_id = 'a' * 32
+        client._wait_inspect_ready()
+        session_id = client._session_id
+
+        def emit_and_wait():
+            count = len(client.inspect_logs) + 1
+            emulator.emit(session_id, console_event(count))
+            client.inspect_log_wait(count)
+
+        return timed(emit_and_wait, 500)
+
+
+@benchmark
+def log_ingest(emulator: Emulator) -> Result:
+    """
+    LogMsg.from_raw for raw console events, timed per batch of 1000, so divide by 1000 for the per event time.
+    Also the memory held per event, measured with tracemalloc, once 100k events have been ingested into a LogStore.
+    """
+    raw_msgs = [json.dumps(console_event(i)) for i in range(100_000)]
+    times = timed(lambda: [LogMsg.from_raw(json.loads(raw), raw) for raw in raw_msgs[:1000]], 100, warmup=2)
+
+    tracemalloc.start()
+    logs = LogStore()
+    for raw in raw_msgs:
+        logs.append(LogMsg.from_raw(json.loads(raw), raw))
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return times, {'bytes_per_event': memory / len(logs)}
+
+
+def summarise(times: List[float]) -> Dict[str, float]:
+    times = sorted(times)
+    return {
+        'n': len(times),
+        'p50': statistics.median(times),
+        'p99': times[max(int(len(times) * 0.99) - 1, 0)],
+        'mean': statistics.mean(times),
+    }
+
+
+def git_commit() -> Optional[str]:
+    p = subprocess.run(('git', 'rev-parse', '--short', 'HEAD'), cwd=ROOT_DIR, capture_output=True, text=True)
+    return p.stdout.strip() or None
+
+
+def fmt(seconds: float) -> str:
+    return f'{seconds * 1e6:9.1f}µs' if seconds < 1e-3 else f'{seconds * 1e3:9.2f}ms'
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--json', type=Path, help='save results to this file')
+    parser.add_argument('--compare', type=Path, help='compare with results saved by a previous run')
+    parser.add_argument('--only', nargs='+', choices=list(benchmarks), help='only run these benchmarks')
+    args = parser.parse_args(argv)
+
+    previous = json.loads(args.compare.read_text())['results'] if args.compare else {}
+    results = {}
+    with Emulator(empty_worker) as emulator:
+        for name in args.only or benchmarks:
+            result = benchmarks[name](emulator)
+            times, extra = result if isinstance(result, tuple) else (result, {})
+            results[name] = r = {**summarise(times), **extra}
+            line = f'{name:>18}: p50 {fmt(r["p50"])}  p99 {fmt(r["p99"])}  (n={r["n"]})'
+            line += ''.join(f'  {key} {value:,.0f}' for key, value in extra.items())
+            if name in previous:
+                changes = {key: r[key] / previous[name][key] - 1 for key in ('p50', *extra) if key in previous[name]}
+                line += ''.join(f'  {key} {change:+.1%}' for key, change in changes.items()) + f' vs {args.compare}'
+            print(line, flush=True)
+
+    if args.json:
+        args.json.write_text(json.dumps({'commit': git_commit(), 'results': results}, indent=2))
+        print(f'results saved to {args.json}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,43 @@
-from .main import TestClient, WorkerError, deploy
+from importlib import import_module
+from typing import TYPE_CHECKING, Any
+
 from .version import VERSION
 
+if TYPE_CHECKING:
+    from .async_client import AsyncTestClient
+    from .load import LoadResult
+    from .main import StalePreviewError, TestClient, WorkerError, deploy
+    from .transport import RequestTiming
+
 __version__ = VERSION
-__all__ = VERSION, 'TestClient', 'deploy', 'WorkerError'
+__all__ = (
+    VERSION,
+    'TestClient',
+    'AsyncTestClient',
+    'deploy',
+    'WorkerError',
+    'StalePreviewError',
+    'LoadResult',
+    'RequestTiming',
+)
+
+# exports are imported on first use, so loading the pytest plugin doesn't import requests, websockets or toml
+_lazy_imports = {
+    'AsyncTestClient': 'async_client',
+    'LoadResult': 'load',
+    'TestClient': 'main',
+    'WorkerError': 'main',
+    'StalePreviewError': 'main',
+    'deploy': 'main',
+    'RequestTiming': 'transport',
+}
+
+
+def __getattr__(name: str) -> Any:
+    try:
+        module_name = _lazy_imports[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(import_module(f'.{module_name}', __name__), name)
+    globals()[name] = value
+    return value
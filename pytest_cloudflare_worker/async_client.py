@@ -0,0 +1,158 @@
+import asyncio
+from time import perf_counter
+from typing import Any, List, Optional
+
+from .inspect import inspect_root
+from .main import (
+    BaseTestClient,
+    Binding,
+    StalePreviewError,
+    WorkerError,
+    preview_not_found,
+    resendable_body,
+    worker_root,
+)
+from .version import VERSION
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+__all__ = ('AsyncTestClient',)
+
+
+class AsyncTestClient(BaseTestClient):
+    """
+    asyncio equivalent of TestClient, built on httpx so many requests can be made concurrently over a bounded
+    pool of keep-alive connections.
+
+    The connection pool belongs to the event loop it was first used in, if the client is used from a different
+    event loop, a new pool is created.
+    """
+
+    __test__ = False
+
+    def __init__(
+        self,
+        *,
+        preview_id: Optional[str] = None,
+        bindings: List[Binding] = None,
+        fake_host: str = 'example.com',
+        inspect_pool_size: int = 0,
+        root: str = worker_root,
+        inspect_root: str = inspect_root,
+        max_connections: int = 100,
+        http2: bool = False,
+        transport: Optional['httpx.AsyncBaseTransport'] = None,
+        max_sessions: int = 4,
+    ):
+        if httpx is None:  # pragma: no cover
+            raise ImportError('httpx is required to use AsyncTestClient, run "pip install httpx"')
+        super().__init__(
+            preview_id=preview_id,
+            bindings=bindings,
+            fake_host=fake_host,
+            inspect_pool_size=inspect_pool_size,
+            root=root,
+            inspect_root=inspect_root,
+            max_sessions=max_sessions,
+        )
+        self.headers = {'user-agent': f'pytest-cloudflare-worker/{VERSION}'}
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.http2 = http2
+        self._transport = transport
+        self._http: Optional[httpx.AsyncClient] = None
+        self._http_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def http(self) -> 'httpx.AsyncClient':
+        loop = asyncio.get_running_loop()
+        if self._http is None or self._http_loop is not loop:
+            self._http = httpx.AsyncClient(
+                headers=self.headers, limits=self.limits, http2=self.http2, transport=self._transport
+            )
+            self._http_loop = loop
+        return self._http
+
+    async def direct_request(self, method: str, url: str, **kwargs: Any) -> 'httpx.Response':
+        return await self.http.request(method, url, **kwargs)
+
+    async def request(self, method: str, path: str, **kwargs: Any) -> 'httpx.Response':
+        url, _ = self._prepare_request(path, kwargs)
+        request_headers = kwargs.pop('headers', None)
+        headers = dict(request_headers or {})
+
+        loop = asyncio.get_running_loop()
+        # a concurrent request may get a session of its own, see BaseTestClient, without inspect nothing blocks
+        if self.inspect_enabled:
+            session, logs = await loop.run_in_executor(None, self._start_request)
+        else:
+            session, logs = self._start_request()
+        # cookies are set as a header since httpx deprecates per-request cookies
+        headers['cookie'] = '; '.join(f'{k}={v}' for k, v in self._session_cookies(session.session_id).items())
+        preview_id = self.preview_id
+        start = perf_counter()
+        try:
+            response = await self.http.request(method, url, headers=headers, **kwargs)
+        finally:
+            self._finish_request(session)
+        self.stats.record_request(perf_counter() - start)
+        response.logs = logs
+        # as BaseTestClient._check_stale_preview(), but redeploying blocks so it's run in an executor
+        if self.stale_preview_redeploy is not None or preview_id != self.preview_id:
+            if not preview_not_found(response):
+                self.stale_preview_redeploy = None
+            elif await loop.run_in_executor(None, self.redeploy_stale_preview, preview_id):
+                if not resendable_body(kwargs):
+                    raise StalePreviewError(preview_id)
+                return await self.request(method, path, headers=request_headers, **kwargs)
+        if response.status_code >= 500:
+            error_logs = [msg for msg in logs if msg.level == 'ERROR']
+            if not error_logs:
+                error_logs = await loop.run_in_executor(None, self._wait_for_error_logs, logs)
+            raise WorkerError(error_logs, overlapping=logs.overlapping)
+        return response
+
+    async def get(self, path: str, **kwargs: Any) -> 'httpx.Response':
+        return await self.request('GET', path, **kwargs)
+
+    async def options(self, path: str, **kwargs: Any) -> 'httpx.Response':
+        return await self.request('OPTIONS', path, **kwargs)
+
+    async def head(self, path: str, **kwargs: Any) -> 'httpx.Response':
+        return await self.request('HEAD', path, **kwargs)
+
+    async def post(self, path: str, **kwargs: Any) -> 'httpx.Response':
+        return await self.request('POST', path, **kwargs)
+
+    async def put(self, path: str, **kwargs: Any) -> 'httpx.Response':
+        return await self.request('PUT', path, **kwargs)
+
+    async def patch(self, path: str, **kwargs: Any) -> 'httpx.Response':
+        return await self.request('PATCH', path, **kwargs)
+
+    async def delete(self, path: str, **kwargs: Any) -> 'httpx.Response':
+        return await self.request('DELETE', path, **kwargs)
+
+    async def aclose(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(None, self._close_inspect)
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = self._http_loop = None
+
+    def close(self) -> None:
+        """
+        Close the client outside an event loop, the connection pool is closed if its event loop is still usable.
+        """
+        self._close_inspect()
+        if self._http is not None:
+            if not self._http_loop.is_closed() and not self._http_loop.is_running():
+                self._http_loop.run_until_complete(self._http.aclose())
+            self._http = self._http_loop = None
+
+    async def __aenter__(self) -> 'AsyncTestClient':
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.aclose()
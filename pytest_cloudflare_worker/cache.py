@@ -0,0 +1,196 @@
+import hashlib
+import json
+import os
+from fnmatch import fnmatch
+from pathlib import Path
+from time import time
+from typing import List, Optional, Sequence, Union
+
+__all__ = 'DeployCache', 'BuildCache'
+
+
+class DeployCache:
+    """
+    On-disk cache of preview ids, keyed by a hash of everything which is uploaded in a deploy, so unchanged
+    workers are not uploaded again while their preview is still fresh.
+    """
+
+    def __init__(self, cache_dir: Path, *, ttl: float = 1800):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+
+    @staticmethod
+    def key(url: str, script: Union[bytes, Path], metadata: str) -> str:
+        """
+        script may be a path, in which case it's hashed in chunks rather than read into memory.
+        """
+        h = hashlib.sha256()
+        for part in url.encode(), metadata.encode():
+            h.update(len(part).to_bytes(8, 'big'))
+            h.update(part)
+        if isinstance(script, Path):
+            with script.open('rb') as f:
+                h.update(os.fstat(f.fileno()).st_size.to_bytes(8, 'big'))
+                while chunk := f.read(65536):
+                    h.update(chunk)
+        else:
+            h.update(len(script).to_bytes(8, 'big'))
+            h.update(script)
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Get the preview_id for key, if it's in the cache and has not gone stale.
+        """
+        path = self._path(key)
+        try:
+            data = json.loads(path.read_text())
+        except (FileNotFoundError, ValueError):
+            return None
+
+        if time() - data['created'] > self.ttl:
+            self.invalidate(key)
+            return None
+        return data['preview_id']
+
+    def set(self, key: str, preview_id: str) -> None:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps({'preview_id': preview_id, 'created': time()}))
+        tmp_path.replace(path)
+
+    def invalidate(self, key: str) -> None:
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f'{key}.json'
+
+
+default_build_include = ('*',)
+default_build_exclude = (
+    '.git/*',
+    '.pytest_cache/*',
+    'node_modules/*',
+    'dist/*',
+    'target/*',
+    'worker/generated/*',
+    '*__pycache__/*',
+)
+lock_files = {'package-lock.json', 'yarn.lock', 'pnpm-lock.yaml', 'Cargo.lock'}
+
+
+class BuildCache:
+    """
+    Records a fingerprint of the inputs to "wrangler build" so the build can be skipped when neither the inputs nor
+    the built output have changed since the last build.
+
+    include and exclude are fnmatch patterns matched against paths relative to the wrangler directory,
+    wrangler.toml and lock files are hashed by content, other files by their modification time and size.
+    Files in cache_dir and ignore_dirs, e.g. pytest's cache directory, are excluded wherever they are, so writing
+    the cache doesn't change the fingerprint.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        *,
+        include: Sequence[str] = default_build_include,
+        exclude: Sequence[str] = default_build_exclude,
+        ignore_dirs: Sequence[Path] = (),
+    ):
+        self.cache_dir = cache_dir
+        self.include = include
+        self.exclude = exclude
+        self.ignore_dirs = [cache_dir, *ignore_dirs]
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, wrangler_dir: Path, environment: Optional[str] = None) -> str:
+        h = hashlib.sha256()
+        if environment is not None:
+            # output built for one environment isn't fresh for another
+            h.update(f'env\0{environment}\n'.encode())
+        exclude = [*self.exclude, *dir_patterns(wrangler_dir, self.ignore_dirs)]
+        for path in input_files(wrangler_dir, self.include, exclude):
+            rel_path = path.relative_to(wrangler_dir).as_posix()
+            if path.name == 'wrangler.toml' or path.name in lock_files:
+                file_id = hashlib.sha256(path.read_bytes()).hexdigest()
+            else:
+                stat = path.stat()
+                file_id = f'{stat.st_mtime_ns}:{stat.st_size}'
+            h.update(f'{rel_path}\0{file_id}\n'.encode())
+        return h.hexdigest()
+
+    def is_fresh(self, wrangler_dir: Path, fingerprint: str, output: Path, environment: Optional[str] = None) -> bool:
+        """
+        Whether output was built for environment from inputs matching fingerprint.
+        """
+        try:
+            data = json.loads(self._path(wrangler_dir, environment).read_text())
+            stat = output.stat()
+        except (FileNotFoundError, ValueError):
+            return False
+        else:
+            return data == {'fingerprint': fingerprint, 'output': self._output_id(stat)}
+
+    def store(self, wrangler_dir: Path, output: Path, environment: Optional[str] = None) -> None:
+        """
+        Record the current inputs as those output was built from, called after a successful build.
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        data = {'fingerprint': self.fingerprint(wrangler_dir, environment), 'output': self._output_id(output.stat())}
+        self._path(wrangler_dir, environment).write_text(json.dumps(data))
+
+    @staticmethod
+    def _output_id(stat: os.stat_result) -> str:
+        return f'{stat.st_mtime_ns}:{stat.st_size}'
+
+    def _path(self, wrangler_dir: Path, environment: Optional[str]) -> Path:
+        # each environment has its own record, so building one doesn't make the others stale
+        key = str(wrangler_dir.resolve()) if environment is None else f'{wrangler_dir.resolve()}\0{environment}'
+        return self.cache_dir / f'build-{hashlib.sha256(key.encode()).hexdigest()[:16]}.json'
+
+
+def built_script_path(wrangler_dir: Path, environment: Optional[str] = None) -> Path:
+    """
+    Where the script built for environment is kept, see build_source(), dist/ is excluded from the fingerprint.
+    """
+    scripts_dir = wrangler_dir / 'dist' / 'pytest-cloudflare-worker'
+    return scripts_dir / 'worker.js' if environment is None else scripts_dir / 'env' / environment / 'worker.js'
+
+
+def input_files(wrangler_dir: Path, include: Sequence[str], exclude: Sequence[str]) -> List[Path]:
+    """
+    Files in wrangler_dir matching include and not exclude, the inputs to "wrangler build", in a stable order.
+    """
+    files = []
+    for root, dirs, file_names in os.walk(wrangler_dir):
+        root_path = Path(root)
+        rel_root = root_path.relative_to(wrangler_dir).as_posix()
+        prefix = '' if rel_root == '.' else f'{rel_root}/'
+        dirs[:] = sorted(d for d in dirs if not any(fnmatch(f'{prefix}{d}/', pattern) for pattern in exclude))
+        for name in sorted(file_names):
+            rel_path = f'{prefix}{name}'
+            if any(fnmatch(rel_path, p) for p in include) and not any(fnmatch(rel_path, p) for p in exclude):
+                files.append(root_path / name)
+    return files
+
+
+def dir_patterns(wrangler_dir: Path, dirs: Sequence[Path]) -> List[str]:
+    """
+    Patterns matching the files in those of dirs which are inside wrangler_dir, for use with input_files().
+    """
+    patterns = []
+    wrangler_dir = wrangler_dir.resolve()
+    for path in dirs:
+        try:
+            rel_path = Path(path).resolve().relative_to(wrangler_dir)
+        except ValueError:
+            continue
+        if rel_path.parts:
+            patterns.append(f'{rel_path.as_posix()}/*')
+    return patterns
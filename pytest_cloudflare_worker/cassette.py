@@ -0,0 +1,155 @@
+import base64
+import hashlib
+import json
+import os
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Deque, Dict, List, Optional, Tuple
+
+from .logs import LogStore
+
+if TYPE_CHECKING:
+    from requests import PreparedRequest, Response
+
+    from .inspect import LogMsg
+
+__all__ = 'Cassette', 'CassetteError', 'cassette_key'
+
+modes = 'auto', 'record', 'replay'
+
+
+class CassetteError(Exception):
+    pass
+
+
+def cassette_key(script: bytes, bindings: List[Dict[str, Any]]) -> str:
+    """
+    Hash of the built script and its bindings, cassettes recorded with a different key are re-recorded.
+    """
+    h = hashlib.sha256(script)
+    h.update(json.dumps(bindings, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+class Cassette:
+    """
+    Requests made by one test, with their responses and the inspect logs they produced, so the test can be rerun
+    without deploying or making any requests.
+
+    In "auto" mode the cassette is replayed if it was recorded with the same key, otherwise it's recorded, if a
+    request isn't found when replaying, it and later requests are recorded. "record" always records,
+    "replay" raises CassetteError for requests which weren't recorded with this key.
+
+    Requests are matched on method, fake host, path, query and a hash of the body, in order for identical requests.
+    """
+
+    def __init__(self, path: Path, key: str, *, mode: str = 'auto'):
+        assert mode in modes, f'mode must be one of {modes}'
+        self.path = path
+        self.key = key
+        self.mode = mode
+        self.recording = True
+        self.changed = False
+        self._recorded: Dict[Tuple[Any, ...], Deque[Dict[str, Any]]] = defaultdict(deque)
+        # (interaction, log cursor) for each request made, in order, this is what's saved
+        self._used: List[Tuple[Dict[str, Any], int]] = []
+
+        if mode != 'record':
+            try:
+                data = json.loads(path.read_text())
+            except (FileNotFoundError, ValueError):
+                data = None
+            if data and data['key'] == key:
+                for interaction in data['interactions']:
+                    self._recorded[tuple(interaction['match'])].append(interaction)
+            # in "replay" mode, without a cassette for this key every request raises CassetteError
+            self.recording = mode == 'auto' and not self._recorded
+
+    def play(
+        self, fake_host: str, request: 'PreparedRequest', log_cursor: int, *, match_body: bool = True
+    ) -> Optional[Tuple['Response', List['LogMsg']]]:
+        """
+        Find the next recorded response to request and the logs it produced, if it wasn't recorded, switch to
+        recording and return None, or raise CassetteError in "replay" mode.
+        """
+        match = request_match(fake_host, request, match_body)
+        recorded = self._recorded.get(match)
+        if not recorded:
+            if self.mode == 'replay':
+                raise CassetteError(f'{request.method} {request.path_url} not found in cassette "{self.path}"')
+            self.recording = True
+            return None
+
+        from .inspect import LogMsg
+
+        interaction = recorded.popleft()
+        self._used.append((interaction, log_cursor))
+        logs = [LogMsg.from_raw(data) for data in interaction['logs']]
+        return build_response(request, interaction['response']), [msg for msg in logs if msg]
+
+    def record(self, fake_host: str, response: 'Response', log_cursor: int, *, match_body: bool = True) -> None:
+        # match on the original request if redirects were followed
+        request = response.history[0].request if response.history else response.request
+        interaction = {
+            'match': request_match(fake_host, request, match_body),
+            'response': {
+                'status': response.status_code,
+                'reason': response.reason,
+                'headers': dict(response.headers),
+                **encode_body(response.content),
+            },
+        }
+        self._used.append((interaction, log_cursor))
+        self.changed = True
+
+    def save(self, logs: LogStore) -> None:
+        """
+        Save the cassette if anything was recorded, logs for recorded requests are taken from logs.
+        """
+        if not self.changed:
+            return
+        interactions = []
+        cursors = [cursor for _, cursor in self._used[1:]] + [len(logs)]
+        for (interaction, cursor), next_cursor in zip(self._used, cursors):
+            if 'logs' not in interaction:
+                interaction['logs'] = [msg.full for msg in logs[cursor:next_cursor]]
+            interactions.append(interaction)
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(f'.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps({'key': self.key, 'interactions': interactions}, indent=2))
+        tmp_path.replace(self.path)
+
+
+def request_match(fake_host: str, request: 'PreparedRequest', match_body: bool) -> Tuple[Any, ...]:
+    body = request.body
+    if isinstance(body, str):
+        body = body.encode()
+    body_hash = hashlib.sha256(body).hexdigest() if match_body and isinstance(body, bytes) else None
+    return request.method, fake_host, request.path_url, body_hash
+
+
+def encode_body(body: bytes) -> Dict[str, str]:
+    try:
+        return {'body': body.decode()}
+    except UnicodeDecodeError:
+        return {'body_base64': base64.b64encode(body).decode()}
+
+
+def build_response(request: 'PreparedRequest', data: Dict[str, Any]) -> 'Response':
+    from requests import Response
+    from requests.structures import CaseInsensitiveDict
+    from requests.utils import get_encoding_from_headers
+
+    response = Response()
+    response.status_code = data['status']
+    response.reason = data['reason']
+    response.headers = CaseInsensitiveDict(data['headers'])
+    response.encoding = get_encoding_from_headers(response.headers)
+    if 'body_base64' in data:
+        response._content = base64.b64decode(data['body_base64'])
+    else:
+        response._content = data['body'].encode()
+    response.url = request.url
+    response.request = request
+    return response
@@ -0,0 +1,506 @@
+"""
+Local stand-in for the cloudflare preview endpoints, so tests and benchmarks can run without network access.
+
+The emulator accepts the multipart upload made by deploy(), routes requests to a preview using the
+"__ew_fiddle_preview" cookie, and serves the inspect websocket, speaking the subset of the devtools protocol used
+by inspect.py. The uploaded script isn't run, instead requests are handled by a python "worker stub" with the
+signature:
+
+    def worker(request: WorkerRequest, env: Dict[str, Any], console: Console) -> WorkerResponse
+"""
+
+import asyncio
+import json
+import math
+import os
+import sys
+import traceback
+import uuid
+from datetime import datetime
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from time import perf_counter
+from typing import Any, BinaryIO, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from urllib.parse import parse_qsl, urlsplit
+
+import websockets
+
+from .kv import KVStore
+
+__all__ = 'Emulator', 'WorkerRequest', 'WorkerResponse', 'Console', 'echo_worker', 'load_worker'
+
+
+class WorkerRequest:
+    def __init__(self, method: str, url: str, headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.url = url
+        self.headers = headers
+        self.body = body
+        split_url = urlsplit(url)
+        self.hostname = split_url.hostname
+        self.pathname = split_url.path
+        self.params = dict(parse_qsl(split_url.query, keep_blank_values=True))
+
+    def text(self) -> str:
+        return self.body.decode()
+
+    def json(self) -> Any:
+        return json.loads(self.body)
+
+
+class WorkerResponse:
+    """
+    Response from a worker stub, body may be an iterable of bytes which is sent with chunked encoding,
+    a chunk at a time, like a streamed response from a worker.
+    """
+
+    def __init__(self, body: Any = b'', *, status: int = 200, headers: Optional[Dict[str, str]] = None):
+        if isinstance(body, str):
+            body = body.encode()
+        self.body: Union[bytes, Iterable[bytes]] = body
+        self.status = status
+        self.headers = headers or {}
+
+    @classmethod
+    def json(cls, data: Any, *, status: int = 200, headers: Optional[Dict[str, str]] = None) -> 'WorkerResponse':
+        headers = {'content-type': 'application/json', **(headers or {})}
+        return cls(json.dumps(data, indent=2) + '\n', status=status, headers=headers)
+
+
+WorkerStub = Callable[[WorkerRequest, Dict[str, Any], 'Console'], WorkerResponse]
+
+
+class Console:
+    """
+    Equivalent of "console" in a worker, calls are sent as "Runtime.consoleAPICalled" events to the inspect sessions
+    for the request's session.
+
+    line defaults to the line number in the worker stub which called the method. If objects is given, lists and
+    dicts logged are stored in it by objectId so they can be expanded with "Runtime.getProperties".
+    """
+
+    def __init__(
+        self,
+        emit: Callable[[Dict[str, Any]], None],
+        *,
+        file: str = 'worker.js',
+        objects: Optional[Dict[str, Any]] = None,
+    ):
+        self._emit = emit
+        self.file = file
+        self._objects = objects
+
+    def log(self, *args: Any, line: Optional[int] = None) -> None:
+        self._call('log', args, line)
+
+    def info(self, *args: Any, line: Optional[int] = None) -> None:
+        self._call('info', args, line)
+
+    def debug(self, *args: Any, line: Optional[int] = None) -> None:
+        self._call('debug', args, line)
+
+    def warn(self, *args: Any, line: Optional[int] = None) -> None:
+        self._call('warning', args, line)
+
+    def error(self, *args: Any, line: Optional[int] = None) -> None:
+        self._call('error', args, line)
+
+    def _call(self, type_: str, args: Tuple[Any, ...], line: Optional[int]) -> None:
+        if line is None:
+            line = sys._getframe(2).f_lineno
+        params = {
+            'type': type_,
+            'args': [remote_object(arg, self._objects) for arg in args],
+            'executionContextId': 1,
+            'timestamp': datetime.now().timestamp() * 1000,
+            'stackTrace': {'callFrames': [{'functionName': '', 'url': self.file, 'lineNumber': line - 1}]},
+        }
+        self._emit({'method': 'Runtime.consoleAPICalled', 'params': params})
+
+
+def remote_object(value: Any, objects: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Convert a python value to a devtools RemoteObject as sent by the cloudflare inspect websocket, lists and dicts
+    are given an objectId and stored in objects if it's not None.
+    """
+    if value is None:
+        return {'type': 'object', 'subtype': 'null', 'value': 'null'}
+    elif value is Ellipsis:
+        return {'type': 'undefined', 'value': 'undefined'}
+    elif isinstance(value, bool):
+        return {'type': 'boolean', 'value': 'true' if value else 'false'}
+    elif isinstance(value, (int, float)):
+        return {'type': 'number', 'value': value, 'description': js_number(value)}
+    elif isinstance(value, str):
+        return {'type': 'string', 'value': value}
+    elif isinstance(value, datetime):
+        return {'type': 'object', 'subtype': 'date', 'className': 'Date', 'description': js_date(value)}
+
+    if isinstance(value, (list, tuple)):
+        obj = {'type': 'object', 'subtype': 'array', 'className': 'Array', 'description': f'Array({len(value)})'}
+    else:
+        obj = {'type': 'object', 'className': 'Object', 'description': 'Object'}
+    if objects is not None and isinstance(value, (list, tuple, dict)):
+        obj['objectId'] = object_id = uuid.uuid4().hex
+        objects[object_id] = value
+    return obj
+
+
+def object_properties(value: Any, objects: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    PropertyDescriptors of a list or dict for the result of "Runtime.getProperties".
+    """
+    if isinstance(value, dict):
+        items = list(value.items())
+    else:
+        items = [(str(i), v) for i, v in enumerate(value)]
+    properties = [
+        {'name': k, 'value': remote_object(v, objects), 'enumerable': True, 'isOwn': True, 'configurable': True}
+        for k, v in items
+    ]
+    if not isinstance(value, dict):
+        properties.append({'name': 'length', 'value': remote_object(len(value)), 'enumerable': False, 'isOwn': True})
+    return properties
+
+
+def js_number(value: float) -> str:
+    if isinstance(value, float) and value.is_integer() and not math.isinf(value):
+        value = int(value)
+    return str(value)
+
+
+def js_date(value: datetime) -> str:
+    return value.strftime('%a %b %d %Y %H:%M:%S GMT+0000 (Coordinated Universal Time)')
+
+
+def echo_worker(request: WorkerRequest, env: Dict[str, Any], console: Console) -> WorkerResponse:
+    """
+    Default worker stub, logs the request and responds with a description of it.
+    """
+    console.log('handling request:', request.method, request.pathname)
+    data = {
+        'method': request.method,
+        'headers': request.headers,
+        'url': {'hostname': request.hostname, 'pathname': request.pathname, 'params': request.params},
+        'body': request.text(),
+    }
+    return WorkerResponse.json(data)
+
+
+def load_worker(path: str) -> WorkerStub:
+    """
+    Load a worker stub from a path in the form "module.path:function".
+    """
+    module_path, _, attr = path.partition(':')
+    if not attr:
+        raise ValueError(f'worker stub path "{path}" must be in the form "module.path:function"')
+    __import__(module_path)
+    return getattr(sys.modules[module_path], attr)
+
+
+class Preview:
+    def __init__(self, metadata: Dict[str, Any], script: bytes, kv: KVStore):
+        self.metadata = metadata
+        self.script = script
+        self.env: Dict[str, Any] = {}
+        for binding in metadata.get('bindings', []):
+            if binding['type'] == 'plain_text':
+                self.env[binding['name']] = binding['text']
+            elif binding['type'] == 'kv_namespace':
+                self.env[binding['name']] = kv.namespace(binding['namespace_id'])
+
+
+class Emulator:
+    """
+    Run the emulator in background threads, use root as the preview and API root for deploy() and the client,
+    and inspect_root as the client's inspect root.
+
+    "kv_namespace" bindings are bound to in-memory namespaces in kv, see KVStore.
+    """
+
+    def __init__(self, worker: WorkerStub = echo_worker, *, host: str = '127.0.0.1'):
+        self.worker = worker
+        self.host = host
+        self.previews: Dict[str, Preview] = {}
+        self.kv = KVStore()
+        # session_id -> objectId -> value of lists and dicts logged by the worker, kept while the session has an
+        # inspect connection to expand them, like the remote objects of a devtools session
+        self._objects: Dict[str, Dict[str, Any]] = {}
+        self._sessions: Dict[str, List[asyncio.Queue]] = {}
+        self._sessions_lock = Lock()
+        # session_id -> (Profiler.start time, [(start, end) of each worker call]) in microseconds
+        self._profiling: Dict[str, Tuple[float, List[Tuple[float, float]]]] = {}
+        self._http_server: Optional[ThreadingHTTPServer] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._ws_server = None
+        self._threads: List[Thread] = []
+        self.root = self.inspect_root = ''
+
+    def start(self) -> 'Emulator':
+        self._http_server = ThreadingHTTPServer((self.host, 0), self._http_handler())
+        self._http_server.daemon_threads = True
+        self._start_thread(lambda: self._http_server.serve_forever(poll_interval=0.05))
+        self.root = f'http://{self.host}:{self._http_server.server_address[1]}'
+
+        self._loop = asyncio.new_event_loop()
+        self._start_thread(self._loop.run_forever)
+        self._ws_server = asyncio.run_coroutine_threadsafe(self._serve_inspect(), self._loop).result()
+        ws_port = next(iter(self._ws_server.sockets)).getsockname()[1]
+        self.inspect_root = f'ws://{self.host}:{ws_port}/inspect'
+        return self
+
+    def stop(self) -> None:
+        if self._http_server is not None:
+            self._http_server.shutdown()
+            self._http_server.server_close()
+            self._http_server = None
+        if self._loop is not None:
+            self._ws_server.close()
+            asyncio.run_coroutine_threadsafe(self._ws_server.wait_closed(), self._loop).result(5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        for t in self._threads:
+            t.join(5)
+        if self._loop is not None:
+            self._loop.close()
+            self._loop = None
+        self._threads = []
+
+    def __enter__(self) -> 'Emulator':
+        return self.start()
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+    def emit(self, session_id: str, event: Dict[str, Any]) -> None:
+        """
+        Send an event to every inspect connection for the session.
+        """
+        msg = json.dumps(event)
+        with self._sessions_lock:
+            queues = list(self._sessions.get(session_id, []))
+        for queue in queues:
+            self._loop.call_soon_threadsafe(queue.put_nowait, msg)
+
+    def handle_upload(self, content_type: str, body: bytes) -> str:
+        parser_input = f'content-type: {content_type}\r\n\r\n'.encode() + body
+        parts = {}
+        for part in BytesParser(policy=HTTP).parsebytes(parser_input).iter_parts():
+            parts[part.get_param('name', header='content-disposition')] = part.get_payload(decode=True)
+        metadata = json.loads(parts['metadata'])
+        preview_id = uuid.uuid4().hex
+        self.previews[preview_id] = Preview(metadata, parts[metadata['body_part']], self.kv)
+        return preview_id
+
+    def handle_request(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> WorkerResponse:
+        headers = {k.lower(): v for k, v in headers.items()}
+        cookies = dict(c.strip().split('=', 1) for c in headers.pop('cookie', '').split(';') if '=' in c)
+        preview_cookie = cookies.get('__ew_fiddle_preview', '')
+        preview_id, session_id, host = preview_cookie[:32], preview_cookie[32:64], preview_cookie[65:]
+        preview = self.previews.get(preview_id)
+        if preview is None:
+            return WorkerResponse(f'preview "{preview_id}" not found\n', status=404)
+
+        headers['host'] = host
+        request = WorkerRequest(method, f'https://{host}{path}', headers, body)
+        console = Console(lambda event: self.emit(session_id, event), objects=self._objects.get(session_id))
+        start = perf_counter_us()
+        try:
+            return self.worker(request, dict(preview.env), console)
+        except Exception as exc:
+            self.emit(session_id, exception_event(exc))
+            return WorkerResponse(b'', status=500)
+        finally:
+            profiling = self._profiling.get(session_id)
+            if profiling is not None:
+                profiling[1].append((start, perf_counter_us()))
+
+    def _http_handler(self):
+        emulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def handle_one_request(self):
+                self.raw_requestline = self.rfile.readline(65537)
+                if not self.raw_requestline or not self.parse_request():
+                    self.close_connection = True
+                    return
+                if self.headers.get('transfer-encoding', '').lower() == 'chunked':
+                    body = read_chunked(self.rfile)
+                else:
+                    body = self.rfile.read(int(self.headers.get('content-length', 0)))
+                path = urlsplit(self.path).path
+                if self.command == 'POST' and (path == '/script' or path.endswith('/preview')):
+                    preview_id = emulator.handle_upload(self.headers['content-type'], body)
+                    if path == '/script':
+                        data = {'id': preview_id}
+                    else:
+                        data = {'success': True, 'result': {'preview_id': preview_id}}
+                    response = WorkerResponse.json(data)
+                else:
+                    response = emulator.handle_request(self.command, self.path, dict(self.headers.items()), body)
+                self._send(response)
+
+            def _send(self, response: WorkerResponse) -> None:
+                self.send_response(response.status)
+                for k, v in response.headers.items():
+                    self.send_header(k, v)
+                streamed = not isinstance(response.body, bytes)
+                if streamed:
+                    self.send_header('transfer-encoding', 'chunked')
+                else:
+                    self.send_header('content-length', str(len(response.body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    if streamed:
+                        write_chunked(self.wfile, response.body)
+                    else:
+                        self.wfile.write(response.body)
+                self.wfile.flush()
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+        return Handler
+
+    async def _serve_inspect(self):
+        return await websockets.serve(self._inspect_handler, self.host, 0)
+
+    async def _inspect_handler(self, ws, path: Optional[str] = None) -> None:
+        if path is None:
+            path = ws.request.path
+        session_id = path.rstrip('/').rsplit('/', 1)[-1]
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._sessions_lock:
+            self._sessions.setdefault(session_id, []).append(queue)
+            self._objects.setdefault(session_id, {})
+
+        async def send_events():
+            while True:
+                await ws.send(await queue.get())
+
+        sender = asyncio.create_task(send_events())
+        try:
+            async for msg in ws:
+                data = json.loads(msg)
+                try:
+                    result = {'result': self._command_result(session_id, data)}
+                except KeyError as e:
+                    result = {'error': {'code': -32000, 'message': f'Could not find object with given id {e}'}}
+                queue.put_nowait(json.dumps({'id': data['id'], **result}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            sender.cancel()
+            with self._sessions_lock:
+                queues = self._sessions[session_id]
+                queues.remove(queue)
+                if not queues:
+                    # nothing can expand the session's objects any more
+                    del self._sessions[session_id]
+                    del self._objects[session_id]
+
+    def _command_result(self, session_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        method = data['method']
+        if method == 'Runtime.getIsolateId':
+            return {'id': f'emulator-{os.getpid()}'}
+        elif method == 'Profiler.start':
+            self._profiling[session_id] = perf_counter_us(), []
+        elif method == 'Profiler.stop':
+            start, calls = self._profiling.pop(session_id, (perf_counter_us(), []))
+            return {'profile': cpu_profile(self.worker, start, calls, perf_counter_us())}
+        elif method == 'Runtime.getProperties':
+            objects = self._objects[session_id]
+            value = objects[data['params']['objectId']]
+            return {'result': object_properties(value, objects)}
+        return {}
+
+    def _start_thread(self, target: Callable[[], Any]) -> None:
+        t = Thread(name='cf-emulator', target=target, daemon=True)
+        t.start()
+        self._threads.append(t)
+
+
+def read_chunked(rfile: BinaryIO) -> bytes:
+    chunks = []
+    while size := int(rfile.readline().split(b';', 1)[0], 16):
+        chunks.append(rfile.read(size))
+        rfile.readline()
+    # skip trailers
+    while rfile.readline() not in {b'\r\n', b'\n', b''}:
+        pass
+    return b''.join(chunks)
+
+
+def write_chunked(wfile: BinaryIO, chunks: Iterable[bytes]) -> None:
+    # flush each chunk so the client sees it as the worker produces it
+    for chunk in chunks:
+        if chunk:
+            wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+            wfile.flush()
+    wfile.write(b'0\r\n\r\n')
+
+
+def perf_counter_us() -> float:
+    return perf_counter() * 1_000_000
+
+
+def cpu_profile(worker: WorkerStub, start: float, calls: List[Tuple[float, float]], end: float) -> Dict[str, Any]:
+    """
+    Build a devtools profile in which the worker stub is the only function, and time outside calls to it is idle.
+    """
+    code = getattr(worker, '__code__', None)
+    worker_frame = {
+        'functionName': getattr(worker, '__name__', 'worker'),
+        'scriptId': '1',
+        'url': 'worker.js',
+        'lineNumber': code.co_firstlineno - 1 if code else 0,
+        'columnNumber': 0,
+    }
+    nodes = [
+        {'id': 1, 'callFrame': pseudo_frame('(root)'), 'hitCount': 0, 'children': [2, 3]},
+        {'id': 2, 'callFrame': pseudo_frame('(idle)'), 'hitCount': 0},
+        {'id': 3, 'callFrame': worker_frame, 'hitCount': 0},
+    ]
+    samples, time_deltas = [], []
+    last = start
+    for sample_start, node_id in sorted([(s, 3) for s, _ in calls] + [(e, 2) for _, e in calls]):
+        samples.append(node_id)
+        time_deltas.append(int(sample_start - last))
+        nodes[node_id - 1]['hitCount'] += 1
+        last = sample_start
+    return {
+        'nodes': nodes,
+        'startTime': int(start),
+        'endTime': int(start) + sum(time_deltas) + int(end - last),
+        'samples': samples,
+        'timeDeltas': time_deltas,
+    }
+
+
+def pseudo_frame(name: str) -> Dict[str, Any]:
+    return {'functionName': name, 'scriptId': '0', 'url': '', 'lineNumber': -1, 'columnNumber': -1}
+
+
+def exception_event(exc: Exception) -> Dict[str, Any]:
+    line = getattr(exc, 'line', None) or traceback.extract_tb(exc.__traceback__)[-1].lineno
+    description = f'{exc.__class__.__name__}: {exc}'
+    details = {
+        'text': 'Uncaught',
+        'exception': {
+            'type': 'object',
+            'subtype': 'error',
+            'className': exc.__class__.__name__,
+            'description': description,
+        },
+        'url': getattr(exc, 'file', 'worker.js'),
+        'lineNumber': line - 1,
+        'columnNumber': 0,
+    }
+    return {
+        'method': 'Runtime.exceptionThrown',
+        'params': {'timestamp': datetime.now().timestamp() * 1000, 'exceptionDetails': details},
+    }
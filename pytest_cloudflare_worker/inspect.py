@@ -1,40 +1,318 @@
 import asyncio
+import itertools
 import json
+import ssl
+import uuid
 import warnings
-from threading import Event
-from typing import Any, Dict, List, Optional
+from collections import deque
+from concurrent.futures import Future, wait
+from threading import Event, Lock, Thread
+from typing import Any, Coroutine, Deque, Dict, List, Optional, TypeVar, Union
 
 import websockets
 
-__all__ = 'inspect', 'LogMsg'
+from .logs import LogStore
+from .subrequests import SubrequestLog, network_methods
 
+__all__ = 'InspectLoop', 'get_inspect_loop', 'Inspector', 'InspectPool', 'LogMsg'
 
-def inspect(*, session_id: str, log: List['LogMsg'], ready: Event, stop: Event, received: Event):
-    async def async_inspect() -> None:
-        async with websockets.connect(f'wss://cloudflareworkers.com/inspect/{session_id}') as ws:
+inspect_root = 'wss://cloudflareworkers.com/inspect'
+T = TypeVar('T')
+
+
+class InspectLoop:
+    """
+    A single event loop per process, run in a daemon thread, on which the inspect connections for every session run
+    concurrently, sharing one TLS context.
+    """
+
+    def __init__(self):
+        self.ssl_context = ssl.create_default_context()
+        self.connections: Dict[str, 'Inspector'] = {}
+        self._lock = Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> 'Future[T]':
+        """
+        Run coro on the event loop, starting the loop if required.
+        """
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                Thread(name='inspect', target=self._loop.run_forever, daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+
+_inspect_loop: Optional[InspectLoop] = None
+_inspect_loop_lock = Lock()
+
+
+def get_inspect_loop() -> InspectLoop:
+    global _inspect_loop
+    with _inspect_loop_lock:
+        if _inspect_loop is None:
+            _inspect_loop = InspectLoop()
+    return _inspect_loop
+
+
+class Inspector:
+    """
+    Connection to the inspect websocket for one session, run on the process's InspectLoop.
+
+    Log messages are appended to log, which wakes anything waiting for them as soon as each message arrives,
+    network events update subrequests. stop() cancels the receive loop rather than waiting for it to notice.
+
+    Objects and arrays logged with console are expanded to expand_depth levels with "Runtime.getProperties",
+    see _expand(), such messages are appended once expanded, later messages wait for them so the order is kept.
+    """
+
+    def __init__(
+        self,
+        *,
+        session_id: str,
+        log: LogStore,
+        root: str = inspect_root,
+        subrequests: Optional[SubrequestLog] = None,
+        expand_depth: int = 0,
+    ):
+        self.session_id = session_id
+        self.url = f'{root}/{session_id}'
+        self.log = log
+        self.subrequests = SubrequestLog() if subrequests is None else subrequests
+        self.ready = Event()
+        self._inspect_loop = get_inspect_loop()
+        self._future: Optional['Future[None]'] = None
+        self._ws = None
+        # ids of commands sent by call() follow those of inspect_start_msgs
+        self._ids = itertools.count(len(inspect_start_msgs) + 1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        # ids of commands sent by sync() -> futures done once messages received before their reply are in log
+        self._syncs: Dict[int, asyncio.Future] = {}
+        self.expand_depth = expand_depth
+        # task appending the last message to be expanded, until it's done later messages are appended after it
+        self._log_tail: Optional[asyncio.Future] = None
+
+    def start(self) -> None:
+        self._inspect_loop.connections[self.session_id] = self
+        self._future = self._inspect_loop.run(self._inspect())
+        self._future.add_done_callback(lambda f: self._inspect_loop.connections.pop(self.session_id, None))
+
+    def stop(self) -> None:
+        """
+        Cancel the receive loop without waiting for the websocket to close.
+        """
+        if self._future is not None:
+            self._future.cancel()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        if self._future is not None:
+            wait([self._future], timeout)
+
+    @property
+    def closed(self) -> bool:
+        return self._future is not None and self._future.done()
+
+    def call(self, method: str, params: Optional[Dict[str, Any]] = None, timeout: float = 10) -> Dict[str, Any]:
+        """
+        Send a command on the inspect websocket and wait for its result, waiting first for the connection to be ready.
+        """
+        if not self.ready.wait(timeout):
+            raise TimeoutError(f'inspect connection for session {self.session_id} not ready')
+        return self._inspect_loop.run(self._call(method, params)).result(timeout)
+
+    def sync(self) -> Optional['Future[None]']:
+        """
+        Send a command and return a future which is done once every message received before its reply has been
+        appended to log. Events arrive in order, so then log has all the logs of requests which already had a response.
+        None if the connection isn't ready.
+        """
+        if not self.ready.is_set() or self.closed:
+            return None
+        return self._inspect_loop.run(self._sync())
+
+    async def _sync(self) -> None:
+        msg_id = next(self._ids)
+        self._syncs[msg_id] = future = asyncio.get_running_loop().create_future()
+        try:
+            await self._ws.send(json.dumps({'id': msg_id, 'method': 'Runtime.getIsolateId', 'params': {}}))
+            await future
+        finally:
+            self._syncs.pop(msg_id, None)
+
+    async def _call(self, method: str, params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        msg_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[msg_id] = future
+        try:
+            await self._ws.send(json.dumps({'id': msg_id, 'method': method, 'params': params or {}}))
+            return await future
+        finally:
+            self._pending.pop(msg_id, None)
+
+    async def _inspect(self) -> None:
+        ssl_context = self._inspect_loop.ssl_context if self.url.startswith('wss:') else None
+        async with websockets.connect(self.url, ssl=ssl_context, close_timeout=1) as ws:
+            self._ws = ws
             for msg in inspect_start_msgs:
                 await ws.send(msg)
 
-            while True:
-                f = ws.recv()
-                try:
-                    msg = await asyncio.wait_for(f, timeout=0.1)
-                except asyncio.TimeoutError:
-                    pass
+            try:
+                async for msg in ws:
+                    self._on_message(msg)
+            except asyncio.CancelledError:
+                # stop() was called, return so the websocket is closed cleanly
+                pass
+            finally:
+                for future in [*self._pending.values(), *self._syncs.values()]:
+                    future.cancel()
+
+    def _on_message(self, msg: str) -> None:
+        data = json.loads(msg)
+        msg_id = data.get('id')
+        if msg_id is not None:
+            if msg_id == 8:  # this is the id of the last element of inspect_start_msgs
+                self.ready.set()
+            future = self._pending.get(msg_id)
+            if future is not None and not future.done():
+                if 'error' in data:
+                    future.set_exception(RuntimeError(f'inspect command failed: {data["error"]}'))
+                else:
+                    future.set_result(data.get('result', {}))
+            sync = self._syncs.get(msg_id)
+            if sync is not None:
+                if self._log_tail is None:
+                    sync.set_result(None)
                 else:
-                    data = json.loads(msg)
-                    if data.get('id') == 8:  # this is the id of the last element of inspect_start_msgs
-                        ready.set()
+                    # messages being expanded are appended first
+                    self._log_tail = asyncio.ensure_future(self._append_after(self._log_tail, None, sync))
+
+        method = data.get('method')
+        if method in network_methods:
+            self.subrequests.on_event(data)
+        if self.expand_depth and method == 'Runtime.consoleAPICalled':
+            args = data['params']['args']
+            if any('objectId' in arg for arg in args) or self._log_tail is not None:
+                # expanding must not block receiving, so it runs in a task which appends the message when it's done
+                expand = asyncio.ensure_future(self._expand_args(args))
+                self._log_tail = asyncio.ensure_future(self._append_after(self._log_tail, expand, data))
+                return
+        log_msg = LogMsg.from_raw(data, msg)
+        if log_msg:
+            if self._log_tail is not None:
+                self._log_tail = asyncio.ensure_future(self._append_after(self._log_tail, None, log_msg))
+            else:
+                self.log.append(log_msg)
+
+    async def _append_after(
+        self,
+        previous: Optional[asyncio.Future],
+        expand: Optional[asyncio.Future],
+        msg: Union['LogMsg', Dict[str, Any], asyncio.Future],
+    ) -> None:
+        """
+        Append msg once previous is done and its arguments have been expanded, a sync() future is set done instead.
+        """
+        if previous is not None:
+            await asyncio.wait([previous])
+        if expand is not None:
+            await asyncio.wait([expand])
+        if isinstance(msg, asyncio.Future):
+            if not msg.done():
+                msg.set_result(None)
+        else:
+            self.log.append(LogMsg.from_raw(msg) if isinstance(msg, dict) else msg)
+        if self._log_tail is asyncio.current_task():
+            self._log_tail = None
+
+    async def _expand_args(self, args: List[Dict[str, Any]]) -> None:
+        """
+        Expand each object argument in place, setting "expanded" to its value, which LogMsg.parse_arg uses.
+        """
+        # objectId -> task getting its properties, so an object logged twice in the message is only requested once,
+        # it's dropped with the message so properties of every object logged aren't kept
+        properties: Dict[str, asyncio.Future] = {}
+        values = await asyncio.gather(*(self._expand(arg, self.expand_depth, properties) for arg in args))
+        for arg, value in zip(args, values):
+            if 'objectId' in arg:
+                arg['expanded'] = value
+
+    async def _expand(self, remote: Dict[str, Any], depth: int, cache: Dict[str, asyncio.Future]) -> Any:
+        """
+        Python value of a RemoteObject with objects and arrays expanded to depth levels.
+
+        The properties of every object at one level are requested concurrently, so expanding takes one round trip
+        per level rather than one per property.
+        """
+        object_id = remote.get('objectId')
+        if object_id is None or depth <= 0:
+            return LogMsg.parse_arg(remote)
+
+        future = cache.get(object_id)
+        if future is None:
+            params = {'objectId': object_id, 'ownProperties': True}
+            future = cache[object_id] = asyncio.ensure_future(self._call('Runtime.getProperties', params))
+        try:
+            properties = (await asyncio.shield(future))['result']
+        except (RuntimeError, asyncio.CancelledError, websockets.ConnectionClosed):
+            # e.g. the object has been released or the connection closed, fall back to its description
+            return LogMsg.parse_arg(remote)
+
+        if remote.get('subtype') == 'array':
+            properties = sorted((p for p in properties if p['name'].isdigit()), key=lambda p: int(p['name']))
+        else:
+            properties = [p for p in properties if p.get('enumerable') and 'value' in p]
+        values = await asyncio.gather(*(self._expand(p['value'], depth - 1, cache) for p in properties))
+        if remote.get('subtype') == 'array':
+            return values
+        return {p['name']: v for p, v in zip(properties, values)}
+
 
-                    log_msg = LogMsg.from_raw(data)
-                    if log_msg:
-                        log.append(log_msg)
-                        received.set()
+class InspectPool:
+    """
+    Pool of sessions whose inspect connection has already been started, so a new session can be used without
+    waiting for the websocket and the inspect_start_msgs handshake.
 
-                if stop.is_set():
-                    return
+    The pool is filled on first use and topped up each time a session is taken from it.
+    """
 
-    asyncio.run(async_inspect())
+    def __init__(self, size: int, *, root: str = inspect_root):
+        self.size = size
+        self.root = root
+        self._ready: Deque[Inspector] = deque()
+        self._lock = Lock()
+
+    def pop(self) -> Optional[Inspector]:
+        """
+        Take a started inspector for a new session from the pool, None if the pool has size 0.
+        """
+        with self._lock:
+            inspector = None
+            self._fill()
+            while self._ready:
+                candidate = self._ready.popleft()
+                if not candidate.closed:
+                    inspector = candidate
+                    break
+            self._fill()
+            return inspector
+
+    def fill(self) -> None:
+        """
+        Start the pool's inspect connections now rather than when the first session is taken.
+        """
+        with self._lock:
+            self._fill()
+
+    def close(self) -> None:
+        with self._lock:
+            while self._ready:
+                self._ready.popleft().stop()
+
+    def _fill(self) -> None:
+        while len(self._ready) < self.size:
+            inspector = Inspector(session_id=uuid.uuid4().hex, log=LogStore(), root=self.root)
+            inspector.start()
+            self._ready.append(inspector)
 
 
 # we don't need all of these, but not clear which we do
@@ -58,6 +336,7 @@ ignored_methods = {
     'Network.enable',
     'Network.dataReceived',
     'Network.loadingFinished',
+    'Network.loadingFailed',
 }
 known_methods = {
     'Runtime.consoleAPICalled',
@@ -68,48 +347,125 @@ known_methods = {
 
 
 class LogMsg:
-    def __init__(self, method: str, data):
-        # debug(data)
-        self.full = data
-        params = data['params']
+    """
+    A log message from the inspect websocket.
+
+    Only the method and raw message are stored when it's created, fields are decoded together the first time any
+    of them is accessed and the formatted string is cached since it's used by every comparison.
+    """
+
+    __slots__ = '_method', '_raw', '_level', '_args', '_message', '_file', '_line', '_headers', '_str'
+    _fields = 'full', 'level', 'args', 'message', 'file', 'line', 'headers'
+
+    def __init__(self, method: str, raw: Union[str, bytes, Dict[str, Any]]):
+        self._method = method
+        self._raw = raw
+        self._level = None
+        self._str = None
+
+    @classmethod
+    def from_raw(cls, data: Dict[str, Any], raw: Union[str, bytes, None] = None) -> Optional['LogMsg']:
+        """
+        Create a LogMsg from a decoded message, if raw is given the raw message is stored instead of data.
+        """
+        method = data.get('method')
+        if not method or method in ignored_methods:
+            return
+        elif method in known_methods:
+            return cls(method, data if raw is None else raw)
+        else:
+            raise RuntimeError(f'unknown message from inspect websocket, type {method}\n{data}')
+
+    @property
+    def method(self) -> str:
+        return self._method
+
+    @property
+    def full(self) -> Dict[str, Any]:
+        return self._raw if isinstance(self._raw, dict) else json.loads(self._raw)
+
+    def dumps(self) -> str:
+        """
+        The message as JSON, the raw message if it's stored as text.
+        """
+        if isinstance(self._raw, dict):
+            return json.dumps(self._raw)
+        return self._raw.decode() if isinstance(self._raw, bytes) else self._raw
+
+    @property
+    def size(self) -> int:
+        """
+        Approximate size of the message in memory, the length of the raw message.
+        """
+        return len(self.dumps()) if isinstance(self._raw, dict) else len(self._raw)
+
+    @property
+    def level(self) -> str:
+        self._decode()
+        return self._level
+
+    @property
+    def args(self) -> Optional[List[Any]]:
+        self._decode()
+        return self._args
+
+    @property
+    def message(self) -> str:
+        self._decode()
+        return self._message
+
+    @property
+    def file(self) -> str:
+        self._decode()
+        return self._file
+
+    @property
+    def line(self) -> int:
+        self._decode()
+        return self._line
+
+    @property
+    def headers(self) -> Optional[Dict[str, str]]:
+        self._decode()
+        return self._headers
+
+    def _decode(self) -> None:
+        if self._level is not None:
+            return
+        # debug(self.full)
+        params = self.full['params']
+        method = self._method
+        self._args = self._headers = None
         if method == 'Runtime.consoleAPICalled':
-            self.level = params['type'].upper()
-            self.args = [self.parse_arg(arg) for arg in params['args']]
-            self.message = ', '.join(json.dumps(arg) for arg in self.args)
+            self._args = [self.parse_arg(arg) for arg in params['args']]
+            self._message = ', '.join(json.dumps(arg) for arg in self._args)
             frame = params['stackTrace']['callFrames'][0]
-            self.file = frame['url']
-            self.line = frame['lineNumber'] + 1
+            self._file = frame['url']
+            self._line = frame['lineNumber'] + 1
+            level = params['type'].upper()
         elif method == 'Runtime.exceptionThrown':
-            self.level = 'ERROR'
             details = params['exceptionDetails']
-            self.message = details['exception']['description']
-            self.file = details['url']
-            self.line = details['lineNumber'] + 1
+            self._message = details['exception']['description']
+            self._file = details['url']
+            self._line = details['lineNumber'] + 1
+            level = 'ERROR'
         elif method == 'Network.requestWillBeSent':
-            self.level = 'INFO'
             request = params['request']
-            self.message = 'request {method} {url}'.format(**request)
-            self.headers = request['headers']
-            self.file = '<unknown>'
-            self.line = params['initiator']['lineNumber'] + 1
+            self._message = 'request {method} {url}'.format(**request)
+            self._headers = request['headers']
+            self._file = '<unknown>'
+            self._line = params['initiator']['lineNumber'] + 1
+            level = 'INFO'
         else:
             assert method == 'Network.responseReceived', method
-            self.level = 'INFO'
             response = params['response']
-            self.message = 'response {status}'.format(**response)
-            self.headers = response['headers']
-            self.file = '<unknown>'
-            self.line = 0
-
-    @classmethod
-    def from_raw(cls, data: Dict[str, Any]) -> Optional['LogMsg']:
-        method = data.get('method')
-        if not method or method in ignored_methods:
-            return
-        elif method in known_methods:
-            return cls(method, data)
-        else:
-            raise RuntimeError(f'unknown message from inspect websocket, type {method}\n{data}')
+            self._message = 'response {status}'.format(**response)
+            self._headers = response['headers']
+            self._file = '<unknown>'
+            self._line = 0
+            level = 'INFO'
+        # set last since it marks the message as decoded
+        self._level = level
 
     @classmethod
     def parse_arg(cls, arg: Dict[str, Any]) -> Any:
@@ -127,9 +483,10 @@ class LogMsg:
             # no good python equivalent
             return '<undefined>'
 
-        # TODO in theory to get more information about objects we need to do
-        # send a "Runtime.getProperties" message
-        if arg_type == 'object' and (description := arg.get('description')):
+        if 'expanded' in arg:
+            # set by Inspector._expand_args()
+            return arg['expanded']
+        elif arg_type == 'object' and (description := arg.get('description')):
             return description
         else:  # pragma: no cover
             warnings.warn(f'unknown inspect log argument {arg}')
@@ -139,7 +496,9 @@ class LogMsg:
         if isinstance(other, str):
             return other == str(self)
         elif isinstance(other, dict):
-            self_dict = {k: self.__dict__[k] for k in other.keys()}
+            if not all(k in self._fields for k in other):
+                return False
+            self_dict = {k: getattr(self, k) for k in other.keys()}
             return other == self_dict
         else:
             return False
@@ -151,7 +510,9 @@ class LogMsg:
         return str(self).startswith(*s)
 
     def __str__(self):
-        return f'{self.level} {self.file}:{self.line}> {self.message}'
+        if self._str is None:
+            self._str = f'{self.level} {self.file}:{self.line}> {self.message}'
+        return self._str
 
     def __repr__(self):
         return repr(str(self))
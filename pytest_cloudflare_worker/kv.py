@@ -0,0 +1,157 @@
+"""
+In-memory stand-in for workers KV namespaces, bound in place of "kv_namespace" bindings by the emulator.
+"""
+
+import base64
+import json
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+__all__ = 'KVNamespace', 'KVStore'
+
+Value = Union[str, bytes]
+# key -> (value, expiration as a unix timestamp or None)
+Entries = Dict[str, Tuple[Value, Optional[float]]]
+
+
+class KVNamespace:
+    """
+    One KV namespace with the methods of the workers KV API which worker stubs use, plus bulk seed() and dump().
+
+    Expired keys are treated as missing and removed when they're next read.
+    """
+
+    def __init__(self, namespace_id: str):
+        self.namespace_id = namespace_id
+        self._entries: Entries = {}
+        self._lock = Lock()
+
+    def get(self, key: str, type: str = 'text') -> Any:
+        with self._lock:
+            entry = self._live_entry(key)
+        if entry is None:
+            return None
+        value = entry[0]
+        if type == 'json':
+            return json.loads(value)
+        elif type == 'arrayBuffer':
+            return value.encode() if isinstance(value, str) else value
+        else:
+            return value.decode() if isinstance(value, bytes) else value
+
+    def put(
+        self, key: str, value: Value, *, expiration: Optional[float] = None, expiration_ttl: Optional[float] = None
+    ) -> None:
+        with self._lock:
+            self._entries[key] = value, expiry(expiration, expiration_ttl)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def list(self, *, prefix: str = '', limit: int = 1000) -> List[str]:
+        """
+        Sorted keys which start with prefix, like the "keys" of KV's list() without pagination.
+        """
+        now = time()
+        with self._lock:
+            keys = [k for k, (_, exp) in self._entries.items() if k.startswith(prefix) and (exp is None or exp > now)]
+        return sorted(keys)[:limit]
+
+    def seed(self, data: Union[Mapping[str, Value], Path, str]) -> int:
+        """
+        Load many keys in one go, either from a mapping of key to value, or from a JSON lines file where each line
+        is an object in the format of "wrangler kv:bulk put": {"key", "value", "expiration", "expiration_ttl",
+        "base64"}. Returns the number of keys loaded.
+        """
+        if isinstance(data, (Path, str)):
+            entries = dict(read_jsonl(Path(data)))
+        else:
+            entries = {k: (v, None) for k, v in data.items()}
+        with self._lock:
+            self._entries.update(entries)
+        return len(entries)
+
+    def dump(self) -> Dict[str, Value]:
+        """
+        All keys which haven't expired, with their values.
+        """
+        now = time()
+        with self._lock:
+            return {k: v for k, (v, exp) in self._entries.items() if exp is None or exp > now}
+
+    def snapshot(self) -> Entries:
+        with self._lock:
+            return dict(self._entries)
+
+    def restore(self, snapshot: Entries) -> None:
+        with self._lock:
+            self._entries = dict(snapshot)
+
+    def _live_entry(self, key: str) -> Optional[Tuple[Value, Optional[float]]]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time():
+            del self._entries[key]
+            return None
+        return entry
+
+    def __len__(self) -> int:
+        return len(self.dump())
+
+    def __repr__(self) -> str:
+        return f'<KVNamespace {self.namespace_id} {len(self)} keys>'
+
+
+def expiry(expiration: Optional[float], expiration_ttl: Optional[float]) -> Optional[float]:
+    if expiration_ttl is not None:
+        return time() + expiration_ttl
+    return expiration
+
+
+def read_jsonl(path: Path) -> Iterable[Tuple[str, Tuple[Value, Optional[float]]]]:
+    with path.open() as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+                key, value = obj['key'], obj['value']
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(f'{path}:{line_no}: invalid KV entry, {e!r}') from e
+            if obj.get('base64'):
+                value = base64.b64decode(value)
+            yield key, (value, expiry(obj.get('expiration'), obj.get('expiration_ttl')))
+
+
+class KVStore:
+    """
+    The KV namespaces of an emulator, keyed by namespace id, namespaces are created when first used so they
+    outlive previews and redeploys.
+    """
+
+    def __init__(self):
+        self.namespaces: Dict[str, KVNamespace] = {}
+        self._lock = Lock()
+
+    def namespace(self, namespace_id: str) -> KVNamespace:
+        with self._lock:
+            ns = self.namespaces.get(namespace_id)
+            if ns is None:
+                self.namespaces[namespace_id] = ns = KVNamespace(namespace_id)
+            return ns
+
+    def snapshot(self) -> Dict[str, Entries]:
+        """
+        Copy of every namespace's entries which can be passed to restore() to undo later changes.
+        """
+        with self._lock:
+            namespaces = list(self.namespaces.values())
+        return {ns.namespace_id: ns.snapshot() for ns in namespaces}
+
+    def restore(self, snapshot: Dict[str, Entries]) -> None:
+        with self._lock:
+            namespaces = list(self.namespaces.values())
+        for ns in namespaces:
+            ns.restore(snapshot.get(ns.namespace_id, {}))
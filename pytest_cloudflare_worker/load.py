@@ -0,0 +1,176 @@
+import itertools
+from collections import Counter
+from threading import Thread
+from time import monotonic, perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+__all__ = 'LatencyHistogram', 'LoadResult', 'run_load'
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies in the style of HdrHistogram: values are recorded in microseconds in buckets whose width
+    is at most 1/2**(sub_bucket_bits - 1) of their value, so percentiles are accurate to ~1.6% by default while
+    memory depends on the range of values, not the number of samples.
+    """
+
+    def __init__(self, sub_bucket_bits: int = 7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts: Dict[Tuple[int, int], int] = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def record(self, seconds: float) -> None:
+        us = max(int(seconds * 1_000_000), 0)
+        shift = max(us.bit_length() - self.sub_bucket_bits, 0)
+        # (shift, us >> shift) sorts in the same order as the values in each bucket
+        self.counts[(shift, us >> shift)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        assert other.sub_bucket_bits == self.sub_bucket_bits, 'histograms must have the same precision'
+        self.counts.update(other.counts)
+        self.count += other.count
+        self.total += other.total
+        for attr, func in (('min', min), ('max', max)):
+            values = [v for v in (getattr(self, attr), getattr(other, attr)) if v is not None]
+            setattr(self, attr, func(values) if values else None)
+
+    def percentile(self, percent: float) -> float:
+        """
+        Latency in seconds which percent of recorded values are less than or equal to, 0 if nothing is recorded.
+        """
+        if not self.count:
+            return 0.0
+        target = max(self.count * percent / 100, 1)
+        seen = 0
+        for (shift, sub_bucket), count in sorted(self.counts.items()):
+            seen += count
+            if seen >= target:
+                # highest value in the bucket, this never understates a latency
+                return min((((sub_bucket + 1) << shift) - 1) / 1_000_000, self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def buckets(self) -> Iterator[Tuple[float, float, int]]:
+        """
+        Yield (lower bound, upper bound, count) in seconds for each bucket with values.
+        """
+        for (shift, sub_bucket), count in sorted(self.counts.items()):
+            yield (sub_bucket << shift) / 1_000_000, ((sub_bucket + 1) << shift) / 1_000_000, count
+
+
+class LoadResult:
+    """
+    Outcome of a load test, see TestClient.load().
+    """
+
+    def __init__(self, *, concurrency: int, duration: float, histogram: LatencyHistogram, status_codes: Counter):
+        self.concurrency = concurrency
+        self.duration = duration
+        self.histogram = histogram
+        self.status_codes = status_codes
+        self.requests = sum(status_codes.values())
+        # 5xx responses, TestClient.request() would raise WorkerError for these
+        self.worker_errors = sum(v for k, v in status_codes.items() if isinstance(k, int) and k >= 500)
+        # requests which failed without a response, e.g. connection errors
+        self.exceptions = sum(v for k, v in status_codes.items() if not isinstance(k, int))
+        self.errors = self.worker_errors + self.exceptions
+
+    @property
+    def throughput(self) -> float:
+        """
+        Requests per second.
+        """
+        return self.requests / self.duration if self.duration else 0.0
+
+    @property
+    def error_rate(self) -> float:
+        return self.errors / self.requests if self.requests else 0.0
+
+    @property
+    def p50(self) -> float:
+        return self.histogram.percentile(50)
+
+    @property
+    def p90(self) -> float:
+        return self.histogram.percentile(90)
+
+    @property
+    def p99(self) -> float:
+        return self.histogram.percentile(99)
+
+    @property
+    def max(self) -> float:
+        return self.histogram.max or 0.0
+
+    def __str__(self) -> str:
+        return (
+            f'{self.requests} requests in {self.duration:0.2f}s with concurrency {self.concurrency}, '
+            f'{self.throughput:0.1f} req/s, p50={self.p50 * 1000:0.1f}ms p90={self.p90 * 1000:0.1f}ms '
+            f'p99={self.p99 * 1000:0.1f}ms max={self.max * 1000:0.1f}ms, errors {self.error_rate:0.2%} '
+            f'({self.worker_errors} worker errors)'
+        )
+
+    def __repr__(self) -> str:
+        return f'<LoadResult {self}>'
+
+
+def run_load(
+    send: Callable[[], int], *, concurrency: int, duration: Optional[float] = None, requests: Optional[int] = None
+) -> LoadResult:
+    """
+    Call send() from concurrency threads until duration seconds have passed or requests calls have been made.
+
+    send() should make one request and return its status code, exceptions are counted by type name in
+    LoadResult.status_codes. Each thread records into its own histogram, they're merged at the end.
+    """
+    if (duration is None) == (requests is None):
+        raise ValueError('exactly one of "duration" and "requests" must be set')
+    if concurrency < 1:
+        raise ValueError('concurrency must be at least 1')
+
+    # next() on itertools.count is atomic, so it's a lock free way to share the request budget between threads
+    counter = itertools.count()
+    deadline = None if duration is None else monotonic() + duration
+    results: List[Tuple[LatencyHistogram, Counter]] = []
+
+    def more() -> bool:
+        return next(counter) < requests if deadline is None else monotonic() < deadline
+
+    def run() -> None:
+        histogram = LatencyHistogram()
+        status_codes = Counter()
+        results.append((histogram, status_codes))
+        while more():
+            start = perf_counter()
+            try:
+                status = send()
+            except Exception as e:
+                status_codes[type(e).__name__] += 1
+            else:
+                histogram.record(perf_counter() - start)
+                status_codes[status] += 1
+
+    threads = [Thread(target=run, name=f'cf-load-{i}', daemon=True) for i in range(concurrency)]
+    start = perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    time_taken = perf_counter() - start
+
+    histogram = LatencyHistogram()
+    status_codes = Counter()
+    for h, s in results:
+        histogram.merge(h)
+        status_codes.update(s)
+    return LoadResult(concurrency=concurrency, duration=time_taken, histogram=histogram, status_codes=status_codes)
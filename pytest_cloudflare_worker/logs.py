@@ -0,0 +1,315 @@
+import gzip
+import json
+from bisect import bisect_left
+from collections import defaultdict, deque
+from itertools import islice
+from pathlib import Path
+from threading import Condition
+from time import monotonic
+from typing import IO, TYPE_CHECKING, Any, Callable, Deque, Dict, Iterator, List, Optional, Union
+
+if TYPE_CHECKING:
+    from .inspect import LogMsg
+
+__all__ = 'LogStore', 'RequestLogs', 'read_log_file'
+
+
+class LogStore:
+    """
+    Log messages received from the inspect websocket for one session.
+
+    Behaves like a read-only list of LogMsg, with positions usable as cursors so a request's logs can be found and
+    waited for by checking only the entries received since it was sent. Entries are indexed by level, file and
+    method, the index is extended to cover new entries when it's queried, so messages aren't decoded as they arrive.
+
+    By default every entry is kept, with max_count and/or max_bytes it's a ring buffer: the oldest entries are
+    evicted, and written to spill_path as gzipped JSON lines if it's set, see limit(). Positions are counted from
+    the first entry received, so len() is the number of entries received and evicted entries are skipped by
+    since(), slices and iteration.
+
+    If mirror is set, entries are also appended to it, e.g. to collect the logs of several sessions together.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_count: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        spill_path: Optional[Path] = None,
+        mirror: Optional['LogStore'] = None,
+    ):
+        self.received = Condition()
+        self.mirror = mirror
+        self._logs: Deque['LogMsg'] = deque()
+        # position of the oldest entry in _logs
+        self._first = 0
+        self._indexed = 0
+        self._index: Dict[str, Dict[Any, List[int]]] = {f: defaultdict(list) for f in ('level', 'file', 'method')}
+        self.max_count: Optional[int] = None
+        self.max_bytes: Optional[int] = None
+        self.spill_path: Optional[Path] = None
+        self._sizes: Deque[int] = deque()
+        self._bytes = 0
+        self._spill_file: Optional[IO[str]] = None
+        self.limit(max_count=max_count, max_bytes=max_bytes, spill_path=spill_path)
+
+    def limit(
+        self,
+        *,
+        max_count: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        spill_path: Optional[Path] = None,
+    ) -> None:
+        """
+        Keep at most max_count entries and/or max_bytes of raw messages in memory, evicting the oldest,
+        evicted entries are appended to spill_path if it's set, use spilled() or read_log_file() to read them.
+        """
+        with self.received:
+            if (max_bytes is None) != (self.max_bytes is None):
+                self._sizes = deque(msg.size for msg in self._logs) if max_bytes is not None else deque()
+                self._bytes = sum(self._sizes)
+            self.max_count = max_count
+            self.max_bytes = max_bytes
+            if spill_path != self.spill_path:
+                self._close_spill()
+                self.spill_path = spill_path
+            self._evict()
+
+    def append(self, msg: 'LogMsg') -> None:
+        with self.received:
+            self._logs.append(msg)
+            if self.max_bytes is not None:
+                size = msg.size
+                self._sizes.append(size)
+                self._bytes += size
+            self._evict()
+            self.received.notify_all()
+        if self.mirror is not None:
+            self.mirror.append(msg)
+
+    def cursor(self) -> int:
+        """
+        Position of the next entry, use with since() and wait_for() to consider only entries received after now.
+        """
+        return self._first + len(self._logs)
+
+    def since(
+        self, cursor: int = 0, *, level: Optional[str] = None, file: Optional[str] = None, method: Optional[str] = None
+    ) -> List['LogMsg']:
+        """
+        Entries from cursor onwards, optionally only those with the given level, file and/or method.
+        """
+        filters = {k: v for k, v in (('level', level), ('file', file), ('method', method)) if v is not None}
+        if not filters:
+            return self._slice(cursor)
+
+        with self.received:
+            self._update_index()
+            start = max(cursor, self._first)
+            positions = None
+            for field, value in filters.items():
+                field_positions = self._index[field].get(value, [])
+                field_positions = field_positions[bisect_left(field_positions, start) :]
+                positions = field_positions if positions is None else sorted(set(positions) & set(field_positions))
+            return [self._logs[i - self._first] for i in positions]
+
+    def wait_for(
+        self, predicate: Callable[['LogMsg'], Any], timeout: float, *, cursor: int = 0, count: int = 1
+    ) -> List['LogMsg']:
+        """
+        Wait until at least count entries from cursor onwards match predicate, return all matching entries.
+
+        Each entry is checked once, so the cost depends on the number of new entries, not the length of the log.
+        If the timeout expires, the entries matched so far are returned.
+        """
+        matches = []
+        checked = cursor
+        deadline = monotonic() + timeout
+        with self.received:
+            while True:
+                checked = max(checked, self._first)
+                new = self._slice(checked)
+                checked += len(new)
+                matches += [msg for msg in new if predicate(msg)]
+                remaining = deadline - monotonic()
+                if len(matches) >= count or remaining <= 0:
+                    return matches
+                self.received.wait(remaining)
+
+    def wait_for_count(self, count: Optional[int], timeout: float) -> bool:
+        """
+        Wait until at least count entries have been received, if count is None, wait for the whole timeout.
+        """
+        with self.received:
+            if count is None:
+                self.received.wait_for(lambda: False, timeout)
+                return True
+            else:
+                return self.received.wait_for(lambda: self.cursor() >= count, timeout)
+
+    def wait_for_quiet(self, quiet: float, timeout: float) -> None:
+        """
+        Wait until no entries have been received for quiet seconds, or for at most timeout seconds.
+        """
+        deadline = monotonic() + timeout
+        with self.received:
+            while (remaining := deadline - monotonic()) > 0:
+                count = self.cursor()
+                self.received.wait(min(quiet, remaining))
+                if self.cursor() == count:
+                    return
+
+    def spilled(self) -> Iterator['LogMsg']:
+        """
+        Lazily iterate over the entries evicted to spill_path, oldest first.
+        """
+        with self.received:
+            if self._spill_file is None:
+                return iter(())
+            self._spill_file.flush()
+        return read_log_file(self.spill_path)
+
+    def close(self) -> None:
+        """
+        Finish writing the spill file, entries evicted later are appended to it as a new gzip member.
+        """
+        with self.received:
+            self._close_spill()
+
+    def _evict(self) -> None:
+        over_count = 0 if self.max_count is None else len(self._logs) - self.max_count
+        while self._logs and (over_count > 0 or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+            msg = self._logs.popleft()
+            self._first += 1
+            over_count -= 1
+            if self.max_bytes is not None:
+                self._bytes -= self._sizes.popleft()
+            if self.spill_path is not None:
+                if self._spill_file is None:
+                    self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+                    self._spill_file = gzip.open(self.spill_path, 'at', compresslevel=6)
+                self._spill_file.write(msg.dumps() + '\n')
+
+    def _close_spill(self) -> None:
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+    def _slice(self, start: int, stop: Optional[int] = None) -> List['LogMsg']:
+        """
+        Entries from position start to stop which are still in memory.
+        """
+        with self.received:
+            length = len(self._logs)
+            i = min(max(start - self._first, 0), length)
+            j = length if stop is None else min(max(stop - self._first, i), length)
+            if i > length // 2:
+                # iterating a deque from the end is cheaper for the recent entries which are usually wanted
+                return list(islice(reversed(self._logs), length - j, length - i))[::-1]
+            return list(islice(self._logs, i, j))
+
+    def _update_index(self) -> None:
+        with self.received:
+            start = max(self._indexed, self._first)
+            for i, msg in enumerate(self._slice(start), start=start):
+                self._index['level'][msg.level].append(i)
+                self._index['file'][msg.file].append(i)
+                self._index['method'][msg.method].append(i)
+            self._indexed = self.cursor()
+            if self._first:
+                # drop positions of evicted entries, so the index doesn't grow without limit either
+                for field_index in self._index.values():
+                    for positions in field_index.values():
+                        del positions[: bisect_left(positions, self._first)]
+
+    def __len__(self) -> int:
+        return self.cursor()
+
+    def __getitem__(self, item: Union[int, slice]) -> Union['LogMsg', List['LogMsg']]:
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self.cursor())
+            return self._slice(start, stop)[::step]
+        with self.received:
+            position = item + self.cursor() if item < 0 else item
+            if not self._first <= position < self.cursor():
+                raise IndexError('log entry evicted' if 0 <= position < self._first else 'log index out of range')
+            return self._logs[position - self._first]
+
+    def __iter__(self) -> Iterator['LogMsg']:
+        return iter(self._slice(self._first))
+
+    def __eq__(self, other: Any) -> bool:
+        return self._slice(self._first) == (other._slice(other._first) if isinstance(other, LogStore) else other)
+
+    def __repr__(self) -> str:
+        return repr(self._slice(self._first))
+
+
+def read_log_file(path: Path) -> Iterator['LogMsg']:
+    """
+    Lazily read log entries from a gzipped JSON lines file written by LogStore, a file which is still being written
+    is read up to the last flush.
+    """
+    from .inspect import LogMsg
+
+    with gzip.open(path, 'rt') as f:
+        try:
+            for line in f:
+                msg = LogMsg.from_raw(json.loads(line), line.rstrip('\n'))
+                if msg:
+                    yield msg
+        except EOFError:
+            # the end of a gzip member which hasn't been closed yet
+            pass
+
+
+class RequestLogs:
+    """
+    Logs of one request, available as response.logs: entries of its session's LogStore from when the request was
+    sent until the next request in the same session is sent, see RequestSession.begin(). Requests made in one session
+    at the same time can't be told apart, their logs include each other's and overlapping is set.
+
+    Logs arrive after the response, use wait() or wait_for() to wait for them. Behaves like a read-only list of
+    LogMsg of the entries received so far.
+    """
+
+    def __init__(self, store: LogStore, start: int):
+        self.store = store
+        self.start = start
+        self.end: Optional[int] = None
+        self.overlapping = False
+
+    def wait(self, count: int, timeout: float = 5) -> 'RequestLogs':
+        """
+        Wait until the request has at least count logs, raise TimeoutError if they don't arrive within timeout.
+        """
+        if len(self.wait_for(lambda msg: True, timeout, count=count)) < count:
+            raise TimeoutError(f'{len(self)} logs received for the request, expected {count}')
+        return self
+
+    def wait_for(self, predicate: Callable[['LogMsg'], Any], timeout: float, *, count: int = 1) -> List['LogMsg']:
+        """
+        Wait until at least count of the request's logs match predicate, return all matching logs, see
+        LogStore.wait_for().
+        """
+        if self.end is None:
+            matches = self.store.wait_for(predicate, timeout, cursor=self.start, count=count)
+            if self.end is None:
+                return matches
+        # no more logs will be attributed to the request
+        return [msg for msg in self if predicate(msg)]
+
+    def __len__(self) -> int:
+        return len(self.store[self.start : self.end])
+
+    def __getitem__(self, item: Union[int, slice]) -> Union['LogMsg', List['LogMsg']]:
+        return self.store[self.start : self.end][item]
+
+    def __iter__(self) -> Iterator['LogMsg']:
+        return iter(self.store[self.start : self.end])
+
+    def __eq__(self, other: Any) -> bool:
+        return self.store[self.start : self.end] == (list(other) if isinstance(other, RequestLogs) else other)
+
+    def __repr__(self) -> str:
+        return repr(self.store[self.start : self.end])
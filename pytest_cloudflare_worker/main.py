@@ -1,21 +1,35 @@
 import json
 import os
 import re
+import shutil
 import subprocess
+import threading
 import uuid
+from collections import defaultdict
+from concurrent.futures import Future, wait
 from pathlib import Path
-from threading import Event, Thread
-from time import time
-from typing import Any, Dict, List, Literal, Optional, Tuple, TypedDict
+from time import monotonic, perf_counter
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, TypedDict
 
-import requests
 import toml
-from requests import Response, Session
-
-from .inspect import LogMsg, inspect
+from requests import Request, Response, Session
+from requests.adapters import DEFAULT_POOLSIZE
+
+from .cache import BuildCache, DeployCache, built_script_path
+from .cassette import Cassette
+from .inspect import Inspector, InspectPool, LogMsg, inspect_root
+from .load import LoadResult, run_load
+from .logs import LogStore, RequestLogs
+from .perf import ClientStats
+from .subrequests import SubrequestLog
+from .transport import MultipartUpload, RequestTiming, RetryPolicy, TimingAdapter, shared_session
 from .version import VERSION
 
-__all__ = 'deploy', 'TestClient', 'WorkerError'
+__all__ = 'deploy', 'TestClient', 'WorkerError', 'StalePreviewError'
+
+api_root = 'https://api.cloudflare.com'
+preview_root = 'https://cloudflareworkers.com'
+worker_root = 'https://00000000000000000000000000000000.cloudflareworkers.com'
 
 
 class Binding(TypedDict, total=False):
@@ -26,36 +40,82 @@ class Binding(TypedDict, total=False):
 
 
 def deploy(
-    wrangler_dir: Path, *, authenticate: bool, test_client: Optional['TestClient'] = None
+    wrangler_dir: Path,
+    *,
+    authenticate: bool,
+    test_client: Optional['TestClient'] = None,
+    cache: Optional[DeployCache] = None,
+    build_cache: Optional[BuildCache] = None,
+    api_root: str = api_root,
+    preview_root: str = preview_root,
+    environment: Optional[str] = None,
+    local_kv: bool = False,
+    retry: Optional[RetryPolicy] = None,
 ) -> Tuple[str, List[Binding]]:
-    source_path, wrangler_data = build_source(wrangler_dir)
+    """
+    Upload the worker as a preview, return its preview_id and bindings.
+
+    local_kv binds KV namespaces without authenticating, for previews on the emulator which stands in for KV.
+    Uploads which fail with a 429 or 5xx response are retried according to retry, by default RetryPolicy().
+    The upload uses test_client's connections if it's set, otherwise connections shared by all deploys.
+    When the preview comes from cache, test_client is given a function to invalidate it and deploy again, used if
+    its first request finds the preview has gone, see BaseTestClient.stale_preview_redeploy.
+    """
+    source_path, wrangler_data = build_source(wrangler_dir, build_cache=build_cache, environment=environment)
 
     if authenticate:
         url = (
-            f'https://api.cloudflare.com/client/v4/'
+            f'{api_root}/client/v4/'
             f'accounts/{wrangler_data["account_id"]}/workers/scripts/{wrangler_data["name"]}/preview'
         )
         api_token = get_api_token()
         headers = {'Authorization': f'Bearer {api_token}'}
     else:
-        url = 'https://cloudflareworkers.com/script'
+        url = f'{preview_root}/script'
         headers = None
 
-    bindings = build_bindings(wrangler_data, authenticate)
+    bindings = build_bindings(wrangler_data, authenticate, local_kv=local_kv)
 
     # debug(bindings)
     script_name = source_path.stem
     metadata = json.dumps({'bindings': bindings, 'body_part': script_name}, separators=(',', ':'))
 
-    files = {
-        'metadata': ('metadata.json', metadata, 'application/json'),
-        script_name: (source_path.name, source_path.read_bytes(), 'application/javascript'),
-    }
-
-    if isinstance(test_client, TestClient):
-        r = test_client.direct_request('POST', url, files=files, headers=headers)
-    else:
-        r = requests.post(url, files=files, headers=headers)
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.key(url, source_path, metadata)
+        if preview_id := cache.get(cache_key):
+            if isinstance(test_client, TestClient):
+
+                def redeploy() -> Tuple[str, List[Binding]]:
+                    cache.invalidate(cache_key)
+                    return deploy(
+                        wrangler_dir,
+                        authenticate=authenticate,
+                        test_client=test_client,
+                        cache=cache,
+                        build_cache=build_cache,
+                        api_root=api_root,
+                        preview_root=preview_root,
+                        environment=environment,
+                        local_kv=local_kv,
+                        retry=retry,
+                    )
+
+                test_client.stale_preview_redeploy = redeploy
+            return preview_id, bindings
+
+    # the script is streamed from disk as it's uploaded rather than read into memory
+    upload = MultipartUpload(
+        [
+            ('metadata', 'metadata.json', 'application/json', metadata),
+            (script_name, source_path.name, 'application/javascript', source_path),
+        ]
+    )
+    headers = {**(headers or {}), 'content-type': upload.content_type}
+
+    send = test_client.direct_request if isinstance(test_client, TestClient) else shared_session().request
+    retry = RetryPolicy() if retry is None else retry
+    r = retry.send(lambda: send('POST', url, data=upload, headers=headers))
 
     # debug(r.request.body)
     if r.status_code not in {200, 201}:
@@ -63,12 +123,22 @@ def deploy(
     obj = r.json()
 
     if authenticate:
-        return obj['result']['preview_id'], bindings
+        preview_id = obj['result']['preview_id']
     else:
-        return obj['id'], bindings
+        preview_id = obj['id']
 
+    if cache_key is not None:
+        cache.set(cache_key, preview_id)
+    return preview_id, bindings
 
-def build_bindings(wrangler_data: Dict[str, Any], authenticate: bool) -> List[Binding]:
+
+def build_bindings(wrangler_data: Dict[str, Any], authenticate: bool, *, local_kv: bool = False) -> List[Binding]:
+    """
+    Bindings for a preview of the worker, wrangler_data should already be for the environment, see environment_data.
+
+    KV namespaces are only bound when authenticating, or with local_kv where namespaces without a preview_id use
+    their id since nothing is shared with cloudflare.
+    """
     bindings: List[Binding] = [{'name': '__TESTING__', 'type': 'plain_text', 'text': 'TRUE'}]
 
     vars = wrangler_data.get('vars')
@@ -80,22 +150,76 @@ def build_bindings(wrangler_data: Dict[str, Any], authenticate: bool) -> List[Bi
     if vars:
         bindings += [{'name': k, 'type': 'plain_text', 'text': v} for k, v in vars.items()]
 
-    if authenticate:
+    if authenticate or local_kv:
         for namespace in wrangler_data.get('kv_namespaces', []):
-            if preview_id := namespace.get('preview_id'):
+            preview_id = namespace.get('preview_id')
+            if local_kv and not preview_id:
+                preview_id = namespace.get('id')
+            if preview_id:
                 bindings.append({'name': namespace['binding'], 'type': 'kv_namespace', 'namespace_id': preview_id})
 
     return bindings
 
 
-def build_source(wrangler_dir: Path) -> Tuple[Path, Dict[str, Any]]:
+# keys which environments don't inherit from the top level of wrangler.toml
+non_inherited_keys = {'vars', 'kv_namespaces', 'durable_objects', 'preview', 'env'}
+
+
+def environment_data(wrangler_data: Dict[str, Any], environment: Optional[str]) -> Dict[str, Any]:
+    """
+    Configuration for an "[env.<environment>]" section of wrangler.toml, following wrangler's rules for inheritance.
+    """
+    if environment is None:
+        return wrangler_data
+    try:
+        env = wrangler_data['env'][environment]
+    except KeyError:
+        raise ValueError(f'environment "{environment}" not found in wrangler.toml')
+    data = {k: v for k, v in wrangler_data.items() if k not in non_inherited_keys}
+    data['name'] = f'{wrangler_data["name"]}-{environment}'
+    data.update(env)
+    return data
+
+
+# builds of the same directory can't run concurrently as they write to the same output
+_build_locks: Dict[Path, threading.Lock] = defaultdict(threading.Lock)
+_build_locks_lock = threading.Lock()
+
+
+def build_source(
+    wrangler_dir: Path, *, build_cache: Optional[BuildCache] = None, environment: Optional[str] = None
+) -> Tuple[Path, Dict[str, Any]]:
+    """
+    Build the worker if required, return the path to the script and the wrangler.toml data for the environment.
+
+    "wrangler build" always writes dist/worker.js, the script is copied from there to a file for the environment,
+    see built_script_path(), so a build for another environment can't replace it while it's being uploaded.
+    """
     wrangler_path = wrangler_dir / 'wrangler.toml'
-    wrangler_data = toml.loads(wrangler_path.read_text())
+    wrangler_data = environment_data(toml.loads(wrangler_path.read_text()), environment)
     if wrangler_data['type'] == 'javascript':
         source_path = wrangler_dir / 'index.js'
     else:
-        subprocess.run(('wrangler', 'build'), check=True, cwd=str(wrangler_dir))
-        source_path = wrangler_dir / 'dist' / 'worker.js'
+        source_path = built_script_path(wrangler_dir, environment)
+        build_args = ('wrangler', 'build') if environment is None else ('wrangler', 'build', '--env', environment)
+        with _build_locks_lock:
+            build_lock = _build_locks[wrangler_dir.resolve()]
+        with build_lock:
+            fingerprint = None
+            if build_cache is not None:
+                fingerprint = build_cache.fingerprint(wrangler_dir, environment)
+                if build_cache.is_fresh(wrangler_dir, fingerprint, source_path, environment):
+                    build_cache.hits += 1
+                    return source_path, wrangler_data
+                build_cache.misses += 1
+
+            subprocess.run(build_args, check=True, cwd=str(wrangler_dir))
+            source_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = source_path.with_suffix('.tmp')
+            shutil.copyfile(wrangler_dir / 'dist' / 'worker.js', tmp_path)
+            tmp_path.replace(source_path)
+            if build_cache is not None:
+                build_cache.store(wrangler_dir, source_path, environment)
     assert source_path.is_file(), f'source path "{source_path}" not found'
     return source_path, wrangler_data
 
@@ -109,107 +233,613 @@ def get_api_token() -> str:
     return toml.loads(api_token_path.read_text())['api_token']
 
 
+# body of the response to a request for a preview which doesn't exist
+preview_not_found_re = re.compile(rb'preview\b.*\bnot found', re.I)
+
+
+def preview_not_found(response: Response) -> bool:
+    return response.status_code == 404 and bool(preview_not_found_re.search(response.content[:1000]))
+
+
+def resendable_body(kwargs: Dict[str, Any]) -> bool:
+    """
+    Whether the body of a request made with kwargs can be sent again, generators and files are consumed by sending.
+    """
+    return kwargs.get('files') is None and all(
+        isinstance(kwargs.get(k), (type(None), bytes, str, dict, list, tuple)) for k in ('data', 'content')
+    )
+
+
 class WorkerError(Exception):
-    def __init__(self, logs: List['LogMsg']):
-        super().__init__('\n'.join(str(msg) for msg in logs))
+    def __init__(self, logs: List['LogMsg'], *, overlapping: bool = False):
+        message = '\n'.join(str(msg) for msg in logs)
+        if overlapping:
+            message += '\n(other requests were in flight in the same session, these may be their errors)'
+        super().__init__(message)
         self.logs = logs
+        self.overlapping = overlapping
 
 
-class TestClient(Session):
-    __test__ = False
+class StalePreviewError(Exception):
+    """
+    Raised when a request found the cached preview had gone, the worker has been redeployed but the request's body
+    can't be sent again, e.g. it was a generator.
+    """
+
+    def __init__(self, preview_id: str):
+        super().__init__(
+            f'preview {preview_id} had gone, the worker has been redeployed but the request body was consumed '
+            'so the request cannot be made again, make it again to use the new preview'
+        )
+        self.preview_id = preview_id
+
+
+class RequestSession:
+    """
+    A cloudflare session with its logs, see BaseTestClient. in_flight is the number of requests being made in the
+    session, settled is done once the logs of the requests which have had a response have all been received.
+    """
+
+    def __init__(self, session_id: str, logs: LogStore, inspector: Optional[Inspector] = None):
+        self.session_id = session_id
+        self.logs = logs
+        self.inspector = inspector
+        self.in_flight = 0
+        self.settled: Optional['Future[None]'] = None
+        # monotonic() time the last response in the session was received
+        self.finished = 0.0
+        # logs of requests which may still receive entries
+        self._open: List[RequestLogs] = []
+        self._begin_lock = threading.Lock()
+
+    def idle(self, settle_timeout: float) -> bool:
+        """
+        Whether a request can be made in the session without waiting for the logs of earlier requests.
+        """
+        if self.in_flight:
+            return False
+        settling = self._open and self.settled is not None and not self.settled.done()
+        return not settling or monotonic() > self.finished + settle_timeout
+
+    def finish(self, inspector: Optional[Inspector]) -> None:
+        """
+        Record that a request's response has been received, once none are in flight use inspector to find when
+        their logs have all arrived.
+        """
+        self.in_flight -= 1
+        self.finished = monotonic()
+        if not self.in_flight and inspector is not None:
+            self.settled = inspector.sync()
+
+    def begin(self, settle_timeout: float) -> RequestLogs:
+        """
+        Start the logs of a request in the session, ending the logs of earlier requests once they've settled,
+        waiting until settle_timeout after the last response at most.
+
+        Requests in flight in the session at the same time can't be told apart, their logs are left open and
+        marked as overlapping.
+        """
+        with self._begin_lock:
+            overlapping = self.in_flight > 1
+            if self._open and not overlapping:
+                if self.settled is not None:
+                    wait([self.settled], max(self.finished + settle_timeout - monotonic(), 0))
+                cursor = self.logs.cursor()
+                for request_logs in self._open:
+                    request_logs.end = cursor
+                self._open = []
+            logs = RequestLogs(self.logs, self.logs.cursor())
+            self._open.append(logs)
+            if overlapping:
+                for request_logs in self._open:
+                    request_logs.overlapping = True
+            return logs
+
+    def close(self) -> None:
+        if self.inspector is not None:
+            self.inspector.stop()
+        self.logs.close()
+
+
+class BaseTestClient:
+    """
+    State and behaviour shared by TestClient and AsyncTestClient: routing requests to the preview with a cookie,
+    rewriting fake_host and collecting logs from the inspect websocket.
+
+    Requests use the main cloudflare session. Since inspect events don't identify the request which caused them,
+    a request isn't sent in a session while another is in flight or until the logs of the last have all arrived,
+    which takes one round trip on the inspect websocket, so each response's logs are just those of its request.
+    Instead the request is routed to an idle session, or a new session taken from the inspect pool if there is one.
+    Concurrent requests use up to max_sessions sessions, beyond that they wait for one to be idle. inspect_logs has
+    the logs of every session.
+    """
 
     def __init__(
-        self, *, preview_id: Optional[str] = None, bindings: List[Binding] = None, fake_host: str = 'example.com'
+        self,
+        *,
+        preview_id: Optional[str],
+        bindings: Optional[List[Binding]],
+        fake_host: str,
+        inspect_pool_size: int,
+        root: str,
+        inspect_root: str,
+        max_sessions: int,
     ):
-        super().__init__()
         self._original_fake_host = fake_host
         self.fake_host = self._original_fake_host
         self.preview_id = preview_id
         self.bindings: List[Binding] = bindings or []
-        self._root = 'https://00000000000000000000000000000000.cloudflareworkers.com'
+        self._root = root
+        self._inspect_root = inspect_root
         self._session_id = uuid.uuid4().hex
-        self.headers = {'user-agent': f'pytest-cloudflare-worker/{VERSION}'}
-        self.inspect_logs = []
+        self.inspect_logs = LogStore()
+        self.subrequests = SubrequestLog()
+        self.stats = ClientStats()
 
         self.inspect_enabled = True
-        self._inspect_ready = Event()
-        self._inspect_stop = Event()
-        self._inspect_received = Event()
-        self._inspect_thread: Optional[Thread] = None
+        # levels of objects and arrays logged by the worker to expand, 0 to log only their description
+        self.inspect_expand_depth = 2
+        # limits on the logs kept in memory for each session, older logs are evicted and, if inspect_log_spill_dir
+        # is set, written to "<inspect_log_spill_dir>/<session id>.jsonl.gz", see LogStore.limit()
+        self.inspect_log_max_count: Optional[int] = None
+        self.inspect_log_max_bytes: Optional[int] = None
+        self.inspect_log_spill_dir: Optional[Path] = None
+        self._inspector: Optional[Inspector] = None
+        self.inspect_pool_size = inspect_pool_size
+        self._inspect_pool: Optional[InspectPool] = None
+
+        # maximum number of cloudflare sessions, each with its own inspect connection, used for concurrent requests
+        self.max_sessions = max_sessions
+        # route every request to the main session, e.g. while it's being profiled, logs of requests made at the same
+        # time are then marked as overlapping, see RequestSession.begin()
+        self.single_session = False
+        # longest to wait after a response for the inspect connection to confirm its logs have all arrived
+        self.inspect_log_settle_timeout = 2.0
+        # set by deploy() when the preview came from its cache, called if the first request finds the preview has
+        # gone, e.g. cloudflare dropped it before the cache's ttl, the request is then made again
+        self.stale_preview_redeploy: Optional[Callable[[], Tuple[str, List[Binding]]]] = None
+        self._redeploy_lock = threading.Lock()
+
+        self._sessions_lock = threading.Lock()
+        # notified when a request finishes or a session is added
+        self._sessions_changed = threading.Condition(self._sessions_lock)
+        # each session's logs are also added to inspect_logs
+        self._main_session = RequestSession(self._session_id, LogStore(mirror=self.inspect_logs))
+        # sessions for concurrent requests, stopped by new_cf_session()
+        self._extra_sessions: List[RequestSession] = []
+        # extra sessions being started
+        self._starting_sessions = 0
 
     def new_cf_session(self):
+        """
+        Switch to a new cloudflare session, taking a session whose inspect connection is already started from the
+        pool if inspect_pool_size is set.
+        """
+        start = perf_counter()
         self._stop_inspect()
-        self.inspect_logs = []
-        self._session_id = uuid.uuid4().hex
+        self._close_extra_sessions()
+        self.inspect_logs.close()
         self.fake_host = self._original_fake_host
 
-    def direct_request(self, method: str, url: str, **kwargs) -> Response:
-        return super().request(method, url, **kwargs)
-
-    def request(self, method: str, path: str, **kwargs: Any) -> Response:
+        inspector = None
+        if self.inspect_enabled and self.inspect_pool_size:
+            inspector = self._get_inspect_pool().pop()
+
+        self.inspect_logs = LogStore()
+        if inspector:
+            inspector.expand_depth = self.inspect_expand_depth
+            inspector.log.mirror = self.inspect_logs
+            self._inspector = inspector
+            self._session_id = inspector.session_id
+            session_logs = inspector.log
+            self.subrequests = inspector.subrequests
+        else:
+            self._session_id = uuid.uuid4().hex
+            session_logs = LogStore(mirror=self.inspect_logs)
+            self.subrequests = SubrequestLog()
+        with self._sessions_lock:
+            self._main_session = RequestSession(self._session_id, session_logs)
+        self.stats.setup += perf_counter() - start
+
+    def start_inspect_pool(self) -> None:
+        """
+        Connect the pool's inspect sessions ahead of the first new_cf_session(), if inspect_pool_size is set.
+        """
+        if self.inspect_enabled and self.inspect_pool_size:
+            self._get_inspect_pool().fill()
+
+    def _get_inspect_pool(self) -> InspectPool:
+        if self._inspect_pool is None:
+            self._inspect_pool = InspectPool(self.inspect_pool_size, root=self._inspect_root)
+        return self._inspect_pool
+
+    def inspect_log_wait(self, count: Optional[int] = None, wait_time: float = 5) -> LogStore:
+        assert self.inspect_enabled, 'inspect_log_wait make no sense without inspect_enabled=True'
+        start = perf_counter()
+        received = self.inspect_logs.wait_for_count(count, wait_time)
+        self.stats.log_wait += perf_counter() - start
+        if not received:
+            raise TimeoutError(f'{len(self.inspect_logs)} logs received, expected {count}')
+        return self.inspect_logs
+
+    def _prepare_request(self, path: str, kwargs: Dict[str, Any]) -> Tuple[str, Dict[str, str]]:
+        """
+        Check and rewrite path to a URL on the preview, return that URL and the cookies to route it.
+        """
         assert self.preview_id, 'preview_id not set in test client'
+        path = self._relative_path(path)
+        assert 'cookies' not in kwargs, '"cookies" kwarg not allowed'
+        return self._root + path, self._session_cookies(self._session_id)
+
+    def redeploy_stale_preview(self, preview_id: Optional[str]) -> bool:
+        """
+        Called when a request to preview_id found the preview had gone, redeploy it with stale_preview_redeploy unless
+        that's already been done, return whether there's a new preview to make the request to.
+        """
+        with self._redeploy_lock:
+            if preview_id == self.preview_id:
+                if self.stale_preview_redeploy is None:
+                    return False
+                start = perf_counter()
+                self.preview_id, self.bindings = self.stale_preview_redeploy()
+                self.stats.deploy += perf_counter() - start
+                # cleared once preview_id has changed, so requests which got a response meanwhile still retry
+                self.stale_preview_redeploy = None
+            return True
+
+    def _check_stale_preview(self, preview_id: Optional[str], response: Response) -> bool:
+        """
+        Whether a request to preview_id should be made again as response shows that preview had gone and it has been
+        redeployed, only the first response after deploy() used its cache is checked, or responses from a preview
+        which has since been replaced.
+        """
+        if self.stale_preview_redeploy is None and preview_id == self.preview_id:
+            return False
+        if preview_not_found(response):
+            return self.redeploy_stale_preview(preview_id)
+        self.stale_preview_redeploy = None
+        return False
+
+    def _session_cookies(self, session_id: str) -> Dict[str, str]:
+        return {'__ew_fiddle_preview': f'{self.preview_id}{session_id}{1}{self.fake_host}'}
+
+    def _start_request(self, *, main: bool = False) -> Tuple[RequestSession, RequestLogs]:
+        """
+        Wait for the inspect connection to be ready, choose the session for a request, the main session if main or
+        single_session is set, and start the request's logs. Call _finish_request() once the response has been
+        received.
+        """
+        self._wait_inspect_ready()
+        session = self._acquire_session(main or self.single_session)
+        start = perf_counter()
+        try:
+            logs = session.begin(self.inspect_log_settle_timeout)
+        except BaseException:
+            self._finish_request(session)
+            raise
+        self.stats.log_wait += perf_counter() - start
+        return session, logs
+
+    def _acquire_session(self, main: bool) -> RequestSession:
+        """
+        An idle session, preferring the main session, otherwise while there are fewer than max_sessions, a session
+        from the inspect pool, or a session whose logs are settling, which begin() waits for, or a new session.
+        With max_sessions sessions, wait for one to be idle.
+        """
+        with self._sessions_changed:
+            if main or not self.inspect_enabled:
+                # without inspect, logs don't need to be told apart
+                self._main_session.in_flight += 1
+                return self._main_session
+            while True:
+                sessions = [self._main_session, *self._extra_sessions]
+                session = next((s for s in sessions if s.idle(self.inspect_log_settle_timeout)), None)
+                if session is None:
+                    settling = next((s for s in sessions if not s.in_flight), None)
+                    if len(sessions) + self._starting_sessions < self.max_sessions:
+                        if settling is None or self.inspect_pool_size:
+                            self._starting_sessions += 1
+                            break
+                    session = settling
+                if session is not None:
+                    session.in_flight += 1
+                    return session
+                self._sessions_changed.wait()
+
+        try:
+            return self._add_extra_session()
+        finally:
+            with self._sessions_changed:
+                self._starting_sessions -= 1
+                self._sessions_changed.notify_all()
+
+    def _add_extra_session(self) -> RequestSession:
+        """
+        Start a session for a request made while no session is idle.
+        """
+        start = perf_counter()
+        inspector = None
+        if self.inspect_pool_size:
+            inspector = self._get_inspect_pool().pop()
+        if inspector is None:
+            inspector = Inspector(session_id=uuid.uuid4().hex, log=LogStore(), root=self._inspect_root)
+            inspector.start()
+        inspector.expand_depth = self.inspect_expand_depth
+        # subrequests of all sessions are collected together
+        inspector.subrequests = self.subrequests
+        inspector.log.mirror = self.inspect_logs
+        self._limit_logs(inspector.log)
+        inspector.ready.wait(2)
+        session = RequestSession(inspector.session_id, inspector.log, inspector)
+        session.in_flight = 1
+        with self._sessions_lock:
+            self._extra_sessions.append(session)
+        self.stats.setup += perf_counter() - start
+        return session
+
+    def _finish_request(self, session: RequestSession) -> None:
+        with self._sessions_changed:
+            inspector = self._inspector if session is self._main_session else session.inspector
+            session.finish(inspector if self.inspect_enabled else None)
+            self._sessions_changed.notify_all()
+
+    def _close_extra_sessions(self) -> None:
+        with self._sessions_lock:
+            sessions, self._extra_sessions = self._extra_sessions, []
+        for session in sessions:
+            session.close()
+
+    def _relative_path(self, path: str) -> str:
         host_regex = '^https?://' + re.escape(self.fake_host)
         path = re.sub(host_regex, '', path)
         if not path.startswith('/'):
             raise ValueError(f'path "{path}" must be relative or match "{host_regex}"')
+        return path
 
+    def _wait_inspect_ready(self) -> None:
+        """
+        Start the inspect connection if it's not running and wait for it to be ready.
+        """
         if self.inspect_enabled:
-            if self._inspect_thread is None:
-                self._start_inspect()
-            self._inspect_ready.wait(2)
+            start = perf_counter()
+            self._limit_logs(self.inspect_logs, spill=True)
+            self._limit_logs(self._main_session.logs)
+            with self._sessions_lock:
+                # requests from several threads may find the inspect connection isn't running
+                if self._inspector is None:
+                    self._start_inspect()
+                inspector = self._inspector
+            inspector.ready.wait(2)
+            self.stats.setup += perf_counter() - start
+        elif self._inspector is not None:
+            # the session may have come from the pool already connected
+            self._stop_inspect()
+
+    def _limit_logs(self, logs: LogStore, *, spill: bool = False) -> None:
+        spill_path = None
+        if spill and self.inspect_log_spill_dir is not None:
+            spill_path = Path(self.inspect_log_spill_dir) / f'{self._session_id}.jsonl.gz'
+        if getattr(self, 'cassette', None) is not None:
+            # the cassette takes each request's logs from inspect_logs when it's saved, so none can be evicted
+            logs.limit(spill_path=spill_path)
+        else:
+            max_count, max_bytes = self.inspect_log_max_count, self.inspect_log_max_bytes
+            logs.limit(max_count=max_count, max_bytes=max_bytes, spill_path=spill_path)
+
+    def _wait_for_error_logs(self, logs: RequestLogs) -> List['LogMsg']:
+        start = perf_counter()
+        try:
+            return logs.wait_for(lambda msg: msg.level == 'ERROR', 10)
+        finally:
+            self.stats.log_wait += perf_counter() - start
 
-        assert 'cookies' not in kwargs, '"cookies" kwarg not allowed'
-        cookies = {'__ew_fiddle_preview': f'{self.preview_id}{self._session_id}{1}{self.fake_host}'}
+    def _start_inspect(self):
+        self._inspector = Inspector(
+            session_id=self._session_id,
+            log=self._main_session.logs,
+            root=self._inspect_root,
+            subrequests=self.subrequests,
+            expand_depth=self.inspect_expand_depth,
+        )
+        self._inspector.start()
+
+    def _stop_inspect(self, wait: bool = False):
+        if self._inspector is not None:
+            inspector = self._inspector
+            self._inspector = None
+            inspector.stop()
+            if wait:
+                inspector.join(1)
+
+    def _close_inspect(self) -> None:
+        self._stop_inspect(wait=True)
+        self._close_extra_sessions()
+        self.inspect_logs.close()
+        if self._inspect_pool is not None:
+            self._inspect_pool.close()
+
+
+# arguments of Session.request() which are used to build the request rather than to send it
+request_args = {'params', 'data', 'headers', 'files', 'auth', 'json', 'hooks'}
+# when recording, a request's logs are assumed to have all arrived once none have arrived for this long
+record_log_quiet_time = 0.2
+
+
+class TestClient(BaseTestClient, Session):
+    """
+    Client which routes requests to the worker preview.
+
+    Request bodies may be file objects or generators, which are streamed, and stream=True works as with requests.
+    Responses have a "timing" attribute with the connect time, TTFB and total time, see RequestTiming, and a "logs"
+    attribute with the request's logs, see RequestLogs.
+    Up to pool_size connections are kept open to each host, new and reused connections and bytes sent and received
+    are counted in stats.
+
+    If cassette is set, requests are replayed from it or recorded to it, see Cassette. When lazy_deploy is set,
+    the worker is only deployed when a request has to be made to the preview, so replayed tests need no network.
+    """
+
+    __test__ = False
+
+    def __init__(
+        self,
+        *,
+        preview_id: Optional[str] = None,
+        bindings: List[Binding] = None,
+        fake_host: str = 'example.com',
+        inspect_pool_size: int = 0,
+        root: str = worker_root,
+        inspect_root: str = inspect_root,
+        pool_size: int = DEFAULT_POOLSIZE,
+        max_sessions: int = 4,
+    ):
+        Session.__init__(self)
+        BaseTestClient.__init__(
+            self,
+            preview_id=preview_id,
+            bindings=bindings,
+            fake_host=fake_host,
+            inspect_pool_size=inspect_pool_size,
+            root=root,
+            inspect_root=inspect_root,
+            max_sessions=max_sessions,
+        )
+        self.headers = {'user-agent': f'pytest-cloudflare-worker/{VERSION}'}
+        self.adapter = TimingAdapter(pool_size=pool_size, stats=self.stats)
+        self.mount('https://', self.adapter)
+        self.mount('http://', self.adapter)
+        self.cassette: Optional[Cassette] = None
+        self.lazy_deploy: Optional[Callable[[], Tuple[str, List[Binding]]]] = None
+
+    def warmup(self, connections: int = 1) -> int:
+        """
+        Open connections to the preview host ahead of the first request, see TimingAdapter.warmup().
+        """
+        # verify as requests would resolve it for a request, e.g. from REQUESTS_CA_BUNDLE, so the same pool is used
+        verify = self.merge_environment_settings(self._root, {}, None, None, None)['verify']
+        return self.adapter.warmup(self._root, connections, verify=verify)
+
+    def direct_request(self, method: str, url: str, **kwargs) -> Response:
+        return super().request(method, url, **kwargs)
 
-        logs_before = len(self.inspect_logs)
-        response = super().request(method, self._root + path, cookies=cookies, **kwargs)
+    def request(self, method: str, path: str, **kwargs: Any) -> Response:
+        if self.cassette is not None and not self.cassette.recording:
+            response = self._replay(method, path, kwargs)
+            if response is not None:
+                return response
+
+        self.ensure_deployed()
+        url, _ = self._prepare_request(path, kwargs)
+        # logs are recorded by their position in inspect_logs, so with a cassette requests stay in the main session
+        session, logs = self._start_request(main=self.cassette is not None)
+        cursor = self.inspect_logs.cursor()
+        preview_id = self.preview_id
+        start = perf_counter()
+        try:
+            response = super().request(method, url, cookies=self._session_cookies(session.session_id), **kwargs)
+        finally:
+            self._finish_request(session)
+        self.stats.record_request(perf_counter() - start)
+        response.logs = logs
+        if self._check_stale_preview(preview_id, response):
+            response.close()
+            if not resendable_body(kwargs):
+                raise StalePreviewError(preview_id)
+            return self.request(method, path, **kwargs)
+        if self.cassette is not None:
+            if self.inspect_enabled:
+                # logs arrive after the response, wait for them so they're recorded with this request
+                start = perf_counter()
+                self.inspect_logs.wait_for_quiet(record_log_quiet_time, 2)
+                self.stats.log_wait += perf_counter() - start
+            self.cassette.record(self.fake_host, response, cursor, match_body='files' not in kwargs)
         if response.status_code >= 500:
-            error_logs = []
-            for i in range(100):  # pragma: no branch
-                error_logs = [msg for msg in self.inspect_logs[logs_before:] if msg.level == 'ERROR']
-                if error_logs:
-                    break
-                self._wait_for_log()
-            raise WorkerError(error_logs)
+            # with stream=True the body hasn't been read, release the connection
+            response.close()
+            raise WorkerError(self._wait_for_error_logs(logs), overlapping=logs.overlapping)
         return response
 
-    def inspect_log_wait(self, count: Optional[int] = None, wait_time: float = 5) -> List['LogMsg']:
-        assert self.inspect_enabled, 'inspect_log_wait make no sense without inspect_enabled=True'
-        start = time()
-        while True:
-            if count is not None and len(self.inspect_logs) >= count:
-                return self.inspect_logs
-            elif time() - start > wait_time:
-                if count is None:
-                    return self.inspect_logs
-                else:
-                    raise TimeoutError(f'{len(self.inspect_logs)} logs received, expected {count}')
-            self._wait_for_log()
-
-    def _wait_for_log(self) -> None:
-        self._inspect_received.wait(0.1)
-        self._inspect_received.clear()
+    def ensure_deployed(self) -> None:
+        """
+        Deploy the worker with lazy_deploy if it's set and the worker hasn't been deployed yet.
+        """
+        if self.preview_id is None and self.lazy_deploy is not None:
+            start = perf_counter()
+            self.preview_id, self.bindings = self.lazy_deploy()
+            self.stats.deploy += perf_counter() - start
 
-    def _start_inspect(self):
-        self._inspect_ready.clear()
-        self._inspect_stop.clear()
-        kwargs = dict(
-            session_id=self._session_id,
-            log=self.inspect_logs,
-            ready=self._inspect_ready,
-            stop=self._inspect_stop,
-            received=self._inspect_received,
+    def _replay(self, method: str, path: str, kwargs: Dict[str, Any]) -> Optional[Response]:
+        assert 'cookies' not in kwargs, '"cookies" kwarg not allowed'
+        url = self._root + self._relative_path(path)
+        request = self.prepare_request(
+            Request(method.upper(), url, **{k: v for k, v in kwargs.items() if k in request_args})
         )
-        self._inspect_thread = Thread(name='inspect', target=inspect, kwargs=kwargs, daemon=True)
-        self._inspect_thread.start()
+        cursor = self.inspect_logs.cursor()
+        start = perf_counter()
+        replayed = self.cassette.play(self.fake_host, request, cursor, match_body='files' not in kwargs)
+        if replayed is None:
+            return None
+
+        response, logs = replayed
+        end = perf_counter()
+        self.stats.record_request(end - start)
+        # there's no connection, ttfb and total are both the time taken to replay the response
+        response.timing = RequestTiming(start)
+        response.timing.headers_received = response.timing.body_read = end
+        # replayed logs are complete, so there's nothing to wait for
+        response.logs = self._main_session.begin(0)
+        if self.inspect_enabled:
+            for msg in logs:
+                self._main_session.logs.append(msg)
+        if response.status_code >= 500:
+            raise WorkerError([msg for msg in logs if msg.level == 'ERROR'])
+        return response
 
-    def _stop_inspect(self):
-        if self._inspect_thread is not None:
-            self._inspect_stop.set()
-            t = self._inspect_thread
-            self._inspect_thread = None
-            t.join(1)
+    def load(
+        self,
+        method: str,
+        path: str,
+        *,
+        concurrency: int = 10,
+        duration: Optional[float] = None,
+        requests: Optional[int] = None,
+        **kwargs: Any,
+    ) -> LoadResult:
+        """
+        Load test the worker: make the same request from concurrency threads for duration seconds or until
+        requests requests have been made, routed to the preview like request().
+
+        5xx responses are counted as worker errors rather than raising WorkerError, their logs are in inspect_logs.
+        Each thread uses its own connection so the threads don't contend for the client's connection pool.
+        """
+        self.ensure_deployed()
+        url, _ = self._prepare_request(path, kwargs)
+        self._wait_inspect_ready()
+
+        local = threading.local()
+        sessions: List[Session] = []
+
+        def send() -> int:
+            session = getattr(local, 'session', None)
+            if session is None:
+                local.session = session = Session()
+                session.headers = self.headers
+                sessions.append(session)
+            preview_id = self.preview_id
+            cookies = self._session_cookies(self._session_id)
+            response = session.request(method, url, cookies=cookies, **kwargs)
+            if self._check_stale_preview(preview_id, response):
+                # load requests are sent repeatedly so their bodies can always be sent again
+                cookies = self._session_cookies(self._session_id)
+                response = session.request(method, url, cookies=cookies, **kwargs)
+            return response.status_code
+
+        try:
+            return run_load(send, concurrency=concurrency, duration=duration, requests=requests)
+        finally:
+            for session in sessions:
+                session.close()
 
     def close(self) -> None:
         super().close()
-        self._stop_inspect()
+        self._close_inspect()
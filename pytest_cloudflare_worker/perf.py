@@ -0,0 +1,157 @@
+import json
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+__all__ = 'ClientStats', 'PerfReport'
+
+
+class ClientStats:
+    """
+    Where a test client spent its time, in seconds, collected per test by the plugin's client fixtures.
+
+    setup is switching cloudflare session and waiting for the inspect connection to be ready, log_wait is time
+    spent waiting for logs, e.g. in inspect_log_wait(), deploy is building and deploying the worker.
+
+    connections counts new connections and reused_connections requests sent on a pooled connection, bytes_sent and
+    bytes_received are request and response sizes as sent over the connection, including headers.
+    """
+
+    fields = (
+        'requests',
+        'request_time',
+        'max_request',
+        'log_wait',
+        'setup',
+        'deploy',
+        'connections',
+        'reused_connections',
+        'tls_handshakes',
+        'bytes_sent',
+        'bytes_received',
+    )
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.requests = 0
+        self.request_time = 0.0
+        self.max_request = 0.0
+        self.log_wait = 0.0
+        self.setup = 0.0
+        self.deploy = 0.0
+        self.connections = 0
+        self.reused_connections = 0
+        self.tls_handshakes = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def record_request(self, seconds: float) -> None:
+        self.requests += 1
+        self.request_time += seconds
+        self.max_request = max(self.max_request, seconds)
+
+    def record_connection(self, new: bool, *, tls: bool = False) -> None:
+        if new:
+            self.connections += 1
+            self.tls_handshakes += tls
+        else:
+            self.reused_connections += 1
+
+    def merge(self, other: 'ClientStats') -> None:
+        for field in self.fields:
+            if field == 'max_request':
+                self.max_request = max(self.max_request, other.max_request)
+            else:
+                setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, float]) -> 'ClientStats':
+        stats = cls()
+        for field in cls.fields:
+            setattr(stats, field, data.get(field, 0))
+        return stats
+
+    def as_dict(self) -> Dict[str, float]:
+        return {field: getattr(self, field) for field in self.fields}
+
+    def __str__(self) -> str:
+        return (
+            f'requests: {self.requests}, total {self.request_time * 1000:0.1f}ms, '
+            f'max {self.max_request * 1000:0.1f}ms\n'
+            f'log wait: {self.log_wait * 1000:0.1f}ms\n'
+            f'session setup: {self.setup * 1000:0.1f}ms\n'
+            f'deploy: {self.deploy * 1000:0.1f}ms\n'
+            f'connections: {self.connections} new ({self.tls_handshakes} TLS), {self.reused_connections} reused, '
+            f'{self.bytes_sent / 1000:0.1f}kB sent, {self.bytes_received / 1000:0.1f}kB received'
+        )
+
+
+# components of a test's duration, in the order they're listed, with their labels
+components = ('deploy', 'deploy'), ('setup', 'session setup'), ('request_time', 'requests'), ('log_wait', 'log wait')
+
+
+class PerfReport:
+    """
+    ClientStats and durations of each test in the run, for the --cf-durations summary and --cf-perf-json.
+    """
+
+    def __init__(self):
+        self.durations: Dict[str, float] = defaultdict(float)
+        self.stats: Dict[str, Dict[str, float]] = {}
+
+    def add_duration(self, nodeid: str, seconds: float) -> None:
+        self.durations[nodeid] += seconds
+
+    def add_stats(self, nodeid: str, stats: Dict[str, float]) -> None:
+        """
+        Add the stats of a test, a test with more than one client fixture has stats from each of them.
+        """
+        if nodeid in self.stats:
+            combined = ClientStats.from_dict(self.stats[nodeid])
+            combined.merge(ClientStats.from_dict(stats))
+            stats = combined.as_dict()
+        self.stats[nodeid] = stats
+
+    def slowest(self, n: Optional[int] = None) -> List[Tuple[str, float, Dict[str, float]]]:
+        """
+        (node id, duration, stats) of the n slowest tests which used a test client, all of them if n is falsy.
+        """
+        tests = sorted(
+            ((nodeid, self.durations[nodeid], stats) for nodeid, stats in self.stats.items()),
+            key=lambda x: x[1],
+            reverse=True,
+        )
+        return tests[:n] if n else tests
+
+    def summary(self, n: Optional[int] = None) -> List[str]:
+        lines = []
+        for nodeid, duration, stats in self.slowest(n):
+            lines.append(f'{duration:8.2f}s {nodeid}')
+            lines.append(f'          {explain(duration, stats)}')
+        return lines
+
+    def write_json(self, path: Path) -> None:
+        tests = [dict(nodeid=nodeid, duration=duration, **stats) for nodeid, duration, stats in self.slowest()]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({'tests': tests}, indent=2))
+
+
+def explain(duration: float, stats: Dict[str, float]) -> str:
+    """
+    Break a test's duration down into its components, largest first, time not spent in the client is "other".
+    """
+    parts: List[Tuple[float, str]] = [(stats[field], label) for field, label in components if stats.get(field)]
+    other = duration - sum(t for t, _ in parts)
+    if other > 0.0005:
+        parts.append((other, 'other'))
+    parts.sort(reverse=True)
+    text = ', '.join(f'{label} {t * 1000:0.1f}ms' for t, label in parts)
+    requests = int(stats.get('requests', 0))
+    if requests:
+        text += f' ({requests} requests, max {stats["max_request"] * 1000:0.1f}ms'
+        if connections := int(stats.get('connections', 0)):
+            text += f', {connections} new connections'
+        text += ')'
+    return text
@@ -1,14 +1,43 @@
+import fcntl
+import json
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
+from threading import Thread
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
 
 import pytest
 
-from .main import TestClient, deploy
+from .cache import BuildCache, DeployCache, built_script_path, default_build_exclude, default_build_include
+from .cassette import Cassette, cassette_key, modes as cassette_modes
+from .perf import ClientStats, PerfReport
+from .profiler import ProfileStats, write_profile
+
+# requests, websockets and toml are imported when they're first needed, so runs without worker tests don't pay
+# for importing them
+if TYPE_CHECKING:
+    from .async_client import AsyncTestClient
+    from .emulator import Emulator
+    from .kv import KVNamespace
+    from .load import LoadResult
+    from .main import BaseTestClient, Binding, TestClient
 
 __version__ = ('pytest_addoption',)
 
 
 def pytest_addoption(parser):
     parser.addoption('--cf-wrangler-dir', action='store', default='.', help='directory in which to find wrangler.toml')
+    parser.addoption(
+        '--cf-worker',
+        action='append',
+        default=[],
+        help=(
+            'worker for the cf_client fixture in the form "name=wrangler_dir[:environment]", '
+            'may be given multiple times, overrides workers of the same name from the cf_workers ini option'
+        ),
+    )
     parser.addoption(
         '--cf-auth-client',
         action='store_true',
@@ -18,30 +47,819 @@ def pytest_addoption(parser):
             'will only work with this set'
         ),
     )
+    parser.addoption(
+        '--cf-no-deploy-cache',
+        action='store_true',
+        default=False,
+        help='always upload the worker, even if an unchanged script was deployed recently',
+    )
+    parser.addoption(
+        '--cf-deploy-cache-ttl',
+        action='store',
+        type=float,
+        default=1800,
+        help='seconds for which a deployed preview is reused when the script and bindings have not changed',
+    )
+    parser.addoption(
+        '--cf-no-build-cache',
+        action='store_true',
+        default=False,
+        help='always run "wrangler build", even if its inputs have not changed since the last build',
+    )
+    parser.addoption(
+        '--cf-inspect-pool-size',
+        action='store',
+        type=int,
+        default=2,
+        help='number of cloudflare sessions to keep with their inspect connection ready for the next test',
+    )
+    parser.addoption(
+        '--cf-max-sessions',
+        action='store',
+        type=int,
+        default=4,
+        help=(
+            'most cloudflare sessions a test client uses so concurrent requests get their own logs, '
+            'beyond this requests wait for a session to be idle'
+        ),
+    )
+    parser.addoption(
+        '--cf-pool-size',
+        action='store',
+        type=int,
+        default=10,
+        help='number of connections test clients keep open to each host',
+    )
+    parser.addoption(
+        '--cf-warmup-connections',
+        action='store',
+        type=int,
+        default=1,
+        help='number of connections to the preview to open after deploying, before the first test uses them',
+    )
+    parser.addoption(
+        '--cf-emulator',
+        action='store_true',
+        default=False,
+        help='run tests against a local emulator of the cloudflare preview endpoints instead of cloudflare',
+    )
+    parser.addoption(
+        '--cf-emulator-worker',
+        action='store',
+        default=None,
+        help='python worker stub used by the emulator, in the form "module.path:function", defaults to an echo worker',
+    )
+    parser.addoption(
+        '--cf-profile',
+        action='store_true',
+        default=False,
+        help='record a CPU profile of the worker during each test which uses the "client" fixture',
+    )
+    parser.addoption(
+        '--cf-profile-dir',
+        action='store',
+        default='.cf-profiles',
+        help='directory in which to write the ".cpuprofile" file for each profiled test',
+    )
+    parser.addoption(
+        '--cf-cassette-dir',
+        action='store',
+        default=None,
+        help=(
+            'record requests, responses and logs for each test in this directory and replay them on later runs '
+            'while the worker script and bindings are unchanged'
+        ),
+    )
+    parser.addoption(
+        '--cf-cassette-mode',
+        action='store',
+        choices=cassette_modes,
+        default='auto',
+        help=(
+            'with --cf-cassette-dir: "auto" replays cassettes recorded for the current script and records the rest, '
+            '"record" always records, "replay" fails for requests which were not recorded'
+        ),
+    )
+    parser.addoption(
+        '--cf-durations',
+        action='store',
+        type=int,
+        default=None,
+        metavar='N',
+        help=(
+            'show the N slowest tests which used a test client with where their time went: deploy, session setup, '
+            'requests and waiting for logs, N=0 for all'
+        ),
+    )
+    parser.addoption(
+        '--cf-perf-json',
+        action='store',
+        default=None,
+        metavar='PATH',
+        help='write the time each test spent deploying, in session setup, making requests and waiting for logs to PATH',
+    )
+    parser.addoption(
+        '--cf-watch',
+        action='store_true',
+        default=False,
+        help=(
+            'after running the tests, watch the worker source and when it changes redeploy and rerun the tests '
+            'which failed or use the worker, keeping the connections and inspect sessions open between runs'
+        ),
+    )
+    parser.addini(
+        'cf_workers',
+        type='linelist',
+        default=[],
+        help='workers for the cf_client fixture, one per line in the form "name=wrangler_dir[:environment]"',
+    )
+    parser.addini(
+        'cf_build_include',
+        type='linelist',
+        default=list(default_build_include),
+        help='patterns relative to the wrangler directory of files to fingerprint when deciding whether to rebuild',
+    )
+    parser.addini(
+        'cf_build_exclude',
+        type='linelist',
+        default=list(default_build_exclude),
+        help='patterns relative to the wrangler directory of files to ignore when deciding whether to rebuild',
+    )
+
+
+build_cache_key = pytest.StashKey[Optional[BuildCache]]()
+profile_stats_key = pytest.StashKey[ProfileStats]()
+cassette_key_key = pytest.StashKey[str]()
+background_deploy_key = pytest.StashKey[Optional['Future[TestClient]']]()
+# functions to redeploy each deployed worker, called by --cf-watch when the source changes
+redeploys_key = pytest.StashKey[List[Callable[[], None]]]()
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers',
+        'cf_load(method, path, concurrency=10, duration=None, requests=None, **kwargs): '
+        'load test the worker, use the cf_load fixture to get the result',
+    )
+    # config.cache is missing with "-p no:cacheprovider"
+    cache = getattr(config, 'cache', None)
+    if config.getoption('--cf-no-build-cache') or cache is None:
+        build_cache = None
+    else:
+        build_cache = BuildCache(
+            cache.mkdir('cloudflare_worker_build'),
+            include=config.getini('cf_build_include'),
+            exclude=config.getini('cf_build_exclude'),
+            ignore_dirs=ignored_cache_dirs(config),
+        )
+    config.stash[build_cache_key] = build_cache
+    config.stash[profile_stats_key] = ProfileStats()
+    config.stash[redeploys_key] = []
+    if config.getoption('--cf-watch'):
+        if config.getoption('--cf-cassette-dir') is not None:
+            raise pytest.UsageError('--cf-watch can not be used with --cf-cassette-dir')
+        if getattr(config.option, 'dist', 'no') != 'no':
+            raise pytest.UsageError('--cf-watch can not be used with pytest-xdist')
+
+
+def ignored_cache_dirs(config) -> List[Path]:
+    """
+    pytest's cache directory, which pytest writes to during the run, so it's never part of the worker's source.
+    """
+    cache = getattr(config, 'cache', None)
+    return [] if cache is None else [Path(cache._cachedir)]
+
+
+def pytest_itemcollected(item):
+    """
+    Start deploying in the background as soon as a test which needs the worker is collected, so the deploy overlaps
+    with collecting the rest of the suite.
+
+    If tests may be deselected, the deploy is started once collection has finished instead, see
+    pytest_collection_finish, so runs which select no test needing the worker don't deploy it.
+    """
+    config = item.config
+    if (
+        background_deploy_key not in config.stash
+        and not selecting_tests(config)
+        and 'session_client' in getattr(item, 'fixturenames', ())
+    ):
+        config.stash[background_deploy_key] = start_background_deploy(config)
+
+
+def pytest_collection_finish(session):
+    config = session.config
+    if background_deploy_key not in config.stash and any(
+        'session_client' in getattr(item, 'fixturenames', ()) for item in session.items
+    ):
+        config.stash[background_deploy_key] = start_background_deploy(config)
+
+
+def selecting_tests(config) -> bool:
+    """
+    Whether options which deselect collected tests are set: -k, -m, --deselect, --lf and --sw.
+    """
+    option = config.option
+    return bool(
+        getattr(option, 'keyword', None)
+        or getattr(option, 'markexpr', None)
+        or getattr(option, 'deselect', None)
+        or getattr(option, 'lf', False)
+        or getattr(option, 'stepwise', False)
+    )
+
+
+def start_background_deploy(config) -> Optional['Future[TestClient]']:
+    """
+    Start setting up the session client in a background thread, unless the deploy is lazy (with cassettes), needs the
+    emulator fixture, or this is the pytest-xdist controller, which doesn't run tests.
+    """
+    if (
+        config.getoption('collectonly')
+        or config.getoption('--cf-emulator')
+        or config.getoption('--cf-cassette-dir') is not None
+        or (getattr(config.option, 'dist', 'no') != 'no' and not hasattr(config, 'workerinput'))
+    ):
+        return None
+    future: 'Future[TestClient]' = Future()
+
+    def run():
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(setup_session_client(config, config._tmp_path_factory, None))
+            except BaseException as exc:
+                future.set_exception(exc)
+
+    # a daemon thread, unlike ThreadPoolExecutor's, so a deploy which isn't needed after all doesn't delay exit
+    Thread(target=run, name='cf-background-deploy', daemon=True).start()
+    return future
+
+
+def pytest_unconfigure(config):
+    # the background deploy wasn't used, e.g. every test which needed it was deselected by another plugin, close the
+    # client once the deploy finishes rather than waiting for it
+    future = config.stash.get(background_deploy_key, None)
+    if future is not None:
+        future.add_done_callback(close_unused_client)
+
+
+def close_unused_client(future: 'Future[TestClient]') -> None:
+    if future.exception() is None:
+        future.result().close()
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--cf-profile'):
+        for item in items:
+            if 'client' in getattr(item, 'fixturenames', ()) and 'cf_profile' not in item.fixturenames:
+                item.fixturenames.append('cf_profile')
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtestloop(session) -> Optional[bool]:
+    """
+    With --cf-watch, run the tests, then wait for the worker source to change, redeploy and rerun the tests which
+    failed or use a worker, until interrupted.
+
+    The last test of each run is given the session as nextitem, so session fixtures aren't torn down between runs:
+    deployed clients keep their connection pools and inspect sessions.
+    """
+    config = session.config
+    if not config.getoption('--cf-watch') or config.getoption('collectonly'):
+        return None
+    if session.testsfailed and not config.option.continue_on_collection_errors:
+        raise session.Interrupted(
+            f'{session.testsfailed} error{"s" if session.testsfailed != 1 else ""} during collection'
+        )
+
+    from .watch import SourceWatcher
+
+    dirs = dict.fromkeys([get_wrangler_dir(config)] + [wrangler_dir for _, wrangler_dir, _ in get_workers(config)])
+    watcher = SourceWatcher(
+        list(dirs),
+        include=config.getini('cf_build_include'),
+        exclude=config.getini('cf_build_exclude'),
+        ignore_dirs=ignored_cache_dirs(config),
+    )
+    reporter = config.pluginmanager.get_plugin('terminalreporter')
+    items = session.items
+    while True:
+        # a run stopped by --maxfail or -x is followed by watching like any other
+        failed = run_items(session, items)
+        if reporter is not None:
+            watched = ', '.join(map(str, watcher.wrangler_dirs))
+            reporter.ensure_newline()
+            reporter.write_sep('=', f'{len(failed)} failed, watching for changes in {watched}')
+        try:
+            watcher.wait()
+        except KeyboardInterrupt:
+            break
+        try:
+            for redeploy in config.stash[redeploys_key]:
+                redeploy()
+        except Exception as exc:
+            # e.g. a syntax error, wait for the next change
+            if reporter is not None:
+                reporter.ensure_newline()
+                reporter.write_sep('!', f'redeploying the worker failed: {exc!r}', red=True)
+            items = [item for item in session.items if item.nodeid in failed]
+            continue
+        items = [item for item in session.items if item.nodeid in failed or uses_worker(item)]
+    return True
+
+
+def run_items(session, items: List[pytest.Item]) -> List[str]:
+    """
+    Run items like pytest's own loop, without tearing down session fixtures after the last, return the node ids of
+    the items which failed.
+    """
+    session.testsfailed = 0
+    session.shouldfail = session.shouldstop = False
+    failed = []
+    for i, item in enumerate(items):
+        nextitem = items[i + 1] if i + 1 < len(items) else session
+        before = session.testsfailed
+        item.config.hook.pytest_runtest_protocol(item=item, nextitem=nextitem)
+        if session.testsfailed > before:
+            failed.append(item.nodeid)
+        if session.shouldfail or session.shouldstop:
+            break
+    return failed
+
+
+def uses_worker(item: pytest.Item) -> bool:
+    fixture_names = getattr(item, 'fixturenames', ())
+    return 'session_client' in fixture_names or 'cf_session_clients' in fixture_names
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    durations = config.getoption('--cf-durations')
+    perf_json = config.getoption('--cf-perf-json')
+    if durations is not None or perf_json:
+        report = perf_report(terminalreporter.stats)
+        if durations is not None:
+            title = 'slowest' if durations == 0 else f'slowest {durations}'
+            terminalreporter.section(f'cloudflare worker {title} tests')
+            for line in report.summary(durations) or ['(no tests used a test client)']:
+                terminalreporter.write_line(line)
+        if perf_json:
+            report.write_json(Path(perf_json))
+            terminalreporter.write_line(f'cloudflare worker performance report written to {perf_json}')
+
+    build_cache = config.stash[build_cache_key]
+    if build_cache is not None and (build_cache.hits or build_cache.misses):
+        hits, misses = build_cache.hits, build_cache.misses
+        terminalreporter.write_line(f'cloudflare worker build cache: {hits} hits, {misses} misses')
+
+    profile_stats = config.stash[profile_stats_key]
+    if profile_stats.profiles:
+        terminalreporter.section('cloudflare worker hottest functions')
+        for line in profile_stats.summary():
+            terminalreporter.write_line(line)
+        terminalreporter.write_line(f'profiles written to {config.getoption("--cf-profile-dir")}')
+
+
+def perf_report(stats: Dict[str, List[Any]]) -> PerfReport:
+    """
+    Build the performance report from test reports, this works with pytest-xdist since user_properties are sent
+    to the controller with each report.
+    """
+    report = PerfReport()
+    for reports in stats.values():
+        for test_report in reports:
+            if hasattr(test_report, 'duration') and hasattr(test_report, 'when'):
+                report.add_duration(test_report.nodeid, test_report.duration)
+                if test_report.when == 'teardown':
+                    for key, value in test_report.user_properties:
+                        if key == 'cf_perf':
+                            report.add_stats(test_report.nodeid, value)
+    return report
+
+
+def pytest_report_header(config) -> Optional[List[str]]:
+    build_cache = config.stash[build_cache_key]
+    wrangler_dir = get_wrangler_dir(config)
+    wrangler_path = wrangler_dir / 'wrangler.toml'
+    if build_cache is None or not wrangler_path.is_file():
+        return None
+
+    import toml
+
+    if toml.loads(wrangler_path.read_text()).get('type') == 'javascript':
+        return None
+
+    fingerprint = build_cache.fingerprint(wrangler_dir)
+    if build_cache.is_fresh(wrangler_dir, fingerprint, built_script_path(wrangler_dir)):
+        status = 'hit, skipping "wrangler build"'
+    else:
+        status = 'miss, running "wrangler build"'
+    return [f'cloudflare worker build cache: {status} (fingerprint {fingerprint[:12]})']
+
+
+def get_wrangler_dir(config) -> Path:
+    return Path(config.getoption('--cf-wrangler-dir')).resolve()
+
+
+def get_workers(config) -> List[Tuple[str, Path, Optional[str]]]:
+    """
+    Parse the workers from --cf-worker, relative to the current directory, and the cf_workers ini option,
+    relative to the rootdir, as (name, wrangler directory, environment).
+    """
+    workers = {}
+    specs = [(s, config.rootpath) for s in config.getini('cf_workers')]
+    specs += [(s, Path.cwd()) for s in config.getoption('--cf-worker')]
+    for spec, root in specs:
+        m = re.fullmatch(r'(\w[\w-]*)=([^:]+)(?::([\w-]+))?', spec.strip())
+        if not m:
+            raise pytest.UsageError(f'invalid worker "{spec}", should be in the form "name=wrangler_dir[:environment]"')
+        name, path, environment = m.groups()
+        workers[name] = name, (root / path).resolve(), environment
+    return list(workers.values())
+
+
+def shared_deploy(
+    shared_dir: Path, deploy_: Callable[[], Tuple[str, List['Binding']]], *, name: Optional[str] = None
+) -> Tuple[str, List['Binding']]:
+    """
+    Deploy once for all pytest-xdist workers: whichever worker first takes the lock in the shared directory
+    deploys and publishes the preview_id and bindings, the other workers read them.
+
+    name distinguishes the deploys of different cloudflare workers in one session.
+    """
+    stem = 'cloudflare_worker_deploy' if name is None else f'cloudflare_worker_deploy-{name}'
+    data_path = shared_dir / f'{stem}.json'
+    with (shared_dir / f'{stem}.lock').open('w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if data_path.exists():
+                data = json.loads(data_path.read_text())
+                return data['preview_id'], data['bindings']
+
+            preview_id, bindings = deploy_()
+            data_path.write_text(json.dumps({'preview_id': preview_id, 'bindings': bindings}))
+            return preview_id, bindings
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@pytest.fixture(name='cf_emulator', scope='session')
+def _fix_cf_emulator(request) -> Optional['Emulator']:
+    """
+    Local emulator of the cloudflare preview endpoints if --cf-emulator is set, otherwise None.
+    """
+    if not request.config.getoption('--cf-emulator'):
+        yield None
+        return
+
+    from .emulator import Emulator, echo_worker, load_worker
+
+    worker_path = request.config.getoption('--cf-emulator-worker')
+    worker = load_worker(worker_path) if worker_path else echo_worker
+    with Emulator(worker) as emulator:
+        yield emulator
+
+
+def record_stats(request, clients: Iterable['BaseTestClient']) -> None:
+    """
+    Attach the stats of clients since the last test to the test's report and reset them, the first test to use
+    a client includes its deploy.
+    """
+    stats = ClientStats()
+    for client in clients:
+        stats.merge(client.stats)
+        # reset in place since the client's transport records connections in it
+        client.stats.reset()
+    request.node.user_properties.append(('cf_perf', stats.as_dict()))
+    request.node.add_report_section('teardown', 'cloudflare worker', str(stats))
+
+
+def timed_deploy(client: 'BaseTestClient', deploy_: Callable[[], Tuple[str, List['Binding']]]) -> None:
+    start = perf_counter()
+    client.preview_id, client.bindings = deploy_()
+    client.stats.deploy += perf_counter() - start
+
+
+def worker_client(
+    config,
+    tmp_path_factory,
+    cf_emulator: Optional['Emulator'],
+    wrangler_dir: Path,
+    *,
+    inspect_pool_size: int,
+    name: Optional[str] = None,
+    **kwargs: Any,
+) -> Tuple['TestClient', Callable[[], Tuple[str, List['Binding']]]]:
+    """
+    Create a test client for the worker in wrangler_dir and a function to deploy it, kwargs are passed to deploy().
+
+    When running with pytest-xdist, the deploy function deploys once and shares the preview between all pytest
+    workers, each pytest worker's client still uses its own cloudflare session.
+    """
+    from .main import TestClient, deploy
+
+    auth_client: bool = config.getoption('--cf-auth-client')
+    cache = None
+    # previews only live as long as the emulator, so they're never cached
+    pytest_cache = getattr(config, 'cache', None)
+    if not config.getoption('--cf-no-deploy-cache') and pytest_cache is not None and not cf_emulator:
+        cache = DeployCache(
+            pytest_cache.mkdir('cloudflare_worker_deploy'), ttl=config.getoption('--cf-deploy-cache-ttl')
+        )
+
+    client_kwargs = {}
+    if cf_emulator:
+        client_kwargs = dict(root=cf_emulator.root, inspect_root=cf_emulator.inspect_root)
+        kwargs.update(api_root=cf_emulator.root, preview_root=cf_emulator.root, local_kv=True)
+
+    client = TestClient(
+        inspect_pool_size=inspect_pool_size,
+        pool_size=config.getoption('--cf-pool-size'),
+        max_sessions=config.getoption('--cf-max-sessions'),
+        **client_kwargs,
+    )
+    deploy_ = partial(
+        deploy,
+        wrangler_dir,
+        authenticate=auth_client,
+        test_client=client,
+        cache=cache,
+        build_cache=config.stash[build_cache_key],
+        **kwargs,
+    )
+    if hasattr(config, 'workerinput') and not cf_emulator:
+        # basetemp is per xdist worker, its parent is shared by all workers in this run
+        return client, partial(shared_deploy, tmp_path_factory.getbasetemp().parent, deploy_, name=name)
+    else:
+        return client, deploy_
+
+
+def setup_session_client(config, tmp_path_factory, cf_emulator: Optional['Emulator']) -> 'TestClient':
+    """
+    Create a test client and deploy the worker preview to cloudflare, or the emulator if it's enabled.
+
+    With --cf-cassette-dir, the worker is only deployed when a test has to record, and sessions aren't pre-connected.
+    """
+    from .main import build_bindings, build_source
+
+    wrangler_dir = get_wrangler_dir(config)
+    use_cassettes = config.getoption('--cf-cassette-dir') is not None
+    inspect_pool_size = 0 if use_cassettes else config.getoption('--cf-inspect-pool-size')
+    client, deploy_ = worker_client(
+        config, tmp_path_factory, cf_emulator, wrangler_dir, inspect_pool_size=inspect_pool_size
+    )
+
+    if use_cassettes:
+        source_path, wrangler_data = build_source(wrangler_dir, build_cache=config.stash[build_cache_key])
+        client.bindings = build_bindings(
+            wrangler_data, config.getoption('--cf-auth-client'), local_kv=cf_emulator is not None
+        )
+        config.stash[cassette_key_key] = cassette_key(source_path.read_bytes(), client.bindings)
+        client.lazy_deploy = deploy_
+    else:
+        timed_deploy(client, deploy_)
+        config.stash[redeploys_key].append(partial(timed_deploy, client, deploy_))
+        client.start_inspect_pool()
+        if warmup_connections := config.getoption('--cf-warmup-connections'):
+            client.warmup(warmup_connections)
+    return client
 
 
 @pytest.fixture(name='session_client', scope='session')
-def _fix_session_client(request):
+def _fix_session_client(request, tmp_path_factory, cf_emulator: Optional['Emulator']):
     """
-    Create a test client and deploy the worker preview to cloudflare.
+    Test client for the worker, set up in the background during collection if possible, see start_background_deploy.
     """
-    wrangler_dir = Path(request.config.getoption('--cf-wrangler-dir')).resolve()
-    auth_client: bool = request.config.getoption('--cf-auth-client')
-    client = TestClient()
-    preview_id, bindings = deploy(wrangler_dir, authenticate=auth_client, test_client=client)
-    client.preview_id = preview_id
-    client.bindings = bindings
+    config = request.config
+    future = config.stash.get(background_deploy_key, None)
+    if future is None:
+        client = setup_session_client(config, tmp_path_factory, cf_emulator)
+    else:
+        config.stash[background_deploy_key] = None
+        start = perf_counter()
+        client = future.result()
+        # only the time tests were blocked waiting for the deploy is attributed to them
+        client.stats.deploy = perf_counter() - start
 
     yield client
 
     client.close()
 
 
+@pytest.fixture(name='cf_session_clients', scope='session')
+def _fix_cf_session_clients(request, tmp_path_factory, cf_emulator: Optional['Emulator']):
+    """
+    A test client for each worker configured with --cf-worker or the cf_workers ini option, keyed by name.
+
+    Workers are built and deployed concurrently, so setup takes as long as the slowest deploy.
+    """
+    config = request.config
+    workers = get_workers(config)
+    if not workers:
+        pytest.fail('no workers configured, use "--cf-worker" or the "cf_workers" ini option', pytrace=False)
+
+    clients = {}
+    deploys = []
+    for name, wrangler_dir, environment in workers:
+        clients[name], deploy_ = worker_client(
+            config,
+            tmp_path_factory,
+            cf_emulator,
+            wrangler_dir,
+            inspect_pool_size=config.getoption('--cf-inspect-pool-size'),
+            name=name,
+            environment=environment,
+        )
+        deploys.append(deploy_)
+        config.stash[redeploys_key].append(partial(timed_deploy, clients[name], deploy_))
+
+    try:
+        with ThreadPoolExecutor(len(deploys), thread_name_prefix='cf-deploy') as pool:
+            list(pool.map(timed_deploy, clients.values(), deploys))
+        yield clients
+    finally:
+        for client in clients.values():
+            client.close()
+
+
 @pytest.fixture(name='client')
-def _fix_client(session_client: TestClient):
+def _fix_client(request, session_client: 'TestClient'):
     """
-    Create a test client.
+    Create a test client, using a cassette for the test if --cf-cassette-dir is set.
     """
     session_client.new_cf_session()
+    cassette_dir = request.config.getoption('--cf-cassette-dir')
+    if cassette_dir is None:
+        yield session_client
+        record_stats(request, [session_client])
+        return
+
+    name = re.sub(r'[^\w.-]+', '_', request.node.nodeid).strip('_')
+    session_client.cassette = cassette = Cassette(
+        Path(cassette_dir) / f'{name}.json',
+        request.config.stash[cassette_key_key],
+        mode=request.config.getoption('--cf-cassette-mode'),
+    )
+    yield session_client
+    session_client.cassette = None
+    cassette.save(session_client.inspect_logs)
+    record_stats(request, [session_client])
+
+
+@pytest.fixture(name='cf_client')
+def _fix_cf_client(request, cf_session_clients: Dict[str, 'TestClient']):
+    """
+    Test clients for the workers configured with --cf-worker or cf_workers, keyed by name, e.g. cf_client['api'].
+    """
+    for client in cf_session_clients.values():
+        client.new_cf_session()
+    yield cf_session_clients
+    record_stats(request, cf_session_clients.values())
+
+
+@pytest.fixture(name='cf_load')
+def _fix_cf_load(request, client: 'TestClient') -> 'LoadResult':
+    """
+    Run the load test described by the test's cf_load marker, arguments are passed to TestClient.load().
+    """
+    marker = request.node.get_closest_marker('cf_load')
+    if marker is None:
+        pytest.fail('the cf_load fixture requires a "@pytest.mark.cf_load(method, path, ...)" marker', pytrace=False)
+    result = client.load(*marker.args, **marker.kwargs)
+    request.node.user_properties.append(('cf_load', str(result)))
+    return result
+
+
+@pytest.fixture(name='cf_profile')
+def _fix_cf_profile(request, client: 'TestClient'):
+    """
+    Record a CPU profile of the worker while the test runs using the devtools Profiler on the inspect websocket.
+
+    The profile is written to --cf-profile-dir as "<test id>.cpuprofile" and added to the hottest functions report,
+    --cf-profile applies this fixture to every test which uses the client fixture. No profile is recorded if inspect
+    is disabled, the test switches to a new session or is replayed from a cassette. Requests all use the profiled
+    session while the test runs.
+    """
+    if client.cassette is not None and not client.cassette.recording:
+        yield client
+        return
+
+    client._wait_inspect_ready()
+    inspector = client._inspector
+    if inspector is not None:
+        inspector.call('Profiler.start')
+    client.single_session = True
+    try:
+        yield client
+    finally:
+        client.single_session = False
+    if inspector is None or inspector.closed:
+        return
+    profile = inspector.call('Profiler.stop')['profile']
+    write_profile(Path(request.config.getoption('--cf-profile-dir')), request.node.nodeid, profile)
+    request.config.stash[profile_stats_key].add(profile)
+
+
+@pytest.fixture(name='cf_kv')
+def _fix_cf_kv(session_client: 'TestClient', cf_emulator: Optional['Emulator']):
+    """
+    The emulator's KV namespaces bound to the worker, keyed by binding name.
+
+    The namespaces are snapshotted before the test and rolled back after it, so keys seeded before the test, e.g. in
+    a session fixture with cf_emulator.kv, are shared by every test without re-seeding while changes made during
+    the test are undone.
+    """
+    if cf_emulator is None:
+        pytest.fail('KV fixtures require the emulator, use "--cf-emulator"', pytrace=False)
+    namespaces = {
+        b['name']: cf_emulator.kv.namespace(b['namespace_id'])
+        for b in session_client.bindings
+        if b['type'] == 'kv_namespace'
+    }
+    snapshot = cf_emulator.kv.snapshot()
+    yield namespaces
+    cf_emulator.kv.restore(snapshot)
+
+
+def get_namespace(namespaces: Dict[str, 'KVNamespace'], binding: Optional[str]) -> 'KVNamespace':
+    if binding is None:
+        if len(namespaces) != 1:
+            raise ValueError(f'"binding" must be given when the worker has {len(namespaces)} KV namespaces')
+        return next(iter(namespaces.values()))
+    try:
+        return namespaces[binding]
+    except KeyError:
+        raise ValueError(f'KV namespace "{binding}" not bound to the worker, bindings: {", ".join(namespaces)}')
+
+
+@pytest.fixture(name='kv_seed')
+def _fix_kv_seed(cf_kv: Dict[str, 'KVNamespace']) -> Callable[..., int]:
+    """
+    Load keys into a KV namespace in one batch: kv_seed(data, binding=None) where data is a dict or the path of a
+    JSON lines file, see KVNamespace.seed(). binding may be omitted if the worker has one namespace.
+    """
+
+    def kv_seed(data: Union[Dict[str, Any], Path, str], binding: Optional[str] = None) -> int:
+        return get_namespace(cf_kv, binding).seed(data)
+
+    return kv_seed
+
+
+@pytest.fixture(name='kv_dump')
+def _fix_kv_dump(cf_kv: Dict[str, 'KVNamespace']) -> Callable[..., Dict[str, Any]]:
+    """
+    Get every key in a KV namespace with its value: kv_dump(binding=None).
+    """
+
+    def kv_dump(binding: Optional[str] = None) -> Dict[str, Any]:
+        return get_namespace(cf_kv, binding).dump()
+
+    return kv_dump
+
+
+@pytest.fixture(name='async_session_client', scope='session')
+def _fix_async_session_client(request, session_client: 'TestClient'):
+    """
+    Create an asyncio test client using the worker preview deployed for session_client.
+    """
+    from .async_client import AsyncTestClient
+
+    session_client.ensure_deployed()
+    client = AsyncTestClient(
+        preview_id=session_client.preview_id,
+        bindings=session_client.bindings,
+        inspect_pool_size=request.config.getoption('--cf-inspect-pool-size'),
+        root=session_client._root,
+        inspect_root=session_client._inspect_root,
+        max_sessions=request.config.getoption('--cf-max-sessions'),
+    )
+
+    if session_client.stale_preview_redeploy is not None:
+        stale_preview_id = session_client.preview_id
+
+        def redeploy_stale():
+            # the preview is session_client's, redeploy it there unless session_client has found it had gone already
+            session_client.redeploy_stale_preview(stale_preview_id)
+            return session_client.preview_id, session_client.bindings
+
+        client.stale_preview_redeploy = redeploy_stale
+
+    def redeployed():
+        # runs after session_client's redeploy, which was registered first
+        client.preview_id, client.bindings = session_client.preview_id, session_client.bindings
+
+    request.config.stash[redeploys_key].append(redeployed)
+
+    yield client
+
+    client.close()
+
+
+@pytest.fixture(name='async_client')
+def _fix_async_client(request, async_session_client: 'AsyncTestClient'):
+    """
+    Create an asyncio test client.
+    """
+    async_session_client.new_cf_session()
 
-    return session_client
+    yield async_session_client
+    record_stats(request, [async_session_client])
@@ -0,0 +1,69 @@
+import json
+import re
+from collections import defaultdict
+from itertools import accumulate
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+__all__ = 'self_times', 'write_profile', 'ProfileStats'
+
+# (function name, url, line)
+Frame = Tuple[str, str, int]
+# pseudo nodes which aren't time spent in the worker
+ignored_functions = {'(root)', '(idle)'}
+
+
+def self_times(profile: Dict[str, Any]) -> Dict[Frame, float]:
+    """
+    Seconds spent in each function excluding its callees, from a devtools Profiler.stop() profile.
+
+    Each sample lasts until the next one, the last sample lasts until the profile's endTime.
+    """
+    nodes = {node['id']: node['callFrame'] for node in profile['nodes']}
+    samples = profile.get('samples') or []
+    timestamps = list(accumulate(profile.get('timeDeltas') or [], initial=profile['startTime']))[1:]
+    timestamps.append(profile['endTime'])
+
+    times: Dict[Frame, float] = defaultdict(float)
+    for node_id, start, end in zip(samples, timestamps, timestamps[1:]):
+        frame = nodes[node_id]
+        name = frame['functionName'] or '(anonymous)'
+        if name not in ignored_functions:
+            times[(name, frame['url'], frame['lineNumber'] + 1)] += (end - start) / 1_000_000
+    return dict(times)
+
+
+def write_profile(profile_dir: Path, test_id: str, profile: Dict[str, Any]) -> Path:
+    """
+    Write the profile as a .cpuprofile file which can be opened in chrome devtools, return its path.
+    """
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    name = re.sub(r'[^\w.-]+', '_', test_id).strip('_')
+    path = profile_dir / f'{name}.cpuprofile'
+    path.write_text(json.dumps(profile, separators=(',', ':')))
+    return path
+
+
+class ProfileStats:
+    """
+    Self time per function summed over the profiles of every test, used for the "hottest functions" report.
+    """
+
+    def __init__(self):
+        self.profiles = 0
+        self.times: Dict[Frame, float] = defaultdict(float)
+
+    def add(self, profile: Dict[str, Any]) -> None:
+        self.profiles += 1
+        for frame, t in self_times(profile).items():
+            self.times[frame] += t
+
+    def hottest(self, n: int = 10) -> List[Tuple[Frame, float]]:
+        return sorted(self.times.items(), key=lambda x: x[1], reverse=True)[:n]
+
+    def summary(self, n: int = 10) -> List[str]:
+        total = sum(self.times.values())
+        lines = [f'{self.profiles} profiles, {total * 1000:0.1f}ms of CPU time in the worker']
+        for (name, url, line), t in self.hottest(n):
+            lines.append(f'{t * 1000:10.2f}ms {t / total if total else 0:6.1%}  {name} ({url}:{line})')
+        return lines
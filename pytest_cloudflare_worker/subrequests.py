@@ -0,0 +1,194 @@
+from threading import Condition
+from typing import Any, Dict, Iterator, List, Optional
+
+__all__ = 'Subrequest', 'SubrequestLog', 'network_methods'
+
+network_methods = {
+    'Network.requestWillBeSent',
+    'Network.responseReceived',
+    'Network.dataReceived',
+    'Network.loadingFinished',
+    'Network.loadingFailed',
+}
+
+
+class Subrequest:
+    """
+    A subrequest made by the worker, built from the "Network.*" events with the same requestId.
+
+    Timestamps are in seconds on the inspector's clock, durations are in seconds, timings from the response's
+    "timing" payload are None if they don't apply, e.g. dns and connect when a connection was reused.
+    """
+
+    def __init__(self, request_id: str, method: str, url: str, start: float):
+        self.request_id = request_id
+        self.method = method
+        self.url = url
+        self.start = start
+        self.status: Optional[int] = None
+        self.response_time: Optional[float] = None
+        self.end: Optional[float] = None
+        self.dns: Optional[float] = None
+        self.connect: Optional[float] = None
+        self.ssl: Optional[float] = None
+        self.ttfb: Optional[float] = None
+        self.bytes_received = 0
+        self.encoded_bytes_received = 0
+        self.error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.end is not None
+
+    @property
+    def duration(self) -> Optional[float]:
+        return None if self.end is None else self.end - self.start
+
+    def _response(self, timestamp: float, response: Dict[str, Any]) -> None:
+        self.status = response.get('status')
+        self.response_time = timestamp
+        timing = response.get('timing')
+        if timing:
+            self.dns = timing_span(timing, 'dnsStart', 'dnsEnd')
+            self.connect = timing_span(timing, 'connectStart', 'connectEnd')
+            self.ssl = timing_span(timing, 'sslStart', 'sslEnd')
+            self.ttfb = timing_span(timing, 'sendEnd', 'receiveHeadersEnd')
+        if self.ttfb is None:
+            self.ttfb = timestamp - self.start
+
+    def __repr__(self) -> str:
+        duration = 'pending' if self.duration is None else f'{self.duration * 1000:0.1f}ms'
+        return f'<Subrequest {self.method} {self.url} {self.status or self.error or "-"} {duration}>'
+
+
+def timing_span(timing: Dict[str, float], start: str, end: str) -> Optional[float]:
+    # devtools timings are milliseconds since requestTime, -1 if not applicable
+    start_ms, end_ms = timing.get(start, -1), timing.get(end, -1)
+    if start_ms < 0 or end_ms < 0:
+        return None
+    return (end_ms - start_ms) / 1000
+
+
+class SubrequestLog:
+    """
+    Subrequests made by the worker in one session, in the order they started, with assertion helpers.
+    """
+
+    def __init__(self):
+        self.changed = Condition()
+        self._subrequests: Dict[str, Subrequest] = {}
+
+    def on_event(self, data: Dict[str, Any]) -> None:
+        """
+        Update subrequests from one of network_methods from the inspect websocket.
+        """
+        method = data['method']
+        params = data['params']
+        assert method in network_methods, method
+        with self.changed:
+            if method == 'Network.requestWillBeSent':
+                request = params['request']
+                sub = Subrequest(params['requestId'], request['method'], request['url'], params['timestamp'])
+                self._subrequests[sub.request_id] = sub
+            else:
+                sub = self._subrequests.get(params['requestId'])
+                if sub is None:
+                    # started before the inspect connection was ready
+                    return
+                if method == 'Network.responseReceived':
+                    sub._response(params['timestamp'], params['response'])
+                elif method == 'Network.dataReceived':
+                    sub.bytes_received += params.get('dataLength', 0)
+                    sub.encoded_bytes_received += params.get('encodedDataLength', 0)
+                elif method == 'Network.loadingFinished':
+                    sub.end = params['timestamp']
+                    sub.encoded_bytes_received = params.get('encodedDataLength') or sub.encoded_bytes_received
+                elif method == 'Network.loadingFailed':
+                    sub.end = params['timestamp']
+                    sub.error = params.get('errorText', 'failed')
+            self.changed.notify_all()
+
+    def wait(self, count: Optional[int] = None, timeout: float = 5) -> bool:
+        """
+        Wait until at least count subrequests have started and all of them have finished.
+        """
+        with self.changed:
+            return self.changed.wait_for(
+                lambda: len(self._subrequests) >= (count or 0) and all(s.finished for s in self._subrequests.values()),
+                timeout,
+            )
+
+    def max_concurrency(self) -> int:
+        """
+        Greatest number of subrequests in flight at the same time, unfinished subrequests are treated as in flight.
+        """
+        events = []
+        for sub in self:
+            events += [(sub.start, 1), (sub.end if sub.end is not None else float('inf'), -1)]
+        in_flight = peak = 0
+        # at equal timestamps, ends sort before starts
+        for _, change in sorted(events):
+            in_flight += change
+            peak = max(peak, in_flight)
+        return peak
+
+    def assert_max_fan_out(self, count: int, *, wait_time: float = 5) -> None:
+        """
+        Assert the worker made at most count subrequests, waiting for those in flight to finish first.
+        """
+        self.wait(timeout=wait_time)
+        if len(self) > count:
+            raise AssertionError(f'{len(self)} subrequests made, expected at most {count}\n{self.waterfall()}')
+
+    def assert_max_concurrency(self, count: int, *, wait_time: float = 5) -> None:
+        self.wait(timeout=wait_time)
+        concurrency = self.max_concurrency()
+        if concurrency > count:
+            raise AssertionError(f'{concurrency} concurrent subrequests, expected at most {count}\n{self.waterfall()}')
+
+    def assert_max_duration(self, seconds: float, *, wait_time: float = 5) -> None:
+        """
+        Assert every subrequest finished within seconds of starting, waiting up to wait_time for them to finish,
+        those still unfinished count as too slow.
+        """
+        self.wait(timeout=wait_time)
+        slow = [s for s in self if not s.finished or s.duration > seconds]
+        if slow:
+            urls = ', '.join(s.url for s in slow)
+            raise AssertionError(
+                f'{len(slow)} subrequests took longer than {seconds * 1000:0.0f}ms: {urls}\n{self.waterfall()}'
+            )
+
+    def waterfall(self, width: int = 40) -> str:
+        """
+        Text waterfall chart of the subrequests, one per line.
+        """
+        subrequests = list(self)
+        if not subrequests:
+            return '(no subrequests)'
+        first = min(s.start for s in subrequests)
+        last = max(s.end if s.end is not None else s.start for s in subrequests)
+        scale = width / (last - first) if last > first else 0
+        lines = []
+        for s in subrequests:
+            offset = int((s.start - first) * scale)
+            length = max(int(((s.end if s.end is not None else last) - s.start) * scale), 1)
+            bar = (' ' * offset + ('=' if s.finished else '-') * length).ljust(width)
+            duration = 'pending' if s.duration is None else f'{s.duration * 1000:0.1f}ms'
+            lines.append(f'|{bar[:width]}| {s.method} {s.url} {s.status or s.error or "-"} {duration}')
+        return '\n'.join(lines)
+
+    def __len__(self) -> int:
+        return len(self._subrequests)
+
+    def __getitem__(self, item: int) -> Subrequest:
+        with self.changed:
+            return list(self._subrequests.values())[item]
+
+    def __iter__(self) -> Iterator[Subrequest]:
+        with self.changed:
+            subrequests: List[Subrequest] = list(self._subrequests.values())
+        return iter(subrequests)
+
+    def __repr__(self) -> str:
+        return f'<SubrequestLog {list(self)}>'
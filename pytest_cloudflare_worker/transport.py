@@ -0,0 +1,261 @@
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from time import perf_counter, sleep
+from typing import Any, Callable, Collection, Iterator, List, Optional, Tuple, Union
+
+from requests import PreparedRequest, Request, Response, Session
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from .perf import ClientStats
+from .version import VERSION
+
+__all__ = 'RequestTiming', 'TimingAdapter', 'MultipartUpload', 'RetryPolicy', 'shared_session'
+
+# time taken by the last new connection made in this thread and bytes it has sent since the request started,
+# urllib3 connects and sends in the thread making the request
+_connect_time = threading.local()
+_bytes_sent = threading.local()
+
+
+class RequestTiming:
+    """
+    Timing of a request in seconds, available as response.timing on responses from TestClient.
+
+    connect is the time taken to open a new connection, including the TLS handshake, None if a pooled connection
+    was reused. ttfb is the time from sending the request until the response headers arrived.
+    total is the time until the last of the body was read, with stream=True it's updated as the body is read.
+    """
+
+    __slots__ = 'start', 'connect', 'headers_received', 'body_read'
+
+    def __init__(self, start: float):
+        self.start = start
+        self.connect: Optional[float] = None
+        self.headers_received = start
+        self.body_read = start
+
+    @property
+    def ttfb(self) -> float:
+        return self.headers_received - self.start
+
+    @property
+    def total(self) -> float:
+        return self.body_read - self.start
+
+    def __repr__(self) -> str:
+        connect = 'reused' if self.connect is None else f'{self.connect * 1000:0.1f}ms'
+        return f'<RequestTiming connect={connect} ttfb={self.ttfb * 1000:0.1f}ms total={self.total * 1000:0.1f}ms>'
+
+
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self) -> None:
+        start = perf_counter()
+        super().connect()
+        _connect_time.value = perf_counter() - start
+
+    def send(self, data: Any) -> None:
+        super().send(data)
+        # urllib3 sends headers and body chunks as bytes
+        if isinstance(data, bytes):
+            _bytes_sent.value = getattr(_bytes_sent, 'value', 0) + len(data)
+
+
+class TimedHTTPSConnection(TimedHTTPConnection, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimingAdapter(HTTPAdapter):
+    """
+    requests adapter which sets response.timing, see RequestTiming, and records connections and bytes sent and
+    received in stats if it's set.
+
+    pool_size is the number of connections kept open to each host.
+    """
+
+    def __init__(self, *, pool_size: int = DEFAULT_POOLSIZE, stats: Optional[ClientStats] = None):
+        self.stats = stats
+        super().__init__(pool_maxsize=pool_size)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+    def warmup(self, url: str, connections: int = 1, *, verify: Union[bool, str] = True) -> int:
+        """
+        Open up to connections connections to url's host in parallel, unless the pool already has them, so later
+        requests reuse them rather than waiting for TCP and TLS setup. Returns the number of connections opened.
+        """
+        if hasattr(self, 'get_connection_with_tls_context'):
+            # the pool send() will use, pools are keyed by TLS settings as well as host
+            pool = self.get_connection_with_tls_context(Request('GET', url).prepare(), verify)
+        else:  # pragma: no cover
+            # requests < 2.32.2
+            pool = self.get_connection(url)
+        # more connections than the pool holds would be discarded when they're returned
+        conns = [pool._get_conn() for _ in range(min(connections, self._pool_maxsize))]
+        try:
+            new = [conn for conn in conns if conn.sock is None]
+            if new:
+                with ThreadPoolExecutor(max_workers=len(new)) as executor:
+                    list(executor.map(lambda conn: conn.connect(), new))
+        finally:
+            for conn in conns:
+                pool._put_conn(conn)
+        if self.stats is not None:
+            for _ in new:
+                self.stats.record_connection(True, tls=url.startswith('https:'))
+        return len(new)
+
+    def send(self, request: PreparedRequest, **kwargs: Any) -> Response:
+        _connect_time.value = None
+        _bytes_sent.value = 0
+        timing = RequestTiming(perf_counter())
+        try:
+            response = super().send(request, **kwargs)
+        finally:
+            if self.stats is not None:
+                self.stats.bytes_sent += _bytes_sent.value
+        timing.headers_received = timing.body_read = perf_counter()
+        timing.connect = _connect_time.value
+        stats = self.stats
+        if stats is not None:
+            stats.record_connection(timing.connect is not None, tls=request.url.startswith('https:'))
+            # the status line and headers as received, approximately
+            stats.bytes_received += (
+                17 + len(response.reason or '') + sum(len(k) + len(v) + 4 for k, v in response.raw.headers.items())
+            )
+
+        # the body hasn't been read yet, even without stream=True requests reads it after this returns,
+        # with stream() for content and iter_content(), chunked bodies don't go through read()
+        raw = response.raw
+        raw_read, raw_stream = raw.read, raw.stream
+        body_received = 0
+
+        def body_read() -> None:
+            nonlocal body_received
+            timing.body_read = perf_counter()
+            if stats is not None:
+                # tell() is the number of bytes read from the connection, before decompression
+                stats.bytes_received += raw.tell() - body_received
+                body_received = raw.tell()
+
+        def read(*args: Any, **kwargs: Any) -> bytes:
+            data = raw_read(*args, **kwargs)
+            body_read()
+            return data
+
+        def stream(*args: Any, **kwargs: Any) -> Iterator[bytes]:
+            for chunk in raw_stream(*args, **kwargs):
+                body_read()
+                yield chunk
+
+        raw.read, raw.stream = read, stream
+        response.timing = timing
+        return response
+
+
+class RetryPolicy:
+    """
+    Retry requests, e.g. uploads, which fail with one of statuses: 429 when rate limited, or a 5xx.
+
+    Retries wait backoff * 2 ** attempt seconds, or as long as the response's retry-after header asks, at most
+    max_backoff. The body is sent again, so it must be bytes or re-iterable like MultipartUpload.
+    """
+
+    def __init__(
+        self,
+        retries: int = 3,
+        *,
+        backoff: float = 0.5,
+        max_backoff: float = 10,
+        statuses: Collection[int] = (429, 500, 502, 503, 504),
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.statuses = statuses
+
+    def delay(self, attempt: int, response: Response) -> float:
+        retry_after = response.headers.get('retry-after', '')
+        if retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        return min(self.backoff * 2**attempt, self.max_backoff)
+
+    def send(self, send: Callable[[], Response]) -> Response:
+        """
+        Call send until it returns a response whose status isn't retried or retries are exhausted.
+        """
+        attempt = 0
+        while True:
+            response = send()
+            if response.status_code not in self.statuses or attempt >= self.retries:
+                return response
+            response.close()
+            sleep(self.delay(attempt, response))
+            attempt += 1
+
+
+_shared_session: Optional[Session] = None
+_shared_session_lock = threading.Lock()
+
+
+def shared_session() -> Session:
+    """
+    Session for requests made without a test client, e.g. by deploy(), so they reuse connections.
+    """
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            _shared_session = Session()
+            _shared_session.headers['user-agent'] = f'pytest-cloudflare-worker/{VERSION}'
+            adapter = TimingAdapter()
+            _shared_session.mount('https://', adapter)
+            _shared_session.mount('http://', adapter)
+        return _shared_session
+
+
+class MultipartUpload:
+    """
+    multipart/form-data body which is streamed, with files read in chunks as it's sent.
+
+    The length is known in advance, so requests sends a content-length header rather than using chunked encoding.
+    fields are (name, filename, content type, content) where content may be a path to read.
+    """
+
+    def __init__(self, fields: List[Tuple[str, str, str, Union[bytes, str, Path]]], *, chunk_size: int = 65536):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self.chunk_size = chunk_size
+        self._parts: List[Union[bytes, Path]] = []
+        for name, filename, content_type, content in fields:
+            header = (
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                f'Content-Type: {content_type}\r\n\r\n'
+            )
+            self._parts += [header.encode(), content.encode() if isinstance(content, str) else content, b'\r\n']
+        self._parts.append(f'--{self.boundary}--\r\n'.encode())
+
+    def __len__(self) -> int:
+        return sum(part.stat().st_size if isinstance(part, Path) else len(part) for part in self._parts)
+
+    def __iter__(self) -> Iterator[bytes]:
+        for part in self._parts:
+            if isinstance(part, Path):
+                with part.open('rb') as f:
+                    while chunk := f.read(self.chunk_size):
+                        yield chunk
+            else:
+                yield part
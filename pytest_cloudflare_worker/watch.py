@@ -0,0 +1,146 @@
+"""
+Waiting for a worker's source to change, used by --cf-watch. On linux changes are noticed with inotify, elsewhere
+the source is polled.
+"""
+
+import ctypes
+import ctypes.util
+import hashlib
+import os
+import select
+import sys
+from pathlib import Path
+from time import monotonic, sleep
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .cache import default_build_exclude, default_build_include, dir_patterns, input_files
+
+__all__ = ('SourceWatcher',)
+
+# IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_MOVE_SELF
+inotify_mask = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400 | 0x800
+
+
+class Inotify:
+    """
+    Minimal inotify binding with ctypes: watch directories and wait for any event in them.
+    """
+
+    def __init__(self, dirs: Sequence[Path]):
+        self._libc = get_libc()
+        self.fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        for path in dirs:
+            # a directory which has just been removed can't be watched, its parent's watch sees the removal
+            self._libc.inotify_add_watch(self.fd, os.fsencode(path), inotify_mask)
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait for events for up to timeout seconds, return whether there were any.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if readable:
+            os.read(self.fd, 65536)
+        return bool(readable)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def get_libc() -> Optional[ctypes.CDLL]:
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    except OSError:  # pragma: no cover
+        return None
+    return libc if hasattr(libc, 'inotify_init1') else None
+
+
+class SourceWatcher:
+    """
+    Wait for the content of the source files in wrangler_dirs to change, files are chosen by include and exclude
+    patterns like BuildCache, so build output and dependencies are ignored, as are files in ignore_dirs, e.g. pytest's
+    cache directory.
+
+    Changes which leave every file's content the same, e.g. saving a file without editing it, aren't reported.
+    Files are only read again when their modification time or size changes.
+    """
+
+    def __init__(
+        self,
+        wrangler_dirs: Sequence[Path],
+        *,
+        include: Sequence[str] = default_build_include,
+        exclude: Sequence[str] = default_build_exclude,
+        ignore_dirs: Sequence[Path] = (),
+        poll_interval: float = 0.5,
+        debounce: float = 0.05,
+    ):
+        self.wrangler_dirs = list(wrangler_dirs)
+        self.include = include
+        self.exclude = exclude
+        self.ignore_dirs = ignore_dirs
+        self.poll_interval = poll_interval
+        # editors often write a file in several steps, wait this long after an event before hashing
+        self.debounce = debounce
+        self.inotify = get_libc() is not None
+        self._digests: Dict[Path, Tuple[int, int, str]] = {}
+        self.hash = self.source_hash()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the source changes, return True, or False if timeout expires first.
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            # start watching before hashing, so a change made while hashing isn't missed
+            inotify = Inotify(self._watched_dirs()) if self.inotify else None
+            try:
+                source_hash = self.source_hash()
+                if source_hash != self.hash:
+                    self.hash = source_hash
+                    return True
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                if inotify is None:
+                    sleep(self.poll_interval if remaining is None else min(self.poll_interval, remaining))
+                # with no timeout, wake now and then in case an event was missed, e.g. in a new subdirectory
+                elif inotify.wait(60 if remaining is None else remaining):
+                    sleep(self.debounce)
+            finally:
+                if inotify is not None:
+                    inotify.close()
+
+    def source_hash(self) -> str:
+        h = hashlib.sha256()
+        digests = {}
+        for wrangler_dir in self.wrangler_dirs:
+            for path in self._input_files(wrangler_dir):
+                try:
+                    stat = path.stat()
+                    cached = self._digests.get(path)
+                    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                        digest = cached[2]
+                    else:
+                        digest = hashlib.sha256(path.read_bytes()).hexdigest()
+                except FileNotFoundError:
+                    # removed since the directory was listed
+                    continue
+                digests[path] = stat.st_mtime_ns, stat.st_size, digest
+                h.update(f'{path}\0{digest}\n'.encode())
+        self._digests = digests
+        return h.hexdigest()
+
+    def _watched_dirs(self) -> List[Path]:
+        dirs = set(self.wrangler_dirs)
+        for wrangler_dir in self.wrangler_dirs:
+            dirs.update(path.parent for path in self._input_files(wrangler_dir))
+        return sorted(dirs)
+
+    def _input_files(self, wrangler_dir: Path) -> List[Path]:
+        exclude = [*self.exclude, *dir_patterns(wrangler_dir, self.ignore_dirs)]
+        return input_files(wrangler_dir, self.include, exclude)
@@ -49,7 +49,11 @@ setup(
     install_requires=[
         'requests>=2.24.0',
         'websockets>=8.1',
-        'pytest>=6.0.0',
+        'pytest>=7.0.0',
         'toml>=0.10.1',
     ],
+    extras_require={
+        'async': ['httpx>=0.18.0'],
+        'http2': ['httpx[http2]>=0.18.0'],
+    },
 )
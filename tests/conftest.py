@@ -1,6 +1,18 @@
+import asyncio
+from contextlib import ExitStack
 from pathlib import Path
+from threading import Thread
+from typing import Any, Awaitable, Callable, Iterator, Optional
 
 import pytest
+import websockets
+
+from pytest_cloudflare_worker import TestClient, deploy
+from pytest_cloudflare_worker.emulator import Emulator, WorkerStub
+
+from .example_worker import worker as example_worker
+
+pytest_plugins = ['pytester']
 
 ROOT_DIR = Path(__file__).parent.parent
 
@@ -10,3 +22,73 @@ def _fix_wrangler_dir():
     path = ROOT_DIR / 'example'
     assert path.is_dir()
     return path
+
+
+@pytest.fixture(name='emulator')
+def _fix_emulator() -> Iterator[Emulator]:
+    with Emulator(example_worker) as emulator:
+        yield emulator
+
+
+@pytest.fixture(name='emulator_client')
+def _fix_emulator_client(wrangler_dir: Path) -> Iterator[Callable[..., TestClient]]:
+    """
+    Factory for a TestClient of an Emulator running worker, or of emulator if given, with the example worker
+    deployed to it, or deployed on the first request with lazy_deploy. Clients and emulators are closed after the test.
+    """
+    with ExitStack() as stack:
+
+        def create(
+            worker: WorkerStub = example_worker,
+            *,
+            emulator: Optional[Emulator] = None,
+            lazy_deploy: bool = False,
+            local_kv: bool = False,
+            **client_kwargs: Any,
+        ) -> TestClient:
+            if emulator is None:
+                emulator = stack.enter_context(Emulator(worker))
+            client = stack.enter_context(
+                TestClient(root=emulator.root, inspect_root=emulator.inspect_root, **client_kwargs)
+            )
+
+            def deploy_() -> Any:
+                return deploy(wrangler_dir, authenticate=False, preview_root=emulator.root, local_kv=local_kv)
+
+            if lazy_deploy:
+                client.lazy_deploy = deploy_
+            else:
+                client.preview_id, client.bindings = deploy_()
+            return client
+
+        yield create
+
+
+@pytest.fixture(name='inspect_server')
+def _fix_inspect_server() -> Iterator[Callable[[Callable[..., Awaitable[None]]], str]]:
+    """
+    Factory for a websocket server running handler on a thread of its own, returns the server's inspect root.
+    Servers are closed after the test.
+    """
+    loop = asyncio.new_event_loop()
+    thread = Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    servers = []
+
+    def create(handler: Callable[..., Awaitable[None]]) -> str:
+        async def serve():
+            return await websockets.serve(handler, '127.0.0.1', 0)
+
+        server = asyncio.run_coroutine_threadsafe(serve(), loop).result()
+        servers.append(server)
+        port = next(iter(server.sockets)).getsockname()[1]
+        return f'ws://127.0.0.1:{port}/inspect'
+
+    yield create
+
+    for server in servers:
+        server.close()
+        asyncio.run_coroutine_threadsafe(server.wait_closed(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
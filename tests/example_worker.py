@@ -0,0 +1,41 @@
+"""
+Python stand-in for example/index.js used with the emulator, line numbers match those in index.js.
+"""
+
+from datetime import datetime
+from typing import Any, Dict
+
+from pytest_cloudflare_worker.emulator import Console, WorkerRequest, WorkerResponse
+
+
+class ReferenceError(Exception):
+    line = 28
+
+
+def worker(request: WorkerRequest, env: Dict[str, Any], console: Console) -> WorkerResponse:
+    console.log('handling request:', request.method, request.pathname, line=7)
+    data = {
+        'method': request.method,
+        'headers': request.headers,
+        'url': {'hostname': request.hostname, 'pathname': request.pathname, 'params': request.params},
+        'body': request.text(),
+        'TESTING': env.get('__TESTING__') == 'TRUE',
+    }
+    path = request.pathname[1:].rstrip('/')
+
+    if path == 'vars':
+        data['vars'] = {'FOO': env['FOO'], 'SPAM': env['SPAM']}
+    elif path == 'kv':
+        key = request.params.get('key', 'the-key')
+        value = data['body']
+        console.log('settings KV', key, value, line=25)
+        if 'THINGS' not in env:
+            raise ReferenceError('THINGS is not defined')
+        env['THINGS'].put(key, value, expiration_ttl=3600)
+        data['KV'] = {key: env['THINGS'].get(key)}
+    elif path == 'console':
+        console.log('object', {'foo': 'bar', 'spam': 1}, line=31)
+        console.log('list', ['s', 1, 2.0, True, False, None, ...], line=32)
+        console.log('date', datetime.utcnow(), line=34)
+
+    return WorkerResponse.json(data, headers={'x-foo': 'bar'})
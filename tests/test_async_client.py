@@ -0,0 +1,67 @@
+import asyncio
+
+import httpx
+import pytest
+
+from pytest_cloudflare_worker import AsyncTestClient, WorkerError
+from pytest_cloudflare_worker.inspect import LogMsg
+
+
+def exception_msg(description: str) -> LogMsg:
+    data = {
+        'method': 'Runtime.exceptionThrown',
+        'params': {
+            'exceptionDetails': {'exception': {'description': description}, 'url': 'worker.js', 'lineNumber': 9},
+        },
+    }
+    return LogMsg.from_raw(data)
+
+
+def test_request():
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        return httpx.Response(200, json={'path': request.url.path})
+
+    async def run(client: AsyncTestClient):
+        async with client:
+            return await asyncio.gather(*[client.get(f'https://example.com/{i}') for i in range(20)])
+
+    client = AsyncTestClient(preview_id='a' * 32, transport=httpx.MockTransport(handler))
+    client.inspect_enabled = False
+    responses = asyncio.run(run(client))
+    assert [r.json() for r in responses] == [{'path': f'/{i}'} for i in range(20)]
+    assert {r.url.host for r in requests} == {'00000000000000000000000000000000.cloudflareworkers.com'}
+    cookie = requests[0].headers['cookie']
+    assert cookie == f'__ew_fiddle_preview={"a" * 32}{client._session_id}1example.com'
+    assert requests[0].headers['user-agent'].startswith('pytest-cloudflare-worker/')
+
+
+def test_invalid_url():
+    async def run():
+        async with AsyncTestClient(preview_id='a' * 32) as client:
+            await client.get('https://wrong.com')
+
+    with pytest.raises(ValueError, match=r'path "https://wrong\.com" must be relative or match "\^https\?://'):
+        asyncio.run(run())
+
+
+def test_worker_error():
+    client = AsyncTestClient(preview_id='a' * 32)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        client._main_session.logs.append(exception_msg('ReferenceError: THINGS is not defined'))
+        return httpx.Response(500)
+
+    client._transport = httpx.MockTransport(handler)
+    client.inspect_enabled = False
+    client._main_session.logs.append(exception_msg('an earlier error'))
+
+    async def run():
+        async with client:
+            await client.post('/kv/', content=b'foobar')
+
+    with pytest.raises(WorkerError, match='^ERROR worker.js:10> ReferenceError: THINGS is not defined$') as exc_info:
+        asyncio.run(run())
+    assert len(exc_info.value.logs) == 1
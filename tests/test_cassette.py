@@ -0,0 +1,135 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from pytest_cloudflare_worker import TestClient, WorkerError
+from pytest_cloudflare_worker.cassette import Cassette, CassetteError, cassette_key
+from pytest_cloudflare_worker.emulator import WorkerResponse
+
+from .example_worker import worker
+
+
+def binary_worker(request, env, console):
+    if request.pathname == '/binary':
+        return WorkerResponse(b'\xff\x00', headers={'content-type': 'application/octet-stream'})
+    return worker(request, env, console)
+
+
+def record(emulator_client, path: Path, key: str = 'key-1'):
+    client = emulator_client(binary_worker, lazy_deploy=True)
+    client.cassette = cassette = Cassette(path, key)
+    assert cassette.recording
+
+    r = client.put('/foo/', params={'x': '1'}, json={'a': 1})
+    assert r.status_code == 200
+    assert client.get('/binary').content == b'\xff\x00'
+    with pytest.raises(WorkerError):
+        client.get('/kv/')
+    client.inspect_log_wait(4)
+    cassette.save(client.inspect_logs)
+    assert client.preview_id is not None
+    return r.json()
+
+
+def test_record_replay(emulator_client, tmp_path: Path):
+    path = tmp_path / 'cassette.json'
+    recorded_data = record(emulator_client, path)
+    data = json.loads(path.read_text())
+    assert data['key'] == 'key-1'
+    assert [i['match'][:3] for i in data['interactions']] == [
+        ['PUT', 'example.com', '/foo/?x=1'],
+        ['GET', 'example.com', '/binary'],
+        ['GET', 'example.com', '/kv/'],
+    ]
+    assert [len(i['logs']) for i in data['interactions']] == [1, 0, 3]
+    assert data['interactions'][1]['response']['body_base64'] == '/wA='
+
+    # no emulator and no preview, so nothing can be requested
+    with TestClient(root='http://127.0.0.1:1', inspect_root='ws://127.0.0.1:1/inspect') as client:
+        client.cassette = cassette = Cassette(path, 'key-1', mode='replay')
+        assert not cassette.recording
+        r = client.put('https://example.com/foo/', params={'x': '1'}, json={'a': 1})
+        assert r.status_code == 200
+        assert r.headers['x-foo'] == 'bar'
+        assert r.json() == recorded_data
+        assert r.request.method == 'PUT'
+        r = client.get('/binary')
+        assert r.content == b'\xff\x00'
+        assert r.timing.connect is None
+        assert 0 < r.timing.ttfb == r.timing.total < 0.1
+        with pytest.raises(WorkerError, match='worker.js:28> ReferenceError: THINGS is not defined'):
+            client.get('/kv/')
+        assert client.inspect_logs == [
+            'LOG worker.js:7> "handling request:", "PUT", "/foo/"',
+            'LOG worker.js:7> "handling request:", "GET", "/kv/"',
+            'LOG worker.js:25> "settings KV", "the-key", ""',
+            'ERROR worker.js:28> ReferenceError: THINGS is not defined',
+        ]
+        assert client.preview_id is None
+        assert client._inspector is None
+        assert client.stats.requests == 3
+        assert client.stats.connections == 0
+
+        with pytest.raises(CassetteError, match=r'GET /binary not found in cassette'):
+            client.get('/binary')
+        cassette.save(client.inspect_logs)
+        assert not cassette.changed
+
+
+def test_replay_mismatch(emulator_client, tmp_path: Path):
+    path = tmp_path / 'cassette.json'
+    record(emulator_client, path)
+    # different body so a new request is recorded
+    client = emulator_client(lazy_deploy=True)
+    client.cassette = cassette = Cassette(path, 'key-1')
+    assert client.get('/binary').status_code == 200
+    assert client.preview_id is None
+    r = client.put('/foo/', params={'x': '1'}, json={'a': 2})
+    assert r.json()['body'] == '{"a": 2}'
+    assert client.preview_id is not None
+    assert cassette.recording
+    client.inspect_log_wait(1)
+    cassette.save(client.inspect_logs)
+
+    data = json.loads(path.read_text())
+    assert [i['match'][:3] for i in data['interactions']] == [
+        ['GET', 'example.com', '/binary'],
+        ['PUT', 'example.com', '/foo/?x=1'],
+    ]
+    assert [len(i['logs']) for i in data['interactions']] == [0, 1]
+
+
+def test_record_log_limit(emulator_client, tmp_path: Path):
+    path = tmp_path / 'cassette.json'
+    client = emulator_client(lazy_deploy=True)
+    client.inspect_log_max_count = 1
+    client.cassette = cassette = Cassette(path, 'key-1')
+    assert client.get('/console').status_code == 200
+    assert client.get('/').status_code == 200
+    client.inspect_log_wait(5)
+    cassette.save(client.inspect_logs)
+
+    data = json.loads(path.read_text())
+    assert [len(i['logs']) for i in data['interactions']] == [4, 1]
+
+
+def test_key_changed(emulator_client, tmp_path: Path):
+    path = tmp_path / 'cassette.json'
+    record(emulator_client, path)
+    assert Cassette(path, 'key-2').recording
+    assert Cassette(path, 'key-1', mode='record').recording
+    assert not Cassette(path, 'key-1', mode='replay').recording
+    cassette = Cassette(path, 'key-2', mode='replay')
+    assert not cassette.recording
+    with TestClient() as client:
+        client.cassette = cassette
+        with pytest.raises(CassetteError, match=r'PUT /foo/\?x=1 not found in cassette'):
+            client.put('/foo/', params={'x': '1'}, json={'a': 1})
+
+
+def test_cassette_key():
+    bindings = [{'name': 'FOO', 'type': 'plain_text', 'text': 'bar'}]
+    assert cassette_key(b'x', bindings) == cassette_key(b'x', [dict(reversed(bindings[0].items()))])
+    assert cassette_key(b'x', bindings) != cassette_key(b'y', bindings)
+    assert cassette_key(b'x', bindings) != cassette_key(b'x', [])
@@ -0,0 +1,305 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Barrier
+from time import perf_counter, sleep
+
+import pytest
+
+from pytest_cloudflare_worker import AsyncTestClient, StalePreviewError, TestClient, WorkerError, deploy
+from pytest_cloudflare_worker.cache import DeployCache
+from pytest_cloudflare_worker.emulator import Emulator, WorkerResponse, load_worker
+
+from .example_worker import ReferenceError, worker
+
+
+def test_deploy_request(wrangler_dir: Path, emulator: Emulator):
+    with TestClient(root=emulator.root, inspect_root=emulator.inspect_root) as client:
+        preview_id, bindings = deploy(wrangler_dir, authenticate=False, test_client=client, preview_root=emulator.root)
+        assert list(emulator.previews) == [preview_id]
+        preview = emulator.previews[preview_id]
+        assert preview.script == (wrangler_dir / 'index.js').read_bytes()
+        assert preview.metadata == {'bindings': bindings, 'body_part': 'index'}
+        assert preview.env == {'__TESTING__': 'TRUE', 'FOO': 'bar', 'SPAM': 'spam'}
+
+        client.preview_id = preview_id
+        client.fake_host = 'foobar.com'
+        r = client.get('/vars/', params={'a': '1'})
+        assert r.status_code == 200, r.text
+        assert r.headers['x-foo'] == 'bar'
+        obj = r.json()
+        assert obj['url'] == {'hostname': 'foobar.com', 'pathname': '/vars/', 'params': {'a': '1'}}
+        assert obj['headers']['host'] == 'foobar.com'
+        assert 'cookie' not in obj['headers']
+        assert obj['vars'] == {'FOO': 'bar', 'SPAM': 'spam'}
+        assert client.inspect_log_wait(1) == ['LOG worker.js:7> "handling request:", "GET", "/vars/"']
+
+
+def test_stale_cached_preview(wrangler_dir: Path, emulator: Emulator, tmp_path: Path):
+    cache = DeployCache(tmp_path)
+    with TestClient(root=emulator.root, inspect_root=emulator.inspect_root) as client:
+        preview_id, _ = deploy(wrangler_dir, authenticate=False, cache=cache, preview_root=emulator.root)
+        # the preview expires before the cache's ttl
+        emulator.previews.clear()
+        client.preview_id, _ = deploy(
+            wrangler_dir, authenticate=False, test_client=client, cache=cache, preview_root=emulator.root
+        )
+        assert client.preview_id == preview_id
+        r = client.get('/vars/')
+        assert r.status_code == 200, r.text
+        assert client.preview_id != preview_id
+        assert list(emulator.previews) == [client.preview_id]
+        assert client.stats.requests == 2
+
+        # only the first request is checked
+        emulator.previews.clear()
+        assert client.get('/vars/').status_code == 404
+    assert deploy(wrangler_dir, authenticate=False, cache=cache, preview_root=emulator.root)[0] == client.preview_id
+
+
+def test_stale_cached_preview_body(wrangler_dir: Path, emulator: Emulator, tmp_path: Path):
+    cache = DeployCache(tmp_path)
+    with TestClient(root=emulator.root, inspect_root=emulator.inspect_root) as client:
+        preview_id, _ = deploy(wrangler_dir, authenticate=False, cache=cache, preview_root=emulator.root)
+        emulator.previews.clear()
+        client.preview_id, _ = deploy(
+            wrangler_dir, authenticate=False, test_client=client, cache=cache, preview_root=emulator.root
+        )
+        # the generator is consumed by the first request, so it can't be sent again to the new preview
+        with pytest.raises(StalePreviewError, match=f'preview {preview_id} had gone'):
+            client.post('/vars/', data=(chunk for chunk in [b'foo', b'bar']))
+        assert client.preview_id != preview_id
+        assert list(emulator.previews) == [client.preview_id]
+
+        r = client.post('/vars/', data=(chunk for chunk in [b'foo', b'bar']))
+        assert r.status_code == 200, r.text
+        assert r.json()['body'] == 'foobar'
+
+
+def test_stale_cached_preview_load(wrangler_dir: Path, emulator: Emulator, tmp_path: Path):
+    cache = DeployCache(tmp_path)
+    with TestClient(root=emulator.root, inspect_root=emulator.inspect_root) as client:
+        preview_id, _ = deploy(wrangler_dir, authenticate=False, cache=cache, preview_root=emulator.root)
+        emulator.previews.clear()
+        client.preview_id, _ = deploy(
+            wrangler_dir, authenticate=False, test_client=client, cache=cache, preview_root=emulator.root
+        )
+        result = client.load('GET', '/vars/', concurrency=4, requests=20)
+        assert result.status_codes == {200: 20}
+        assert list(emulator.previews) == [client.preview_id]
+        assert client.preview_id != preview_id
+
+
+def test_stale_cached_preview_async(wrangler_dir: Path, emulator: Emulator):
+    preview_id, _ = deploy(wrangler_dir, authenticate=False, preview_root=emulator.root)
+    emulator.previews.clear()
+    redeploys = []
+
+    def redeploy():
+        redeploys.append(1)
+        return deploy(wrangler_dir, authenticate=False, preview_root=emulator.root)
+
+    async def run():
+        async with AsyncTestClient(preview_id=preview_id, root=emulator.root, inspect_root=emulator.inspect_root) as c:
+            c.stale_preview_redeploy = redeploy
+            # every request is sent to the stale preview, only one redeploys it
+            responses = await asyncio.gather(*[c.get(f'/{i}') for i in range(5)])
+            assert [r.status_code for r in responses] == [200] * 5
+            assert c.preview_id != preview_id
+            return c.preview_id
+
+    new_preview_id = asyncio.run(run())
+    assert list(emulator.previews) == [new_preview_id]
+    assert redeploys == [1]
+
+
+def test_deploy_auth(wrangler_dir: Path, emulator: Emulator, monkeypatch):
+    monkeypatch.setenv('CLOUDFLARE_API_TOKEN', 'testing')
+    preview_id, bindings = deploy(wrangler_dir, authenticate=True, api_root=emulator.root)
+    assert bindings[-1] == {
+        'name': 'THINGS',
+        'type': 'kv_namespace',
+        'namespace_id': '06b957fd6edd4b588e944f85192ff28b',
+    }
+    assert list(emulator.previews) == [preview_id]
+
+
+def test_worker_error(emulator_client):
+    client = emulator_client()
+    with pytest.raises(WorkerError, match='worker.js:28> ReferenceError: THINGS is not defined'):
+        client.get('/kv/')
+    assert client.inspect_logs == [
+        'LOG worker.js:7> "handling request:", "GET", "/kv/"',
+        'LOG worker.js:25> "settings KV", "the-key", ""',
+        'ERROR worker.js:28> ReferenceError: THINGS is not defined',
+    ]
+
+
+def test_unknown_preview(emulator: Emulator):
+    with TestClient(preview_id='a' * 32, root=emulator.root, inspect_root=emulator.inspect_root) as client:
+        client.inspect_enabled = False
+        r = client.get('/')
+        assert r.status_code == 404
+        assert r.text == f'preview "{"a" * 32}" not found\n'
+
+
+def test_async_client(wrangler_dir: Path, emulator: Emulator):
+    preview_id, _ = deploy(wrangler_dir, authenticate=False, preview_root=emulator.root)
+
+    async def run():
+        async with AsyncTestClient(preview_id=preview_id, root=emulator.root, inspect_root=emulator.inspect_root) as c:
+            responses = await asyncio.gather(*[c.get(f'/{i}') for i in range(10)])
+            assert [r.json()['url']['pathname'] for r in responses] == [f'/{i}' for i in range(10)]
+            return c.inspect_log_wait(10)
+
+    logs = asyncio.run(run())
+    assert {log.message for log in logs} == {f'"handling request:", "GET", "/{i}"' for i in range(10)}
+
+
+def test_load_worker():
+    assert load_worker('tests.example_worker:worker') is worker
+    with pytest.raises(ValueError, match='must be in the form "module.path:function"'):
+        load_worker('tests.example_worker')
+
+
+def test_worker_response():
+    r = WorkerResponse('hello', status=201)
+    assert (r.body, r.status, r.headers) == (b'hello', 201, {})
+    r = WorkerResponse.json({'a': 1}, headers={'x': 'y'})
+    assert r.headers == {'content-type': 'application/json', 'x': 'y'}
+
+
+def slow_worker(request, env, console):
+    console.log('start', request.pathname, line=1)
+    sleep(0.1)
+    if request.pathname.startswith('/error/'):
+        raise ReferenceError(f'failed {request.pathname}')
+    console.log('end', request.pathname, line=2)
+    return WorkerResponse('ok')
+
+
+def test_concurrent_request_logs(emulator_client):
+    client = emulator_client(slow_worker)
+    barrier = Barrier(4)
+
+    def get(path: str):
+        barrier.wait()
+        try:
+            return client.get(path)
+        except WorkerError as e:
+            return e
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(get, ['/0/', '/1/', '/error/2/', '/error/3/']))
+
+    for i in 0, 1:
+        assert results[i].logs.wait(2) == [
+            f'LOG worker.js:1> "start", "/{i}/"',
+            f'LOG worker.js:2> "end", "/{i}/"',
+        ]
+    for i in 2, 3:
+        assert results[i].logs == [f'ERROR worker.js:28> ReferenceError: failed /error/{i}/']
+    assert len(client.inspect_logs) == 8
+
+    # sequential requests use the main session again
+    r1 = client.get('/4/')
+    r1.logs.wait(2)
+    r2 = client.get('/5/')
+    assert r1.logs == ['LOG worker.js:1> "start", "/4/"', 'LOG worker.js:2> "end", "/4/"']
+    assert r2.logs.wait(2)[0] == 'LOG worker.js:1> "start", "/5/"'
+    assert client.inspect_logs[-4:] == [*r1.logs, *r2.logs]
+
+
+def test_async_request_logs(wrangler_dir: Path):
+    with Emulator(slow_worker) as emulator:
+        preview_id, _ = deploy(wrangler_dir, authenticate=False, preview_root=emulator.root)
+
+        async def run():
+            async with AsyncTestClient(
+                preview_id=preview_id, root=emulator.root, inspect_root=emulator.inspect_root
+            ) as client:
+                responses = await asyncio.gather(*[client.get(f'/{i}/') for i in range(5)])
+                with pytest.raises(WorkerError, match=r'^ERROR worker.js:28> ReferenceError: failed /error/$'):
+                    await asyncio.gather(client.get('/error/'), client.get('/6/'))
+                for r in responses:
+                    r.logs.wait(2)
+                return responses
+
+        for i, r in enumerate(asyncio.run(run())):
+            assert [msg.message for msg in r.logs] == [f'"start", "/{i}/"', f'"end", "/{i}/"']
+
+
+def test_async_max_sessions(wrangler_dir: Path):
+    with Emulator(slow_worker) as emulator:
+        preview_id, _ = deploy(wrangler_dir, authenticate=False, preview_root=emulator.root)
+
+        async def run():
+            async with AsyncTestClient(
+                preview_id=preview_id, root=emulator.root, inspect_root=emulator.inspect_root, max_sessions=3
+            ) as client:
+                paths = [f'/{i}/' for i in range(10)] + ['/error/']
+                results = await asyncio.gather(*[client.get(path) for path in paths], return_exceptions=True)
+                assert len(client._extra_sessions) == 2
+                return results
+
+        *responses, error = asyncio.run(run())
+        # beyond max_sessions requests wait for a session rather than sharing one
+        for i, r in enumerate(responses):
+            assert [msg.message for msg in r.logs.wait(2)] == [f'"start", "/{i}/"', f'"end", "/{i}/"']
+            assert not r.logs.overlapping
+        assert str(error) == 'ERROR worker.js:28> ReferenceError: failed /error/'
+
+
+def test_single_session(emulator_client):
+    client = emulator_client(slow_worker)
+    client.single_session = True
+    barrier = Barrier(2)
+
+    def get(path: str):
+        barrier.wait()
+        try:
+            return client.get(path)
+        except WorkerError as e:
+            return e
+
+    with ThreadPoolExecutor(2) as executor:
+        r, error = executor.map(get, ['/0/', '/error/'])
+    assert client._extra_sessions == []
+    assert r.logs.overlapping
+    assert error.overlapping
+    assert str(error).endswith('(other requests were in flight in the same session, these may be their errors)')
+
+
+def test_back_to_back_logs(emulator_client):
+    client = emulator_client()
+    start = perf_counter()
+    for _ in range(10):
+        r1 = client.get('/console')
+        r2 = client.get('/')
+        # each request's logs are complete and just its own, without waiting before sending the next request
+        assert r1.logs.wait(4) == [
+            'LOG worker.js:7> "handling request:", "GET", "/console"',
+            *r1.logs[1:],
+        ]
+        assert len(r1.logs) == 4
+        assert r2.logs.wait(1) == ['LOG worker.js:7> "handling request:", "GET", "/"']
+    assert perf_counter() - start < 0.5
+    assert client.stats.log_wait < 0.1
+
+
+def test_objects_released(emulator: Emulator, emulator_client):
+    client = emulator_client(emulator=emulator)
+    client.inspect_expand_depth = 1
+    assert client.get('/console').status_code == 200
+    assert client.inspect_log_wait(4)[1].message == '"object", {"foo": "bar", "spam": 1.0}'
+    session_id = client._session_id
+    assert list(emulator._objects) == [session_id]
+    assert len(emulator._objects[session_id]) == 2
+
+    # once the session has no inspect connection, its objects can't be expanded so they're dropped
+    client.new_cf_session()
+    for _ in range(50):
+        if session_id not in emulator._objects:
+            break
+        sleep(0.01)
+    assert session_id not in emulator._objects
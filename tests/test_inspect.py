@@ -0,0 +1,229 @@
+import asyncio
+import json
+from time import perf_counter
+
+import pytest
+
+from pytest_cloudflare_worker import TestClient
+from pytest_cloudflare_worker.emulator import WorkerResponse
+from pytest_cloudflare_worker.inspect import Inspector, InspectPool, get_inspect_loop
+from pytest_cloudflare_worker.logs import LogStore
+
+
+def console_event(message: str) -> str:
+    params = {
+        'type': 'log',
+        'args': [{'type': 'string', 'value': message}],
+        'stackTrace': {'callFrames': [{'url': 'worker.js', 'lineNumber': 4}]},
+    }
+    return json.dumps({'method': 'Runtime.consoleAPICalled', 'params': params})
+
+
+@pytest.fixture(name='inspect_root')
+def _fix_inspect_root(inspect_server) -> str:
+    """
+    Minimal inspect websocket which replies to every command and logs "hello" once the inspector is ready,
+    commands after the handshake get their method as the result, or an error for the method "Test.fail".
+    """
+
+    async def handler(ws, path=None):
+        async for msg in ws:
+            data = json.loads(msg)
+            msg_id = data['id']
+            if data['method'] == 'Test.fail':
+                await ws.send(json.dumps({'id': msg_id, 'error': {'code': -32601, 'message': 'not found'}}))
+            else:
+                result = {'method': data['method'], 'params': data['params']} if msg_id > 8 else {}
+                await ws.send(json.dumps({'id': msg_id, 'result': result}))
+            if msg_id == 8:
+                await ws.send(console_event('hello'))
+
+    return inspect_server(handler)
+
+
+def test_inspector(inspect_root: str):
+    log = LogStore()
+    inspector = Inspector(session_id='abc', log=log, root=inspect_root)
+    inspector.start()
+    assert inspector.ready.wait(2)
+    assert log.wait_for_count(1, 2)
+    assert log == ['LOG worker.js:5> "hello"']
+
+    start = perf_counter()
+    inspector.stop()
+    inspector.join(1)
+    assert perf_counter() - start < 0.5
+
+
+def test_inspector_sync(inspect_root: str):
+    log = LogStore()
+    inspector = Inspector(session_id='abc', log=log, root=inspect_root)
+    assert inspector.sync() is None
+    inspector.start()
+    assert inspector.ready.wait(2)
+    # "hello" is sent before the reply to sync()'s command, so it's in log without waiting for it
+    inspector.sync().result(2)
+    assert log == ['LOG worker.js:5> "hello"']
+    inspector.stop()
+    inspector.join(1)
+
+
+def test_inspector_call(inspect_root: str):
+    inspector = Inspector(session_id='abc', log=LogStore(), root=inspect_root)
+    inspector.start()
+    assert inspector.call('Profiler.start') == {'method': 'Profiler.start', 'params': {}}
+    assert inspector.call('Runtime.getProperties', {'objectId': '1'}) == {
+        'method': 'Runtime.getProperties',
+        'params': {'objectId': '1'},
+    }
+    with pytest.raises(RuntimeError, match="inspect command failed: {'code': -32601, 'message': 'not found'}"):
+        inspector.call('Test.fail')
+    assert inspector._pending == {}
+    inspector.stop()
+    inspector.join(1)
+
+
+def test_inspect_loop_sessions(inspect_root: str):
+    inspect_loop = get_inspect_loop()
+    inspectors = [Inspector(session_id=f'session-{i}', log=LogStore(), root=inspect_root) for i in range(5)]
+    for inspector in inspectors:
+        inspector.start()
+
+    for inspector in inspectors:
+        assert inspector.ready.wait(2)
+        assert inspector.log.wait_for_count(1, 2)
+        assert inspector.log == ['LOG worker.js:5> "hello"']
+        assert inspect_loop.connections[inspector.session_id] is inspector
+
+    for inspector in inspectors:
+        inspector.stop()
+    for inspector in inspectors:
+        inspector.join(1)
+    assert not any(inspector.session_id in inspect_loop.connections for inspector in inspectors)
+    assert get_inspect_loop() is inspect_loop
+
+
+def test_inspect_pool(inspect_root: str):
+    pool = InspectPool(2, root=inspect_root)
+    inspector = pool.pop()
+    assert inspector.ready.wait(2)
+    assert len(pool._ready) == 2
+    assert all(i.session_id != inspector.session_id for i in pool._ready)
+    assert all(i.ready.wait(2) for i in pool._ready)
+
+    pool._ready[0].stop()
+    inspector2 = pool.pop()
+    assert inspector2 is not None
+    assert not inspector2.closed
+    assert len(pool._ready) == 2
+
+    pool.close()
+    assert len(pool._ready) == 0
+    inspector.stop()
+    inspector2.stop()
+
+
+def test_client_pool(inspect_root: str):
+    client = TestClient(preview_id='x', inspect_pool_size=1)
+    client._inspect_root = inspect_root
+    client.new_cf_session()
+    assert client._inspector is not None
+    assert client._session_id == client._inspector.session_id
+    client._wait_inspect_ready()
+    assert client.inspect_log_wait(1) == ['LOG worker.js:5> "hello"']
+
+    session_id = client._session_id
+    client.new_cf_session()
+    assert client._session_id != session_id
+    client.inspect_enabled = False
+    client._wait_inspect_ready()
+    assert client._inspector is None
+    client.close()
+
+
+def object_event(*args) -> str:
+    params = {'type': 'log', 'args': list(args), 'stackTrace': {'callFrames': [{'url': 'worker.js', 'lineNumber': 0}]}}
+    return json.dumps({'method': 'Runtime.consoleAPICalled', 'params': params})
+
+
+def remote(object_id: str, subtype: str = None) -> dict:
+    obj = {'type': 'object', 'className': 'Object', 'description': 'Object', 'objectId': object_id}
+    if subtype:
+        obj.update(subtype=subtype, className='Array', description='Array(2)')
+    return obj
+
+
+def prop(name: str, value: dict, enumerable: bool = True) -> dict:
+    return {'name': name, 'value': value, 'enumerable': enumerable, 'isOwn': True}
+
+
+def test_expand_objects(inspect_server):
+    """
+    getProperties replies are delayed, so expanding serially would take one delay per object.
+    """
+    objects = {
+        'child': [prop('0', {'type': 'number', 'value': 1}), prop('1', {'type': 'string', 'value': 'x'})],
+        'deep': [prop('a', remote('deeper'))],
+        'deeper': [prop('b', {'type': 'boolean', 'value': 'true'})],
+    }
+    for i in range(10):
+        objects[f'obj-{i}'] = [
+            prop('i', {'type': 'number', 'value': i}),
+            prop('child', remote('child', 'array')),
+            prop('deep', remote('deep')),
+            prop('hidden', {'type': 'string', 'value': 'x'}, enumerable=False),
+        ]
+    calls = []
+
+    async def reply(ws, data):
+        if data['method'] == 'Runtime.getProperties':
+            calls.append(data['params']['objectId'])
+            await asyncio.sleep(0.1)
+            result = {'result': objects[data['params']['objectId']]}
+        else:
+            result = {}
+        await ws.send(json.dumps({'id': data['id'], 'result': result}))
+        if data['id'] == 8:
+            for i in range(10):
+                await ws.send(object_event({'type': 'string', 'value': 'obj'}, remote(f'obj-{i}')))
+            await ws.send(console_event('after'))
+
+    async def handler(ws, path=None):
+        async for msg in ws:
+            asyncio.ensure_future(reply(ws, json.loads(msg)))
+
+    log = LogStore()
+    inspector = Inspector(session_id='abc', log=log, root=inspect_server(handler), expand_depth=2)
+    start = perf_counter()
+    inspector.start()
+    assert log.wait_for_count(11, 5)
+    time_taken = perf_counter() - start
+    inspector.stop()
+    inspector.join(1)
+
+    # two levels of round trips rather than one per object
+    assert time_taken < 0.6
+    # properties are only reused within a message, so they aren't kept for every object logged
+    assert sorted(calls) == ['child'] * 10 + ['deep'] * 10 + [f'obj-{i}' for i in range(10)]
+    assert log[0].args == ['obj', {'i': 0.0, 'child': [1.0, 'x'], 'deep': {'a': 'Object'}}]
+    assert log[9].message == '"obj", {"i": 9.0, "child": [1.0, "x"], "deep": {"a": "Object"}}'
+    # messages are kept in the order they were received
+    assert log[10] == 'LOG worker.js:5> "after"'
+
+
+def test_expand_depth(emulator_client):
+    def worker(request, env, console):
+        console.log({'a': {'b': [1, {'c': 2}]}}, line=1)
+        return WorkerResponse('ok')
+
+    client = emulator_client(worker)
+    for depth, expected in (
+        (0, '"Object"'),
+        (1, '{"a": "Object"}'),
+        (3, '{"a": {"b": [1.0, "Object"]}}'),
+        (4, '{"a": {"b": [1.0, {"c": 2.0}]}}'),
+    ):
+        client.new_cf_session()
+        client.inspect_expand_depth = depth
+        assert client.get('/').status_code == 200
+        assert client.inspect_log_wait(1)[0].message == expected
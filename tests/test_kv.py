@@ -0,0 +1,94 @@
+import json
+from pathlib import Path
+from time import time
+
+import pytest
+
+from pytest_cloudflare_worker.emulator import Emulator
+from pytest_cloudflare_worker.kv import KVNamespace, KVStore
+from pytest_cloudflare_worker.main import build_bindings
+
+
+def test_get_put():
+    ns = KVNamespace('ns')
+    assert ns.get('foo') is None
+    ns.put('foo', 'bar')
+    ns.put('json', '{"a": 1}')
+    ns.put('bytes', b'\x00\x01')
+    assert ns.get('foo') == 'bar'
+    assert ns.get('foo', 'arrayBuffer') == b'bar'
+    assert ns.get('json', 'json') == {'a': 1}
+    assert ns.get('bytes', 'arrayBuffer') == b'\x00\x01'
+    ns.delete('foo')
+    ns.delete('missing')
+    assert ns.get('foo') is None
+    assert ns.list() == ['bytes', 'json']
+    assert ns.list(prefix='j') == ['json']
+    assert repr(ns) == '<KVNamespace ns 2 keys>'
+
+
+def test_expiration():
+    ns = KVNamespace('ns')
+    ns.put('ttl', 'x', expiration_ttl=60)
+    ns.put('expired', 'x', expiration=time() - 1)
+    ns.put('expired_ttl', 'x', expiration_ttl=-1)
+    assert ns.get('ttl') == 'x'
+    assert ns.get('expired') is None
+    assert ns.list() == ['ttl']
+    assert ns.dump() == {'ttl': 'x'}
+
+
+def test_seed_jsonl(tmp_path: Path):
+    path = tmp_path / 'seed.jsonl'
+    lines = [{'key': f'key-{i}', 'value': f'value-{i}'} for i in range(5000)]
+    lines += [
+        {'key': 'binary', 'value': 'AAE=', 'base64': True},
+        {'key': 'expired', 'value': 'x', 'expiration': time() - 1},
+    ]
+    path.write_text('\n'.join(json.dumps(line) for line in lines) + '\n\n')
+    ns = KVNamespace('ns')
+    assert ns.seed(path) == 5002
+    assert ns.seed({'extra': 'value'}) == 1
+    assert len(ns) == 5002
+    assert ns.get('key-4999') == 'value-4999'
+    assert ns.get('binary', 'arrayBuffer') == b'\x00\x01'
+
+    path.write_text('{"key": "a", "value": "b"}\n{"key": "c"}\n')
+    with pytest.raises(ValueError, match=r'seed\.jsonl:2: invalid KV entry'):
+        KVNamespace('ns').seed(str(path))
+
+
+def test_store_snapshot():
+    store = KVStore()
+    store.namespace('a').seed({'x': '1'})
+    snapshot = store.snapshot()
+    store.namespace('a').put('y', '2')
+    store.namespace('a').delete('x')
+    store.namespace('b').put('z', '3')
+    assert store.namespace('a') is store.namespace('a')
+
+    store.restore(snapshot)
+    assert store.namespace('a').dump() == {'x': '1'}
+    assert store.namespace('b').dump() == {}
+
+
+def test_local_kv_bindings():
+    wrangler_data = {
+        'kv_namespaces': [{'binding': 'A', 'id': 'a-id', 'preview_id': 'a-preview'}, {'binding': 'B', 'id': 'b-id'}]
+    }
+    assert build_bindings(wrangler_data, False)[1:] == []
+    assert build_bindings(wrangler_data, True)[1:] == [
+        {'name': 'A', 'type': 'kv_namespace', 'namespace_id': 'a-preview'}
+    ]
+    assert build_bindings(wrangler_data, False, local_kv=True)[1:] == [
+        {'name': 'A', 'type': 'kv_namespace', 'namespace_id': 'a-preview'},
+        {'name': 'B', 'type': 'kv_namespace', 'namespace_id': 'b-id'},
+    ]
+
+
+def test_emulator_kv(emulator: Emulator, emulator_client):
+    client = emulator_client(emulator=emulator, local_kv=True)
+    r = client.post('/kv/', params={'key': 'foo'}, data='bar')
+    assert r.status_code == 200, r.text
+    assert r.json()['KV'] == {'foo': 'bar'}
+    assert emulator.kv.namespace('06b957fd6edd4b588e944f85192ff28b').dump() == {'foo': 'bar'}
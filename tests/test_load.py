@@ -0,0 +1,102 @@
+from collections import Counter
+
+import pytest
+
+from pytest_cloudflare_worker.load import LatencyHistogram, LoadResult, run_load
+
+
+def test_histogram_percentiles():
+    h = LatencyHistogram()
+    for ms in range(1, 1001):
+        h.record(ms / 1000)
+    assert h.count == 1000
+    assert h.min == 0.001
+    assert h.max == 1.0
+    assert h.mean == pytest.approx(0.5005)
+    # values are recorded to within 1/64 and percentiles report the top of the bucket
+    assert 0.5 <= h.percentile(50) < 0.5 * (1 + 1 / 64)
+    assert 0.9 <= h.percentile(90) < 0.9 * (1 + 1 / 64)
+    assert 0.99 <= h.percentile(99) < 0.99 * (1 + 1 / 64)
+    assert h.percentile(100) == 1.0
+    assert len(h.counts) < 400
+    assert sum(c for _, _, c in h.buckets()) == 1000
+
+
+def test_histogram_small_values():
+    h = LatencyHistogram()
+    h.record(0.000_005)
+    h.record(-1)
+    assert list(h.buckets()) == [(0, 0.000_001, 1), (0.000_005, 0.000_006, 1)]
+    assert h.percentile(50) == 0
+    assert LatencyHistogram().percentile(50) == 0
+
+
+def test_histogram_merge():
+    a, b = LatencyHistogram(), LatencyHistogram()
+    a.record(0.01)
+    b.record(0.02)
+    b.record(0.03)
+    a.merge(b)
+    assert a.count == 3
+    assert (a.min, a.max) == (0.01, 0.03)
+    assert a.total == pytest.approx(0.06)
+    a.merge(LatencyHistogram())
+    assert a.count == 3
+
+
+def test_run_load_requests():
+    calls = []
+
+    def send():
+        calls.append(1)
+        if len(calls) % 10 == 0:
+            raise ConnectionError('boom')
+        return 500 if len(calls) % 5 == 0 else 200
+
+    result = run_load(send, concurrency=4, requests=100)
+    assert len(calls) == 100
+    assert result.requests == 100
+    assert result.status_codes == {200: 80, 500: 10, 'ConnectionError': 10}
+    assert result.worker_errors == 10
+    assert result.exceptions == 10
+    assert result.error_rate == 0.2
+    assert result.histogram.count == 90
+    assert result.throughput > 0
+
+
+def test_run_load_duration():
+    result = run_load(lambda: 204, concurrency=2, duration=0.05)
+    assert result.requests > 0
+    assert result.duration >= 0.05
+    assert result.status_codes == {204: result.requests}
+
+
+@pytest.mark.parametrize('kwargs', [{}, {'duration': 1, 'requests': 1}])
+def test_run_load_invalid(kwargs):
+    with pytest.raises(ValueError, match='exactly one of "duration" and "requests" must be set'):
+        run_load(lambda: 200, concurrency=1, **kwargs)
+
+
+def test_load_result_str():
+    h = LatencyHistogram()
+    h.record(0.01)
+    r = LoadResult(concurrency=2, duration=0.5, histogram=h, status_codes=Counter({200: 1}))
+    assert str(r) == (
+        '1 requests in 0.50s with concurrency 2, 2.0 req/s, p50=10.0ms p90=10.0ms p99=10.0ms max=10.0ms, '
+        'errors 0.00% (0 worker errors)'
+    )
+    assert repr(r).startswith('<LoadResult 1 requests')
+
+
+def test_client_load(emulator_client):
+    client = emulator_client()
+    result = client.load('GET', 'https://example.com/load', concurrency=5, requests=50)
+    assert result.status_codes == {200: 50}
+    assert result.error_rate == 0
+    assert 0 < result.p50 <= result.p90 <= result.p99 <= result.max
+    client.inspect_log_wait(50)
+
+    result = client.load('GET', '/kv/', concurrency=2, requests=4)
+    assert result.status_codes == {500: 4}
+    assert result.worker_errors == 4
+    assert result.error_rate == 1
@@ -0,0 +1,178 @@
+import json
+from pathlib import Path
+from threading import Timer
+from time import monotonic
+
+import pytest
+
+from pytest_cloudflare_worker.inspect import LogMsg
+from pytest_cloudflare_worker.logs import LogStore, RequestLogs, read_log_file
+
+
+def console_msg(level: str, message: str, file: str = 'worker.js') -> LogMsg:
+    params = {
+        'type': level,
+        'args': [{'type': 'string', 'value': message}],
+        'stackTrace': {'callFrames': [{'url': file, 'lineNumber': 0}]},
+    }
+    return LogMsg.from_raw({'method': 'Runtime.consoleAPICalled', 'params': params})
+
+
+def test_list_like():
+    logs = LogStore()
+    assert logs == []
+    assert len(logs) == 0
+    logs.append(console_msg('log', 'a'))
+    logs.append(console_msg('error', 'b'))
+    assert logs == ['LOG worker.js:1> "a"', 'ERROR worker.js:1> "b"']
+    assert [{'level': 'LOG'}, {'level': 'ERROR'}] == logs
+    assert logs[1] == {'message': '"b"'}
+    assert logs[:1] == ['LOG worker.js:1> "a"']
+    assert [msg.level for msg in logs] == ['LOG', 'ERROR']
+    assert repr(logs) == '[\'LOG worker.js:1> "a"\', \'ERROR worker.js:1> "b"\']'
+
+
+def test_since():
+    logs = LogStore()
+    logs.append(console_msg('error', 'before'))
+    cursor = logs.cursor()
+    assert cursor == 1
+    logs.append(console_msg('log', 'a'))
+    logs.append(console_msg('error', 'b', file='other.js'))
+    assert logs.since(cursor) == ['LOG worker.js:1> "a"', 'ERROR other.js:1> "b"']
+    assert logs.since(cursor, level='ERROR') == ['ERROR other.js:1> "b"']
+    assert logs.since(level='ERROR') == ['ERROR worker.js:1> "before"', 'ERROR other.js:1> "b"']
+    logs.append(console_msg('error', 'c'))
+    assert logs.since(cursor, level='ERROR', file='worker.js') == ['ERROR worker.js:1> "c"']
+    assert logs.since(method='Runtime.consoleAPICalled') == logs
+    assert logs.since(method='Runtime.exceptionThrown') == []
+    assert logs.since(level='WARN') == []
+
+
+def test_wait_for():
+    logs = LogStore()
+    logs.append(console_msg('error', 'old'))
+    cursor = logs.cursor()
+    Timer(0.05, logs.append, (console_msg('log', 'a'),)).start()
+    Timer(0.1, logs.append, (console_msg('error', 'b'),)).start()
+    errors = logs.wait_for(lambda msg: msg.level == 'ERROR', 2, cursor=cursor)
+    assert errors == ['ERROR worker.js:1> "b"']
+    assert len(logs) == 3
+
+
+def test_wait_for_timeout():
+    logs = LogStore()
+    logs.append(console_msg('log', 'a'))
+    assert logs.wait_for(lambda msg: msg.level == 'ERROR', 0.01) == []
+    assert logs.wait_for(lambda msg: True, 0.01, count=2) == ['LOG worker.js:1> "a"']
+    assert logs.wait_for_count(1, 0)
+    assert not logs.wait_for_count(2, 0.01)
+
+
+def test_raw():
+    data = {
+        'method': 'Runtime.exceptionThrown',
+        'params': {'exceptionDetails': {'exception': {'description': 'Error: x'}, 'url': 'worker.js', 'lineNumber': 2}},
+    }
+    msg = LogMsg.from_raw(data, json.dumps(data))
+    assert msg.method == 'Runtime.exceptionThrown'
+    assert msg.full == data
+    assert msg == 'ERROR worker.js:3> Error: x'
+    assert msg == {'level': 'ERROR', 'line': 3}
+    assert msg != {'missing': 1}
+
+
+def test_max_count():
+    logs = LogStore(max_count=2)
+    for i in range(5):
+        logs.append(console_msg('error' if i % 2 else 'log', str(i)))
+    assert logs == ['ERROR worker.js:1> "3"', 'LOG worker.js:1> "4"']
+    assert len(logs) == logs.cursor() == 5
+    assert logs[3] == 'ERROR worker.js:1> "3"'
+    assert logs[-1] == 'LOG worker.js:1> "4"'
+    assert logs[1:] == ['ERROR worker.js:1> "3"', 'LOG worker.js:1> "4"']
+    with pytest.raises(IndexError, match='evicted'):
+        logs[1]
+    with pytest.raises(IndexError, match='out of range'):
+        logs[5]
+    assert logs.since(1) == logs
+    assert logs.since(level='ERROR') == ['ERROR worker.js:1> "3"']
+    assert logs.wait_for(lambda msg: True, 0, cursor=2) == logs
+    assert list(logs.spilled()) == []
+
+
+def test_max_bytes():
+    size = console_msg('log', '0').size
+    logs = LogStore(max_bytes=size * 3)
+    for i in range(5):
+        logs.append(console_msg('log', str(i)))
+    assert [msg.message for msg in logs] == ['"2"', '"3"', '"4"']
+    logs.limit(max_bytes=size)
+    assert logs == ['LOG worker.js:1> "4"']
+    logs.limit()
+    for i in range(5, 8):
+        logs.append(console_msg('log', str(i)))
+    assert len(list(logs)) == 4
+
+
+def test_spill(tmp_path: Path):
+    spill_path = tmp_path / 'logs' / 'session.jsonl.gz'
+    logs = LogStore(max_count=3, spill_path=spill_path)
+    data = {'method': 'Runtime.consoleAPICalled', 'params': console_msg('warning', 'raw').full['params']}
+    logs.append(LogMsg.from_raw(data, json.dumps(data).encode()))
+    for i in range(5):
+        logs.append(console_msg('log', str(i)))
+    assert logs == ['LOG worker.js:1> "2"', 'LOG worker.js:1> "3"', 'LOG worker.js:1> "4"']
+
+    spilled = logs.spilled()
+    assert next(spilled) == 'WARNING worker.js:1> "raw"'
+    assert list(spilled) == ['LOG worker.js:1> "0"', 'LOG worker.js:1> "1"']
+
+    logs.close()
+    logs.append(console_msg('error', 'after close'))
+    assert [msg.message for msg in logs.spilled()] == ['"raw"', '"0"', '"1"', '"2"']
+    logs.close()
+    assert len(list(read_log_file(spill_path))) == 4
+
+
+def test_request_logs():
+    logs = LogStore()
+    logs.append(console_msg('log', 'before'))
+    first = RequestLogs(logs, logs.cursor())
+    assert first == []
+    Timer(0.05, logs.append, (console_msg('log', 'a'),)).start()
+    assert first.wait(1) == ['LOG worker.js:1> "a"']
+    first.end = logs.cursor()
+
+    second = RequestLogs(logs, logs.cursor())
+    logs.append(console_msg('error', 'b'))
+    assert first == ['LOG worker.js:1> "a"']
+    assert first.wait_for(lambda msg: msg.level == 'ERROR', 1) == []
+    assert second.wait_for(lambda msg: msg.level == 'ERROR', 1) == ['ERROR worker.js:1> "b"']
+    assert len(second) == 1
+    assert second[0].level == 'ERROR'
+    assert repr(second) == '[\'ERROR worker.js:1> "b"\']'
+    with pytest.raises(TimeoutError, match='1 logs received for the request, expected 2'):
+        second.wait(2, timeout=0.01)
+
+
+def test_wait_for_quiet():
+    logs = LogStore()
+    start = monotonic()
+    Timer(0.05, logs.append, (console_msg('log', 'a'),)).start()
+    logs.wait_for_quiet(0.1, 1)
+    assert logs == ['LOG worker.js:1> "a"']
+    assert monotonic() - start >= 0.15
+
+    start = monotonic()
+    logs.wait_for_quiet(1, 0.05)
+    assert monotonic() - start < 0.5
+
+
+def test_mirror():
+    combined = LogStore()
+    a, b = LogStore(mirror=combined), LogStore(mirror=combined)
+    a.append(console_msg('log', 'a'))
+    b.append(console_msg('log', 'b'))
+    assert combined == ['LOG worker.js:1> "a"', 'LOG worker.js:1> "b"']
+    assert b == ['LOG worker.js:1> "b"']
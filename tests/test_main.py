@@ -1,9 +1,12 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from time import sleep
 
 import pytest
 
-from pytest_cloudflare_worker.main import TestClient, deploy
+from pytest_cloudflare_worker.cache import BuildCache, DeployCache
+from pytest_cloudflare_worker.main import TestClient, build_bindings, build_source, deploy, environment_data
 
 auth_test = pytest.mark.skipif(not os.getenv('CLOUDFLARE_API_TOKEN'), reason='requires CLOUDFLARE_API_TOKEN env var')
 
@@ -113,3 +116,169 @@ def test_bad_upload(wrangler_dir: Path):
     finally:
         if env_api_token:
             os.environ['CLOUDFLARE_API_TOKEN'] = env_api_token
+
+
+def test_deploy_cache(wrangler_dir: Path, tmp_path: Path, mocker):
+    post = mocker.patch('pytest_cloudflare_worker.main.shared_session').return_value.request
+    post.return_value.status_code = 200
+    post.return_value.json.return_value = {'id': 'a' * 32}
+    cache = DeployCache(tmp_path)
+
+    preview_id, bindings = deploy(wrangler_dir, authenticate=False, cache=cache)
+    assert preview_id == 'a' * 32
+    assert post.call_count == 1
+    assert len(list(tmp_path.iterdir())) == 1
+
+    post.return_value.json.return_value = {'id': 'b' * 32}
+    preview_id2, bindings2 = deploy(wrangler_dir, authenticate=False, cache=cache)
+    assert preview_id2 == 'a' * 32
+    assert bindings2 == bindings
+    assert post.call_count == 1
+
+    cache.ttl = 0
+    preview_id3, _ = deploy(wrangler_dir, authenticate=False, cache=cache)
+    assert preview_id3 == 'b' * 32
+    assert post.call_count == 2
+
+
+def test_deploy_cache_key():
+    key = DeployCache.key('https://example.com', b'script', '{}')
+    assert len(key) == 64
+    assert DeployCache.key('https://example.com', b'script', '{}') == key
+    assert DeployCache.key('https://example.com', b'script2', '{}') != key
+    assert DeployCache.key('https://example.com/', b'script', '{}') != key
+
+
+def test_build_cache(tmp_path: Path, mocker):
+    wrangler_dir = tmp_path / 'worker'
+    wrangler_dir.mkdir()
+    (wrangler_dir / 'wrangler.toml').write_text('name = "testing"\ntype = "webpack"\n[env.staging]\n')
+    (wrangler_dir / 'index.js').write_text('console.log(1)')
+    (wrangler_dir / 'node_modules').mkdir()
+    (wrangler_dir / 'node_modules' / 'foo.js').write_text('foo')
+
+    def wrangler_build(*args, **kwargs):
+        (wrangler_dir / 'dist').mkdir(exist_ok=True)
+        (wrangler_dir / 'dist' / 'worker.js').write_text('built')
+
+    run = mocker.patch('pytest_cloudflare_worker.main.subprocess.run', side_effect=wrangler_build)
+    build_cache = BuildCache(tmp_path / 'cache')
+
+    source_path, _ = build_source(wrangler_dir, build_cache=build_cache)
+    assert source_path == wrangler_dir / 'dist' / 'pytest-cloudflare-worker' / 'worker.js'
+    assert source_path.read_text() == 'built'
+    assert run.call_count == 1
+    build_source(wrangler_dir, build_cache=build_cache)
+    assert run.call_count == 1
+    assert (build_cache.hits, build_cache.misses) == (1, 1)
+
+    (wrangler_dir / 'node_modules' / 'foo.js').write_text('changed, but excluded')
+    build_source(wrangler_dir, build_cache=build_cache)
+    assert run.call_count == 1
+
+    (wrangler_dir / 'index.js').write_text('console.log(2)')
+    build_source(wrangler_dir, build_cache=build_cache)
+    assert run.call_count == 2
+
+    source_path.unlink()
+    build_source(wrangler_dir, build_cache=build_cache)
+    assert run.call_count == 3
+    assert (build_cache.hits, build_cache.misses) == (2, 3)
+
+    staging_path, _ = build_source(wrangler_dir, build_cache=build_cache, environment='staging')
+    assert staging_path == wrangler_dir / 'dist' / 'pytest-cloudflare-worker' / 'env' / 'staging' / 'worker.js'
+    assert run.call_count == 4
+    assert run.call_args.args[0] == ('wrangler', 'build', '--env', 'staging')
+    build_source(wrangler_dir, build_cache=build_cache, environment='staging')
+    # each environment has its own record and script, building one doesn't make the other stale
+    build_source(wrangler_dir, build_cache=build_cache)
+    assert run.call_count == 4
+
+
+def test_build_environments_concurrently(tmp_path: Path, mocker):
+    wrangler_dir = tmp_path
+    (wrangler_dir / 'wrangler.toml').write_text('name = "testing"\ntype = "webpack"\n[env.a]\n[env.b]\n')
+
+    def wrangler_build(args, **kwargs):
+        (wrangler_dir / 'dist').mkdir(exist_ok=True)
+        (wrangler_dir / 'dist' / 'worker.js').write_text(f'built for {args[-1]}')
+
+    mocker.patch('pytest_cloudflare_worker.main.subprocess.run', side_effect=wrangler_build)
+
+    def build(environment: str) -> str:
+        source_path, _ = build_source(wrangler_dir, environment=environment)
+        sleep(0.01)
+        # the script isn't replaced by the other environment's build before it's uploaded
+        return source_path.read_text()
+
+    with ThreadPoolExecutor(4) as pool:
+        assert list(pool.map(build, ['a', 'b'] * 4)) == ['built for a', 'built for b'] * 4
+
+
+def test_build_cache_ignore_dirs(tmp_path: Path, mocker):
+    wrangler_dir = tmp_path
+    (wrangler_dir / 'wrangler.toml').write_text('name = "testing"\ntype = "webpack"\n')
+
+    def wrangler_build(*args, **kwargs):
+        (wrangler_dir / 'dist').mkdir(exist_ok=True)
+        (wrangler_dir / 'dist' / 'worker.js').write_text('built')
+
+    run = mocker.patch('pytest_cloudflare_worker.main.subprocess.run', side_effect=wrangler_build)
+    build_cache = BuildCache(wrangler_dir / '.cache' / 'd' / 'build', ignore_dirs=[wrangler_dir / '.cache'])
+    build_source(wrangler_dir, build_cache=build_cache)
+    (wrangler_dir / '.cache' / 'v').mkdir()
+    (wrangler_dir / '.cache' / 'v' / 'lastfailed').write_text('{}')
+    (wrangler_dir / '.pytest_cache').mkdir()
+    (wrangler_dir / '.pytest_cache' / 'README.md').write_text('excluded by default')
+    build_source(wrangler_dir, build_cache=build_cache)
+    assert run.call_count == 1
+    assert (build_cache.hits, build_cache.misses) == (1, 1)
+
+
+wrangler_envs = {
+    'name': 'testing',
+    'type': 'javascript',
+    'account_id': 'abc',
+    'vars': {'FOO': 'root'},
+    'kv_namespaces': [{'binding': 'THINGS', 'id': '1', 'preview_id': '2'}],
+    'env': {
+        'staging': {'vars': {'FOO': 'staging'}, 'preview': {'vars': {'FOO': 'staging-preview'}}},
+        'production': {'name': 'prod', 'kv_namespaces': [{'binding': 'OTHER', 'id': '3', 'preview_id': '4'}]},
+    },
+}
+
+
+def test_environment_data():
+    assert environment_data(wrangler_envs, None) is wrangler_envs
+    assert environment_data(wrangler_envs, 'staging') == {
+        'name': 'testing-staging',
+        'type': 'javascript',
+        'account_id': 'abc',
+        'vars': {'FOO': 'staging'},
+        'preview': {'vars': {'FOO': 'staging-preview'}},
+    }
+    assert environment_data(wrangler_envs, 'production') == {
+        'name': 'prod',
+        'type': 'javascript',
+        'account_id': 'abc',
+        'kv_namespaces': [{'binding': 'OTHER', 'id': '3', 'preview_id': '4'}],
+    }
+    with pytest.raises(ValueError, match='environment "missing" not found in wrangler.toml'):
+        environment_data(wrangler_envs, 'missing')
+
+
+def test_environment_bindings():
+    testing = {'name': '__TESTING__', 'type': 'plain_text', 'text': 'TRUE'}
+    assert build_bindings(environment_data(wrangler_envs, 'staging'), True) == [
+        testing,
+        {'name': 'FOO', 'type': 'plain_text', 'text': 'staging-preview'},
+    ]
+    assert build_bindings(environment_data(wrangler_envs, 'production'), True) == [
+        testing,
+        {'name': 'OTHER', 'type': 'kv_namespace', 'namespace_id': '4'},
+    ]
+    assert build_bindings(wrangler_envs, True) == [
+        testing,
+        {'name': 'FOO', 'type': 'plain_text', 'text': 'root'},
+        {'name': 'THINGS', 'type': 'kv_namespace', 'namespace_id': '2'},
+    ]
@@ -0,0 +1,83 @@
+import json
+from pathlib import Path
+
+from pytest_cloudflare_worker.perf import ClientStats, PerfReport, explain
+
+
+def test_client_stats():
+    stats = ClientStats()
+    stats.record_request(0.1)
+    stats.record_request(0.3)
+    stats.log_wait = 0.05
+    other = ClientStats()
+    other.record_request(0.2)
+    other.deploy = 1.5
+    other.record_connection(True, tls=True)
+    other.record_connection(False)
+    other.bytes_sent = 1500
+    stats.merge(other)
+    assert stats.as_dict() == {
+        'requests': 3,
+        'request_time': 0.6000000000000001,
+        'max_request': 0.3,
+        'log_wait': 0.05,
+        'setup': 0,
+        'deploy': 1.5,
+        'connections': 1,
+        'reused_connections': 1,
+        'tls_handshakes': 1,
+        'bytes_sent': 1500,
+        'bytes_received': 0,
+    }
+    assert ClientStats.from_dict(stats.as_dict()).as_dict() == stats.as_dict()
+    assert str(stats).startswith('requests: 3, total 600.0ms, max 300.0ms\n')
+    assert str(stats).endswith('connections: 1 new (1 TLS), 1 reused, 1.5kB sent, 0.0kB received')
+    stats.reset()
+    assert stats.as_dict() == ClientStats().as_dict()
+
+
+def test_explain():
+    stats = {'requests': 2, 'request_time': 0.2, 'max_request': 0.15, 'log_wait': 0.5, 'setup': 0, 'deploy': 0}
+    assert explain(1, stats) == 'log wait 500.0ms, other 300.0ms, requests 200.0ms (2 requests, max 150.0ms)'
+    assert explain(0.1, {'requests': 0, 'deploy': 0.1}) == 'deploy 100.0ms'
+    stats['connections'] = 2
+    assert explain(1, stats).endswith('(2 requests, max 150.0ms, 2 new connections)')
+
+
+def test_perf_report(tmp_path: Path):
+    report = PerfReport()
+    for nodeid, duration in ('a', 0.5), ('b', 2), ('c', 1), ('no-client', 5):
+        report.add_duration(nodeid, duration / 2)
+        report.add_duration(nodeid, duration / 2)
+    report.add_stats('a', ClientStats().as_dict())
+    report.add_stats('b', {**ClientStats().as_dict(), 'deploy': 1.5})
+    report.add_stats('c', {**ClientStats().as_dict(), 'requests': 1, 'request_time': 0.2, 'max_request': 0.2})
+    report.add_stats('c', {**ClientStats().as_dict(), 'requests': 1, 'request_time': 0.5, 'max_request': 0.5})
+
+    assert [nodeid for nodeid, _, _ in report.slowest()] == ['b', 'c', 'a']
+    assert report.summary(2) == [
+        '    2.00s b',
+        '          deploy 1500.0ms, other 500.0ms',
+        '    1.00s c',
+        '          requests 700.0ms, other 300.0ms (2 requests, max 500.0ms)',
+    ]
+
+    path = tmp_path / 'perf' / 'report.json'
+    report.write_json(path)
+    tests = json.loads(path.read_text())['tests']
+    assert [t['nodeid'] for t in tests] == ['b', 'c', 'a']
+    assert tests[1] == {
+        'nodeid': 'c',
+        'duration': 1,
+        'requests': 2,
+        'request_time': 0.7,
+        'max_request': 0.5,
+        'log_wait': 0,
+        'setup': 0,
+        'deploy': 0,
+        'connections': 0,
+        'reused_connections': 0,
+        'tls_handshakes': 0,
+        'bytes_sent': 0,
+        'bytes_received': 0,
+    }
@@ -1,6 +1,18 @@
+import json
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from threading import Event
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Dict
+
 import pytest
 
-from pytest_cloudflare_worker import TestClient, WorkerError
+from pytest_cloudflare_worker import LoadResult, TestClient, WorkerError, plugin
+from pytest_cloudflare_worker.perf import ClientStats
+from pytest_cloudflare_worker.plugin import get_workers, shared_deploy, start_background_deploy
 
 
 def test_client_get(client: TestClient):
@@ -55,10 +67,12 @@ def test_invalid_url(client: TestClient):
         client.get('https://wrong.com')
 
 
-def test_worker_error(client: TestClient):
+def test_worker_error(request, client: TestClient):
     """
     Use the fact that anon clients don't have access to KV worker to cause a 500 error
     """
+    if request.config.getoption('--cf-emulator'):
+        pytest.skip('the emulator binds KV namespaces locally')
     with pytest.raises(WorkerError, match='worker.js:28> ReferenceError: THINGS is not defined'):
         client.get('/kv/')
 
@@ -70,26 +84,421 @@ def test_client_console(client: TestClient):
     # debug(logs)
     assert logs == [
         {'level': 'LOG', 'message': '"handling request:", "GET", "/console"'},
-        # {'level': 'LOG', 'line': 31, 'message': '"object", {"foo": "bar", "spam": 1.0}'},
-        {'level': 'LOG', 'line': 31, 'message': '"object", "Object"'},
-        # {'level': 'LOG', 'message': '"list", ["s", 1.0, 2.0, true, false, null, "<undefined>"]'},
-        {'level': 'LOG', 'message': '"list", "Array(7)"'},
+        {'level': 'LOG', 'line': 31, 'message': '"object", {"foo": "bar", "spam": 1.0}'},
+        {'level': 'LOG', 'message': '"list", ["s", 1.0, 2.0, true, false, null, "<undefined>"]'},
         {'level': 'LOG', 'file': 'worker.js'},
     ]
     assert logs[0] == 'LOG worker.js:7> "handling request:", "GET", "/console"'
     assert logs[0].startswith('LOG worker.js:7>')
     assert repr(logs[0]) == '\'LOG worker.js:7> "handling request:", "GET", "/console"\''
     assert logs[0] != 123
-    # assert logs[2].message == '"list", ["s", 1.0, 2.0, true, false, null, "<undefined>"]'
-    # assert logs[2].args == ['list', ['s', 1, 2, True, False, None, '<undefined>']]
+    assert logs[2].message == '"list", ["s", 1.0, 2.0, true, false, null, "<undefined>"]'
+    assert logs[2].args == ['list', ['s', 1, 2, True, False, None, '<undefined>']]
     assert logs[3].endswith('(Coordinated Universal Time)"')
     with pytest.raises(TimeoutError, match='4 logs received, expected 10'):
         client.inspect_log_wait(10, wait_time=0)
 
 
+def test_client_log_limit(client: TestClient, tmp_path: Path):
+    client.inspect_enabled = True
+    client.inspect_log_max_count = 1
+    client.inspect_log_spill_dir = tmp_path
+    try:
+        assert client.get('/console').status_code == 200
+        logs = client.inspect_log_wait(4)
+        assert len(logs) == 4
+        if client.cassette is not None:
+            # nothing is evicted while using a cassette, it's saved with every request's logs
+            assert len(list(logs)) == 4
+            return
+        assert list(logs) == [logs[3]]
+        assert [msg.level for msg in logs.spilled()] == ['LOG', 'LOG', 'LOG']
+    finally:
+        client.inspect_log_max_count = client.inspect_log_spill_dir = None
+    client.new_cf_session()
+    assert list(tmp_path.glob('*.jsonl.gz'))
+
+
 def test_inspect_disabled(client: TestClient):
     client.inspect_enabled = False
     r = client.get('/console')
     assert r.status_code == 200
 
     assert len(client.inspect_logs) == 0
+
+
+def test_shared_deploy(tmp_path: Path):
+    calls = []
+
+    def deploy_():
+        calls.append(1)
+        return 'a' * 32, [{'name': '__TESTING__', 'type': 'plain_text', 'text': 'TRUE'}]
+
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: shared_deploy(tmp_path, deploy_), range(8)))
+
+    assert len(calls) == 1
+    assert results == [('a' * 32, [{'name': '__TESTING__', 'type': 'plain_text', 'text': 'TRUE'}])] * 8
+
+
+@pytest.mark.cf_load('GET', '/', concurrency=4, requests=20)
+def test_cf_load(cf_load: LoadResult):
+    assert cf_load.requests == 20
+    assert cf_load.error_rate == 0
+    assert cf_load.p99 < 10
+
+
+def test_cf_client(cf_client: Dict[str, TestClient]):
+    assert list(cf_client) == ['example']
+    r = cf_client['example'].get('/')
+    assert r.status_code == 200
+    assert r.headers['x-foo'] == 'bar'
+
+
+class FakeConfig:
+    def __init__(self, ini, options, rootpath):
+        self.ini = ini
+        self.options = options
+        self.rootpath = rootpath
+
+    def getini(self, name):
+        return self.ini
+
+    def getoption(self, name):
+        return self.options
+
+
+def test_get_workers(tmp_path: Path):
+    config = FakeConfig(['api=workers/api', 'site=workers/site:staging'], ['api=other:production'], tmp_path)
+    assert get_workers(config) == [
+        ('api', Path.cwd() / 'other', 'production'),
+        ('site', tmp_path / 'workers' / 'site', 'staging'),
+    ]
+    with pytest.raises(pytest.UsageError, match='invalid worker "api", should be in the form'):
+        get_workers(FakeConfig([], ['api'], tmp_path))
+
+
+def test_shared_deploy_name(tmp_path: Path):
+    assert shared_deploy(tmp_path, lambda: ('a' * 32, []), name='api') == ('a' * 32, [])
+    assert shared_deploy(tmp_path, lambda: ('b' * 32, []), name='site') == ('b' * 32, [])
+    assert shared_deploy(tmp_path, lambda: ('c' * 32, []), name='api') == ('a' * 32, [])
+    assert (tmp_path / 'cloudflare_worker_deploy-api.json').exists()
+
+
+def test_client_stats(client: TestClient):
+    client.inspect_enabled = True
+    assert client.get('/1').status_code == 200
+    assert client.get('/2').status_code == 200
+    client.inspect_log_wait(2)
+    assert client.stats.requests == 2
+    assert 0 < client.stats.max_request <= client.stats.request_time
+    assert client.stats.log_wait > 0
+    # replayed requests make no connections
+    if client.cassette is None or client.cassette.recording:
+        # the session client's connections were opened before the test
+        assert client.stats.reused_connections == 2
+        assert client.stats.bytes_received > 0
+
+
+class OptionsConfig:
+    def __init__(self, **options):
+        self.options = {'collectonly': False, '--cf-emulator': False, '--cf-cassette-dir': None, **options}
+        self.option = SimpleNamespace(dist='no')
+        self._tmp_path_factory = None
+
+    def getoption(self, name):
+        return self.options[name]
+
+
+def test_background_deploy(monkeypatch):
+    monkeypatch.setattr(plugin, 'setup_session_client', lambda config, *args: ('client', config))
+    config = OptionsConfig()
+    future = start_background_deploy(config)
+    assert future.result(5) == ('client', config)
+
+    assert start_background_deploy(OptionsConfig(**{'--cf-emulator': True})) is None
+    assert start_background_deploy(OptionsConfig(**{'--cf-cassette-dir': 'cassettes'})) is None
+    assert start_background_deploy(OptionsConfig(collectonly=True)) is None
+    xdist_controller = OptionsConfig()
+    xdist_controller.option.dist = 'load'
+    assert start_background_deploy(xdist_controller) is None
+
+
+def test_lazy_imports():
+    code = (
+        'import sys, pytest_cloudflare_worker.plugin\n'
+        'assert not {"requests", "websockets", "toml"} & set(sys.modules), sys.modules\n'
+        'from pytest_cloudflare_worker import TestClient\n'
+        'assert "requests" in sys.modules'
+    )
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+
+def test_kv_seed_dump(request, client: TestClient):
+    if not request.config.getoption('--cf-emulator'):
+        pytest.skip('KV fixtures require the emulator')
+    kv_seed, kv_dump = request.getfixturevalue('kv_seed'), request.getfixturevalue('kv_dump')
+    assert kv_seed({f'key-{i}': str(i) for i in range(1000)}) == 1000
+    assert kv_seed({'x': 'y'}, binding='THINGS') == 1
+    r = client.post('/kv/', params={'key': 'new'}, data='value')
+    assert r.json()['KV'] == {'new': 'value'}
+    assert len(kv_dump()) == 1002
+    assert kv_dump('THINGS')['new'] == 'value'
+    with pytest.raises(ValueError, match='KV namespace "OTHER" not bound to the worker, bindings: THINGS'):
+        kv_dump('OTHER')
+
+
+def test_kv_rolled_back(request, client: TestClient):
+    if not request.config.getoption('--cf-emulator'):
+        pytest.skip('KV fixtures require the emulator')
+    assert request.getfixturevalue('kv_dump')() == {}
+
+
+def test_no_cacheprovider(pytester):
+    pytester.makepyfile('def test_ok():\n    pass\n')
+    result = pytester.runpytest('-p', 'pytest_cloudflare_worker.plugin', '-p', 'no:cacheprovider')
+    result.assert_outcomes(passed=1)
+
+
+def test_build_cache_rootdir(pytester, mocker):
+    """
+    The wrangler dir is pytest's rootdir, so pytest's cache, where the build cache is stored, is inside it.
+    """
+    pytester.makefile('.toml', wrangler='name = "testing"\ntype = "webpack"\n')
+    pytester.makepyfile(
+        'def test_deploy(session_client):\n    assert session_client.preview_id\n',
+        test_other='def test_other():\n    pass\n',
+    )
+
+    def wrangler_build(*args, **kwargs):
+        (pytester.path / 'dist').mkdir(exist_ok=True)
+        (pytester.path / 'dist' / 'worker.js').write_text('built')
+
+    run = mocker.patch('pytest_cloudflare_worker.main.subprocess.run', side_effect=wrangler_build)
+    args = '-p', 'pytest_cloudflare_worker.plugin', '--cf-emulator'
+    result = pytester.runpytest(*args)
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines(
+        ['cloudflare worker build cache: miss*', 'cloudflare worker build cache: 0 hits, 1 misses*']
+    )
+    assert run.call_count == 1
+
+    result = pytester.runpytest(*args)
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines(
+        ['cloudflare worker build cache: hit*', 'cloudflare worker build cache: 1 hits, 0 misses*']
+    )
+    assert run.call_count == 1
+
+
+background_deploy_tests = """
+def test_worker(session_client):
+    assert session_client.preview_id == 'fake'
+
+
+def test_other():
+    pass
+"""
+
+
+@pytest.mark.parametrize(
+    'args,deploys,passed',
+    [
+        ((), 1, 2),
+        (('-k', 'other'), 0, 1),
+        (('-k', 'worker'), 1, 1),
+        (('--deselect', 'test_background.py::test_worker'), 0, 1),
+    ],
+)
+def test_background_deploy_selection(pytester, monkeypatch, args, deploys, passed):
+    calls = []
+
+    def setup_session_client(config, *args):
+        calls.append(1)
+        return SimpleNamespace(preview_id='fake', stats=ClientStats(), close=lambda: None)
+
+    monkeypatch.setattr(plugin, 'setup_session_client', setup_session_client)
+    pytester.makepyfile(test_background=background_deploy_tests)
+    result = pytester.runpytest('-p', 'pytest_cloudflare_worker.plugin', *args)
+    result.assert_outcomes(passed=passed)
+    assert len(calls) == deploys
+
+
+def test_background_deploy_unused(pytester, monkeypatch):
+    """
+    A deploy started for tests deselected by another plugin doesn't delay the end of the run.
+    """
+    finish = Event()
+    closed = Event()
+
+    def setup_session_client(config, *args):
+        finish.wait(10)
+        return SimpleNamespace(close=closed.set)
+
+    monkeypatch.setattr(plugin, 'setup_session_client', setup_session_client)
+    pytester.makeconftest(
+        'def pytest_collection_modifyitems(config, items):\n'
+        '    items[:] = [item for item in items if "session_client" not in item.fixturenames]\n'
+    )
+    pytester.makepyfile(test_background=background_deploy_tests)
+    start = perf_counter()
+    result = pytester.runpytest('-p', 'pytest_cloudflare_worker.plugin')
+    result.assert_outcomes(passed=1)
+    assert perf_counter() - start < 5
+    finish.set()
+    assert closed.wait(5)
+
+
+@pytest.fixture(name='worker_project')
+def _fix_worker_project(pytester, wrangler_dir: Path):
+    for name in 'wrangler.toml', 'index.js':
+        (pytester.path / name).write_bytes((wrangler_dir / name).read_bytes())
+    return pytester
+
+
+def test_perf_summary(worker_project):
+    worker_project.makepyfile(
+        test_perf=(
+            'def test_client(client):\n'
+            '    assert client.get("/").status_code == 200\n'
+            '\n'
+            '\n'
+            'def test_other():\n'
+            '    pass\n'
+        )
+    )
+    result = worker_project.runpytest(
+        '-p', 'pytest_cloudflare_worker.plugin', '--cf-emulator', '--cf-durations', '0', '--cf-perf-json', 'perf.json'
+    )
+    result.assert_outcomes(passed=2)
+    result.stdout.fnmatch_lines(
+        [
+            '*cloudflare worker slowest tests*',
+            '*s test_perf.py::test_client',
+            '*(1 requests, max *ms*)',
+            'cloudflare worker performance report written to perf.json',
+        ]
+    )
+    tests = json.loads((worker_project.path / 'perf.json').read_text())['tests']
+    assert [t['nodeid'] for t in tests] == ['test_perf.py::test_client']
+    assert tests[0]['requests'] == 1
+
+    result = worker_project.runpytest('-p', 'pytest_cloudflare_worker.plugin', '--cf-durations', '3', '-k', 'other')
+    result.assert_outcomes(passed=1)
+    result.stdout.fnmatch_lines(['*cloudflare worker slowest 3 tests*', '(no tests used a test client)'])
+
+    result = worker_project.runpytest('-p', 'pytest_cloudflare_worker.plugin', '-k', 'other')
+    assert 'slowest' not in result.stdout.str()
+
+
+profile_tests = """
+def test_client(client, request, pytestconfig):
+    client.get('/')
+    assert ('cf_profile' in request.fixturenames) == pytestconfig.getoption('--cf-profile')
+
+
+def test_other(request):
+    assert 'cf_profile' not in request.fixturenames
+"""
+
+
+@pytest.mark.parametrize('profile', [True, False])
+def test_profile_collection(worker_project, profile: bool):
+    worker_project.makepyfile(test_profile=profile_tests)
+    args = ['-p', 'pytest_cloudflare_worker.plugin', '--cf-emulator', '--cf-profile-dir', 'profiles']
+    result = worker_project.runpytest(*args, *(['--cf-profile'] if profile else []))
+    result.assert_outcomes(passed=2)
+    profiles_dir = worker_project.path / 'profiles'
+    if profile:
+        assert [p.name for p in profiles_dir.iterdir()] == ['test_profile.py_test_client.cpuprofile']
+        result.stdout.fnmatch_lines(['*cloudflare worker hottest functions*', 'profiles written to profiles'])
+    else:
+        assert not profiles_dir.exists()
+        assert 'hottest functions' not in result.stdout.str()
+
+
+@pytest.mark.parametrize(
+    'wrangler_toml,args,header',
+    [
+        ('name = "testing"\ntype = "webpack"\n', (), True),
+        ('name = "testing"\ntype = "webpack"\n', ('--cf-no-build-cache',), False),
+        ('name = "testing"\ntype = "javascript"\n', (), False),
+        (None, (), False),
+    ],
+)
+def test_report_header(pytester, wrangler_toml, args, header: bool):
+    if wrangler_toml is not None:
+        pytester.makefile('.toml', wrangler=wrangler_toml)
+    pytester.makepyfile('def test_ok():\n    pass\n')
+    result = pytester.runpytest('-p', 'pytest_cloudflare_worker.plugin', *args)
+    result.assert_outcomes(passed=1)
+    if header:
+        result.stdout.fnmatch_lines(['cloudflare worker build cache: miss, running "wrangler build" (fingerprint *)'])
+        # the header doesn't build, so the cache is never hit
+        result = pytester.runpytest('-p', 'pytest_cloudflare_worker.plugin', *args)
+        result.stdout.fnmatch_lines(['cloudflare worker build cache: miss*'])
+    else:
+        assert 'cloudflare worker build cache' not in result.stdout.str()
+
+
+watch_tests = """
+from pathlib import Path
+
+clients = []
+
+
+def test_worker(session_client):
+    clients.append(session_client)
+    # session fixtures aren't torn down between runs
+    assert all(c is session_client for c in clients)
+    assert session_client.get('/').status_code == 200
+
+
+def test_fixed():
+    assert Path('fixed').exists()
+
+
+def test_other():
+    pass
+"""
+
+
+def test_watch(worker_project, monkeypatch):
+    """
+    Run with --cf-watch: a failed redeploy reruns just the failed tests, a successful one also the worker's tests.
+    """
+    deploys = []
+
+    def timed_deploy(client, deploy_):
+        deploys.append(client)
+        if len(deploys) == 2:
+            raise RuntimeError('syntax error')
+        plugin_timed_deploy(client, deploy_)
+
+    plugin_timed_deploy = plugin.timed_deploy
+    monkeypatch.setattr(plugin, 'timed_deploy', timed_deploy)
+
+    def fix():
+        (worker_project.path / 'fixed').touch()
+        return True
+
+    def interrupt():
+        raise KeyboardInterrupt
+
+    waits = iter([lambda: True, fix, interrupt])
+    monkeypatch.setattr('pytest_cloudflare_worker.watch.SourceWatcher.wait', lambda self, timeout=None: next(waits)())
+    worker_project.makepyfile(test_watch=watch_tests)
+    result = worker_project.runpytest('-p', 'pytest_cloudflare_worker.plugin', '--cf-emulator', '--cf-watch')
+    # run 1: all three tests, run 2 after the failed redeploy: test_fixed, run 3: test_worker and test_fixed
+    result.assert_outcomes(passed=4, failed=2)
+    result.stdout.fnmatch_lines(
+        [
+            '*1 failed, watching for changes in *',
+            '*redeploying the worker failed: RuntimeError(?syntax error?)*',
+            '*1 failed, watching for changes in *',
+            '*0 failed, watching for changes in *',
+        ]
+    )
+    # the first deploy, then the two redeploys
+    assert len(deploys) == 3
+    assert result.ret == 0
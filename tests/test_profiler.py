@@ -0,0 +1,68 @@
+import json
+from pathlib import Path
+
+from pytest_cloudflare_worker.profiler import ProfileStats, self_times, write_profile
+
+
+def frame(name: str, line: int = 0, url: str = 'worker.js'):
+    return {'functionName': name, 'scriptId': '1', 'url': url, 'lineNumber': line, 'columnNumber': 0}
+
+
+profile = {
+    'nodes': [
+        {'id': 1, 'callFrame': frame('(root)', -1, ''), 'children': [2, 3]},
+        {'id': 2, 'callFrame': frame('handleRequest', 4), 'children': [4]},
+        {'id': 3, 'callFrame': frame('(idle)', -1, '')},
+        {'id': 4, 'callFrame': frame('', 20)},
+    ],
+    'startTime': 1000,
+    'endTime': 10000,
+    'samples': [3, 2, 4, 2, 3],
+    'timeDeltas': [0, 1000, 2000, 500, 1500],
+}
+
+
+def test_self_times():
+    assert self_times(profile) == {
+        ('handleRequest', 'worker.js', 5): 0.0035,
+        ('(anonymous)', 'worker.js', 21): 0.0005,
+    }
+
+
+def test_self_times_empty():
+    assert self_times({'nodes': [], 'startTime': 0, 'endTime': 0}) == {}
+
+
+def test_write_profile(tmp_path: Path):
+    path = write_profile(tmp_path / 'profiles', 'tests/test_foo.py::test_bar[a b]', profile)
+    assert path == tmp_path / 'profiles' / 'tests_test_foo.py_test_bar_a_b.cpuprofile'
+    assert json.loads(path.read_text()) == profile
+
+
+def test_profile_stats():
+    stats = ProfileStats()
+    assert stats.summary() == ['0 profiles, 0.0ms of CPU time in the worker']
+    stats.add(profile)
+    stats.add(profile)
+    assert stats.hottest(1) == [(('handleRequest', 'worker.js', 5), 0.007)]
+    assert stats.summary() == [
+        '2 profiles, 8.0ms of CPU time in the worker',
+        '      7.00ms  87.5%  handleRequest (worker.js:5)',
+        '      1.00ms  12.5%  (anonymous) (worker.js:21)',
+    ]
+
+
+def test_emulator_profile(emulator_client):
+    client = emulator_client()
+    client._wait_inspect_ready()
+    client._inspector.call('Profiler.start')
+    for _ in range(3):
+        assert client.get('/').status_code == 200
+    result = client._inspector.call('Profiler.stop')
+
+    p = result['profile']
+    assert p['samples'] == [3, 2] * 3
+    assert p['endTime'] >= p['startTime'] + sum(p['timeDeltas'])
+    times = self_times(p)
+    assert list(times) == [('worker', 'worker.js', 15)]
+    assert times[('worker', 'worker.js', 15)] > 0
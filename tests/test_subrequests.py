@@ -0,0 +1,127 @@
+import pytest
+
+from pytest_cloudflare_worker.emulator import Emulator
+from pytest_cloudflare_worker.subrequests import SubrequestLog
+
+
+def network_events(request_id: str, url: str, start: float, end: float, *, status: int = 200, timing=None):
+    response = {'url': url, 'status': status, 'headers': {'content-type': 'text/plain'}}
+    if timing:
+        response['timing'] = timing
+    return [
+        {
+            'method': 'Network.requestWillBeSent',
+            'params': {
+                'requestId': request_id,
+                'request': {'url': url, 'method': 'GET', 'headers': {}},
+                'timestamp': start,
+                'initiator': {'type': 'script', 'lineNumber': 10},
+            },
+        },
+        {
+            'method': 'Network.responseReceived',
+            'params': {'requestId': request_id, 'timestamp': (start + end) / 2, 'response': response},
+        },
+        {
+            'method': 'Network.dataReceived',
+            'params': {'requestId': request_id, 'timestamp': end, 'dataLength': 100, 'encodedDataLength': 60},
+        },
+        {
+            'method': 'Network.dataReceived',
+            'params': {'requestId': request_id, 'timestamp': end, 'dataLength': 50, 'encodedDataLength': 30},
+        },
+        {'method': 'Network.loadingFinished', 'params': {'requestId': request_id, 'timestamp': end}},
+    ]
+
+
+timing = {
+    'requestTime': 100.0,
+    'dnsStart': 0.5,
+    'dnsEnd': 2.5,
+    'connectStart': 2.5,
+    'connectEnd': 12.5,
+    'sslStart': 4.5,
+    'sslEnd': 12.5,
+    'sendStart': 13,
+    'sendEnd': 14,
+    'receiveHeadersEnd': 54,
+}
+
+
+def test_subrequest_log():
+    log = SubrequestLog()
+    for event in network_events('1', 'https://a.com/', 100, 100.1, timing=timing):
+        log.on_event(event)
+    for event in network_events('2', 'https://b.com/', 100.05, 100.08, status=404)[:3]:
+        log.on_event(event)
+
+    assert len(log) == 2
+    a, b = log
+    assert a.request_id == '1'
+    assert (a.method, a.url, a.status) == ('GET', 'https://a.com/', 200)
+    assert a.duration == pytest.approx(0.1)
+    assert a.dns == pytest.approx(0.002)
+    assert a.connect == pytest.approx(0.01)
+    assert a.ssl == pytest.approx(0.008)
+    assert a.ttfb == pytest.approx(0.04)
+    assert (a.bytes_received, a.encoded_bytes_received) == (150, 90)
+    assert repr(a) == '<Subrequest GET https://a.com/ 200 100.0ms>'
+
+    assert b.status == 404
+    assert b.dns is None
+    assert b.ttfb == pytest.approx(0.015)
+    assert not b.finished
+    assert not log.wait(timeout=0)
+    assert log.max_concurrency() == 2
+    assert log.waterfall(10) == (
+        '|==========| GET https://a.com/ 200 100.0ms\n' '|     -----| GET https://b.com/ 404 pending'
+    )
+
+    log.on_event({'method': 'Network.loadingFailed', 'params': {'requestId': '2', 'timestamp': 100.2}})
+    assert b.error == 'failed'
+    assert log.wait(2, timeout=0)
+    assert log[1] is b
+    log.on_event({'method': 'Network.loadingFinished', 'params': {'requestId': 'unknown', 'timestamp': 100.2}})
+    assert len(log) == 2
+
+
+def test_subrequest_assertions():
+    log = SubrequestLog()
+    log.assert_max_fan_out(0, wait_time=0)
+    assert log.waterfall() == '(no subrequests)'
+    for i, (start, end) in enumerate([(1, 1.2), (1.1, 1.3), (1.3, 1.5), (1.3, 2)]):
+        for event in network_events(str(i), f'https://example.com/{i}', start, end):
+            log.on_event(event)
+
+    log.assert_max_fan_out(4, wait_time=0)
+    with pytest.raises(AssertionError, match=r'4 subrequests made, expected at most 3\n\|='):
+        log.assert_max_fan_out(3, wait_time=0)
+
+    assert log.max_concurrency() == 2
+    log.assert_max_concurrency(2, wait_time=0)
+    with pytest.raises(AssertionError, match='2 concurrent subrequests, expected at most 1'):
+        log.assert_max_concurrency(1, wait_time=0)
+
+    log.assert_max_duration(0.75, wait_time=0)
+    with pytest.raises(AssertionError, match='1 subrequests took longer than 500ms: https://example.com/3'):
+        log.assert_max_duration(0.5, wait_time=0)
+
+
+def test_client_subrequests(emulator: Emulator, emulator_client):
+    client = emulator_client(emulator=emulator)
+    assert client.get('/').status_code == 200
+    for event in network_events('1', 'https://a.com/', 100, 100.1):
+        emulator.emit(client._session_id, event)
+    assert client.subrequests.wait(1)
+    assert client._inspector.subrequests is client.subrequests
+    client.subrequests.assert_max_fan_out(1)
+    assert client.subrequests[0].url == 'https://a.com/'
+    # requestWillBeSent and responseReceived are still logged
+    assert client.inspect_log_wait(3) == [
+        'LOG worker.js:7> "handling request:", "GET", "/"',
+        'INFO <unknown>:11> request GET https://a.com/',
+        'INFO <unknown>:0> response 200',
+    ]
+
+    client.new_cf_session()
+    assert len(client.subrequests) == 0
@@ -0,0 +1,138 @@
+from email.parser import BytesParser
+from email.policy import HTTP
+from io import BytesIO
+from pathlib import Path
+from time import sleep
+
+import pytest
+from requests import Response
+
+from pytest_cloudflare_worker import TestClient, WorkerError
+from pytest_cloudflare_worker.emulator import WorkerResponse, echo_worker
+from pytest_cloudflare_worker.transport import MultipartUpload, RetryPolicy
+
+
+def streaming_worker(request, env, console):
+    if request.pathname == '/stream/':
+
+        def body():
+            for i in range(3):
+                sleep(0.05)
+                yield f'chunk {i}\n'.encode()
+
+        return WorkerResponse(body(), headers={'content-type': 'text/plain'})
+    elif request.pathname == '/big/':
+        return WorkerResponse(b'x' * 10_000)
+    elif request.pathname == '/error/':
+        console.error('broken', line=3)
+        return WorkerResponse(b'x' * 100_000, status=500)
+    return echo_worker(request, env, console)
+
+
+@pytest.fixture(name='client')
+def _fix_client(emulator_client):
+    return emulator_client(streaming_worker)
+
+
+def test_multipart_upload(tmp_path: Path):
+    path = tmp_path / 'index.js'
+    path.write_bytes(b'x' * 1000)
+    upload = MultipartUpload(
+        [('metadata', 'metadata.json', 'application/json', '{}'), ('index', 'index.js', 'a/b', path)]
+    )
+    body = b''.join(upload)
+    assert len(upload) == len(body)
+    chunks = list(MultipartUpload([('f', 'f', 'a/b', path)], chunk_size=100))
+    assert chunks[1:-2] == [b'x' * 100] * 10
+
+    msg = BytesParser(policy=HTTP).parsebytes(f'content-type: {upload.content_type}\r\n\r\n'.encode() + body)
+    parts = {p.get_param('name', header='content-disposition'): p.get_payload(decode=True) for p in msg.iter_parts()}
+    assert parts == {'metadata': b'{}', 'index': b'x' * 1000}
+
+
+def test_streamed_request_body(client: TestClient, tmp_path: Path):
+    r = client.post('/gen/', data=(f'part {i},'.encode() for i in range(3)))
+    assert r.json()['body'] == 'part 0,part 1,part 2,'
+    assert r.json()['headers']['transfer-encoding'] == 'chunked'
+
+    path = tmp_path / 'upload.txt'
+    path.write_text('file contents')
+    with path.open('rb') as f:
+        r = client.post('/file/', data=f)
+    assert r.json()['body'] == 'file contents'
+
+
+def test_streamed_response(client: TestClient):
+    r = client.get('/stream/', stream=True)
+    assert r.status_code == 200
+    ttfb = r.timing.ttfb
+    assert r.timing.total == ttfb
+    assert list(r.iter_lines()) == [b'chunk 0', b'chunk 1', b'chunk 2']
+    assert r.timing.total >= ttfb + 0.1
+    assert 'total=' in repr(r.timing)
+
+
+def test_timing(client: TestClient):
+    r = client.get('/first/')
+    assert r.status_code == 200
+    timing = r.timing
+    assert timing.connect is not None
+    assert 0 < timing.connect < timing.ttfb <= timing.total
+
+    r = client.get('/second/')
+    assert r.timing.connect is None
+    assert 'connect=reused' in repr(r.timing)
+
+
+def test_stream_worker_error(client: TestClient):
+    client.inspect_enabled = True
+    with pytest.raises(WorkerError, match='broken'):
+        client.get('/error/', stream=True)
+    # the connection was released so the pool still works
+    with client.get('/ok/', stream=True) as r:
+        assert r.status_code == 200
+
+
+def test_connection_stats(client: TestClient):
+    assert client.get('/big/', data=b'y' * 5000).content == b'x' * 10_000
+    assert client.get('/second/').status_code == 200
+    assert client.stats.connections == 1
+    assert client.stats.reused_connections == 1
+    assert client.stats.tls_handshakes == 0
+    assert 5000 < client.stats.bytes_sent < 6000
+    assert 10_000 < client.stats.bytes_received < 11_000
+
+
+def test_warmup(emulator_client):
+    client = emulator_client(streaming_worker, pool_size=2)
+    client.inspect_enabled = False
+    assert client.warmup(5) == 2
+    assert client.warmup(2) == 0
+    assert client.stats.connections == 2
+    r = client.get('/ok/')
+    assert r.status_code == 200
+    assert r.timing.connect is None
+    assert client.stats.connections == 2
+    assert client.stats.reused_connections == 1
+
+
+def response(status: int, **headers: str) -> Response:
+    r = Response()
+    r.status_code = status
+    r.headers.update(headers)
+    r.raw = BytesIO()
+    return r
+
+
+def test_retry_policy(mocker):
+    sleep = mocker.patch('pytest_cloudflare_worker.transport.sleep')
+    responses = iter([response(503), response(429, **{'retry-after': '3'}), response(200)])
+    assert RetryPolicy(backoff=0.1).send(lambda: next(responses)).status_code == 200
+    assert [c.args for c in sleep.call_args_list] == [(0.1,), (3.0,)]
+
+    responses = iter([response(500), response(502), response(400)])
+    assert RetryPolicy(backoff=0.1).send(lambda: next(responses)).status_code == 400
+
+    responses = iter([response(500), response(502)])
+    assert RetryPolicy(1).send(lambda: next(responses)).status_code == 502
+    assert RetryPolicy(max_backoff=1).delay(5, response(429, **{'retry-after': '60'})) == 1
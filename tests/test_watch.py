@@ -0,0 +1,47 @@
+from pathlib import Path
+from threading import Timer
+
+import pytest
+
+from pytest_cloudflare_worker.cache import input_files
+from pytest_cloudflare_worker.watch import SourceWatcher
+
+
+@pytest.fixture(name='worker_dir')
+def _fix_worker_dir(tmp_path: Path) -> Path:
+    (tmp_path / 'wrangler.toml').write_text('name = "test"\n')
+    (tmp_path / 'src').mkdir()
+    (tmp_path / 'src' / 'index.js').write_text('console.log(1)\n')
+    (tmp_path / 'dist').mkdir()
+    (tmp_path / 'dist' / 'worker.js').write_text('built\n')
+    return tmp_path
+
+
+def test_input_files(worker_dir: Path):
+    assert input_files(worker_dir, ['*'], ['dist/*']) == [worker_dir / 'wrangler.toml', worker_dir / 'src' / 'index.js']
+    assert input_files(worker_dir, ['*.js'], []) == [worker_dir / 'dist' / 'worker.js', worker_dir / 'src' / 'index.js']
+
+
+@pytest.mark.parametrize('inotify', [True, False])
+def test_wait_changed(worker_dir: Path, inotify: bool):
+    watcher = SourceWatcher([worker_dir], poll_interval=0.01)
+    if not inotify:
+        watcher.inotify = False
+    source_hash = watcher.hash
+    Timer(0.05, (worker_dir / 'src' / 'index.js').write_text, ('console.log(2)\n',)).start()
+    assert watcher.wait(5) is True
+    assert watcher.hash != source_hash
+    assert watcher.wait(0.01) is False
+
+
+@pytest.mark.parametrize('inotify', [True, False])
+def test_wait_unchanged(worker_dir: Path, inotify: bool):
+    watcher = SourceWatcher([worker_dir], poll_interval=0.01)
+    if not inotify:
+        watcher.inotify = False
+    # build output is excluded and rewriting a file with the same content isn't a change
+    (worker_dir / 'dist' / 'worker.js').write_text('rebuilt\n')
+    (worker_dir / 'wrangler.toml').write_text('name = "test"\n')
+    assert watcher.wait(0.1) is False
+    (worker_dir / 'src' / 'new.js').write_text('')
+    assert watcher.wait(0.1) is True